@@ -10,6 +10,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'your_project.settings')
 django_asgi_app = get_asgi_application()
 
 from devices import routing
+from devices.discovery import DISCOVERY_ENABLED, discovery
+
+# مستمع اكتشاف الأجهزة على الشبكة المحلية (مرة واحدة لكل عملية، فقط إذا فُعّل في الإعدادات)
+if DISCOVERY_ENABLED:
+    discovery.start_in_background()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 ASGI_APPLICATION = 'BasKy.asgi.application'
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -162,4 +163,105 @@ LOGGING = {
             'level': 'INFO',
         },
     },
-}
\ No newline at end of file
+}
+# ==============================================
+# Basky Device Settings
+# ==============================================
+
+# Channel layer و cache مشتركين بين الـ workers (Redis في الإنتاج)
+# بدون REDIS_URL: InMemoryChannelLayer و LocMemCache (عملية واحدة فقط)
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        },
+    }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# مدة صلاحية بيانات اتصال الجهاز في الـ cache، وأقل فترة بين تحديثاتها
+BASKY_PRESENCE_TTL = 120
+BASKY_PRESENCE_REFRESH = 15
+# أقصى مدة (ثواني) قبل كتابة تكرارات نفس حالة الجهاز في DeviceStatus
+BASKY_STATUS_FLUSH_INTERVAL = 30
+# أقصى مدة (ثواني) قبل حفظ تغير أوقات آخر حالة الجهاز فقط في DeviceLatestState،
+# ومدة بقاء الحالة في الـ cache (أطول من فترة الحفظ) قبل إعادة قراءتها من الصف
+BASKY_STATE_PERSIST_INTERVAL = 60
+BASKY_STATE_CACHE_TTL = 300
+# مهلة انتظار تأكيد الأوامر من الجهاز (ثواني)، وحد تسجيل الجهاز البطيء (ms)
+BASKY_COMMAND_TIMEOUT = 5
+BASKY_SLOW_COMMAND_MS = 1000
+# أقصى مهلة يمكن طلبها لأمر واحد (ثواني)
+BASKY_MAX_COMMAND_TIMEOUT = 30
+# API الأوامر الجماعية: أقصى عدد أجهزة في الطلب وأقصى أوامر متزامنة
+BASKY_BULK_MAX_DEVICES = 100
+BASKY_BULK_CONCURRENCY = 20
+# Heartbeat: ping للجهاز الخامل كل BASKY_HEARTBEAT_INTERVAL ثانية (± jitter)،
+# وطرده بعد BASKY_HEARTBEAT_MISSES فترات بدون أي رسالة منه
+BASKY_HEARTBEAT_INTERVAL = 20
+BASKY_HEARTBEAT_JITTER = 0.2
+BASKY_HEARTBEAT_MISSES = 3
+BASKY_HEARTBEAT_TICK = 1.0
+# فحص الوصول للأجهزة: مهلة المنفذ (ثواني)، مدة الـ cache، أقصى فحوص متزامنة،
+# والمنافذ التي تُفحص بعد منفذ الـ WebSocket الخاص بالجهاز
+BASKY_PROBE_TIMEOUT = 2.0
+BASKY_PROBE_CACHE_TTL = 10
+BASKY_PROBE_CONCURRENCY = 50
+BASKY_PROBE_PORTS = (80,)
+# اكتشاف الأجهزة: منفذ UDP لرسائل الإعلان، عنوان الاستماع، ومدة بقاء الجهاز
+# في الجدول بعد آخر إعلان (ثواني)؛ و IP السيرفر يُعاد حسابه كل BASKY_SERVER_IP_TTL
+BASKY_DISCOVERY_PORT = 4210
+BASKY_DISCOVERY_HOST = '0.0.0.0'
+BASKY_DISCOVERY_TTL = 30
+# تشغيل مستمع الاكتشاف مع تطبيق ASGI (BASKY_DISCOVERY_ENABLED=1 في البيئة)، وأقل فترة
+# بين نشر جدول الأجهزة في الـ cache. مع أكثر من worker يجب ضبط REDIS_URL: worker واحد
+# فقط يستمع على المنفذ، و LocMemCache لا يراه إلا هذا الـ worker
+BASKY_DISCOVERY_ENABLED = os.environ.get('BASKY_DISCOVERY_ENABLED') == '1'
+BASKY_DISCOVERY_PUBLISH_INTERVAL = 1.0
+BASKY_SERVER_IP_TTL = 300
+
+# تجميع قراءات السنسورات قبل الكتابة (bulk_create)
+BASKY_INGEST_BATCH_SIZE = 50      # عدد الإطارات في الدفعة
+BASKY_INGEST_MAX_AGE = 1.0        # أقصى عمر للدفعة بالثواني
+BASKY_MAX_BATCH_SAMPLES = 200     # أقصى عدد عينات في رسالة sensor_batch
+BASKY_INGEST_QUEUE_SIZE = 1000    # أقصى عدد دفعات في طابور الكتابة
+BASKY_INGEST_OVERFLOW = 'block'   # عند امتلاء الطابور: block, drop_oldest, coalesce
+
+# بث العينات للـ Dashboard: أقصى معدل للجهاز، والمعدل الافتراضي لكل مشاهد
+BASKY_DASHBOARD_MAX_FPS = 30
+BASKY_DASHBOARD_DEFAULT_FPS = 10
+
+# مكتبة JSON لرسائل الـ WebSocket: None (orjson إن وجد) أو 'json'
+BASKY_JSON_CODEC = None
+
+# ضغط القراءات القديمة إلى SensorChunk: طول النافذة وأقصى عدد عينات
+BASKY_CHUNK_SECONDS = 60
+BASKY_CHUNK_MAX_SAMPLES = 6000
+
+# API القراءات: حجم الصفحة الافتراضي والأقصى
+BASKY_READINGS_PAGE_SIZE = 20
+BASKY_READINGS_MAX_PAGE_SIZE = 1000
+
+# سياسات الاحتفاظ بالبيانات (manage.py apply_retention)
+BASKY_RETENTION = {
+    'sensor_readings': {'days': 7, 'archive': True},   # تُضغط إلى SensorChunk ثم تُحذف
+    'sensor_chunks': {'days': 365},
+    'sensor_rollups_1s': {'days': 7},
+    'sensor_rollups_60s': {'days': 365},
+    'device_status': {'days': 30},
+}
+BASKY_RETENTION_BATCH_SIZE = 2000     # عدد الصفوف في كل transaction
+BASKY_RETENTION_BATCH_PAUSE = 0.05    # فاصل بين الدفعات بالثواني
@@ -0,0 +1,117 @@
+# ==============================================
+# codec.py - ترميز وفك ترميز رسائل الـ WebSocket (JSON)
+# ==============================================
+#
+# يستخدم orjson إذا كان مثبتاً وإلا مكتبة json القياسية.
+# يمكن فرض مكتبة معينة من الإعدادات: BASKY_JSON_CODEC = 'orjson' أو 'json'
+
+import json
+import time
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# orjson.JSONDecodeError يرث من json.JSONDecodeError
+DecodeError = json.JSONDecodeError
+
+# الرسائل الثابتة (type + timestamp فقط)
+STATIC_MESSAGES = ('ping', 'calibrate', 'stop_session', 'get_network_info', 'reset_wifi')
+
+
+class JsonCodec:
+    """مكتبة json القياسية"""
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson (أسرع بكثير في الترميز وفك الترميز)"""
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_codec(name=None):
+    """اختيار الـ codec: orjson إذا كان متاحاً، أو json"""
+    if name == 'json' or orjson is None:
+        return JsonCodec()
+    return OrjsonCodec()
+
+
+codec = get_codec(getattr(settings, 'BASKY_JSON_CODEC', None))
+dumps = codec.dumps
+loads = codec.loads
+
+
+# ==============================================
+# Timestamps
+# ==============================================
+
+_cached_second = None
+_cached_prefix = ''
+
+
+def now_iso():
+    """
+    الوقت الحالي بصيغة ISO (مثل datetime.now().isoformat())
+    الجزء حتى الثواني يُحسب مرة واحدة كل ثانية
+    """
+    global _cached_second, _cached_prefix
+    now = time.time()
+    second = int(now)
+    if second != _cached_second:
+        _cached_prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(second))
+        _cached_second = second
+    return f'{_cached_prefix}.{int((now - second) * 1_000_000):06d}'
+
+
+# ==============================================
+# Messages
+# ==============================================
+
+_envelopes = {}
+
+
+def envelope(message_type, command_id=None):
+    """
+    رسالة ثابتة {"type": ..., "id": ..., "timestamp": ...} من بادئة مُرمّزة مسبقاً
+    (الـ id اختياري ويُضاف بعد البادئة، بنفس ترتيب message)
+    """
+    prefix = _envelopes.get(message_type)
+    if prefix is None:
+        prefix = _envelopes[message_type] = '{"type":%s,' % dumps(message_type)
+    if command_id is None:
+        return f'{prefix}"timestamp":"{now_iso()}"}}'
+    return f'{prefix}"id":{dumps(command_id)},"timestamp":"{now_iso()}"}}'
+
+
+def message(message_type, **fields):
+    """ترميز رسالة مع type و timestamp"""
+    fields['timestamp'] = now_iso()
+    return dumps({'type': message_type, **fields})
+
+
+def command(message_type, command_id=None, **fields):
+    """ترميز أمر للجهاز مع correlation id (بدون حقول: من البادئة المُرمّزة مسبقاً)"""
+    if not fields:
+        return envelope(message_type, command_id)
+    if command_id is None:
+        return message(message_type, **fields)
+    return message(message_type, id=command_id, **fields)
+
+
+for _message_type in STATIC_MESSAGES:
+    envelope(_message_type)
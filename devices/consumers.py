@@ -2,56 +2,182 @@
 # 1. consumers.py - WebSocket Consumer
 # ==============================================
 
-import json
 import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from datetime import datetime
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
 import logging
+import os
+import socket
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from . import codec
+from .heartbeat import heartbeat
+from .models import SENSOR_FIELDS
+from .ingest import (
+    MAX_BATCH_SAMPLES, SensorBuffer, build_sensor_reading, make_sensor_reading,
+    run_in_background, sample_timestamps, sensor_values,
+)
+from .protocol import (
+    FORMAT_BINARY, FORMAT_JSON, FRAME_VERSION, SUPPORTED_FORMATS,
+    FrameError, SensorBatch, decode_frame,
+)
+from .registry import PRESENCE_REFRESH, dashboard_group, device_group, device_registry
+from .state import device_state
 
 logger = logging.getLogger(__name__)
 
+# أقصى معدل بث لعينات الجهاز للـ Dashboard، والمعدل الافتراضي لكل مشاهد
+DASHBOARD_MAX_FPS = getattr(settings, 'BASKY_DASHBOARD_MAX_FPS', 30)
+DASHBOARD_DEFAULT_FPS = getattr(settings, 'BASKY_DASHBOARD_DEFAULT_FPS', 10)
+# أقصى مدة قبل كتابة تكرارات نفس الحالة (last_seen/repeat_count) في DeviceStatus
+STATUS_FLUSH_INTERVAL = getattr(settings, 'BASKY_STATUS_FLUSH_INTERVAL', 30)
+# مهلة انتظار تأكيد الأمر من الجهاز، وحد التحذير من جهاز بطيء (ms)
+COMMAND_TIMEOUT = getattr(settings, 'BASKY_COMMAND_TIMEOUT', 5)
+SLOW_COMMAND_MS = getattr(settings, 'BASKY_SLOW_COMMAND_MS', 1000)
+# أقصى مهلة يمكن طلبها لأمر واحد (ثواني)
+MAX_COMMAND_TIMEOUT = getattr(settings, 'BASKY_MAX_COMMAND_TIMEOUT', 30)
+
+# الأوامر التي يرد عليها الجهاز: نوع الأمر -> نوع رسالة التأكيد
+ACK_TYPES = {
+    'start_session': 'session_ack',
+    'ping': 'pong',
+    'get_network_info': 'network_info',
+    'reset_wifi': 'wifi_reset_ack',
+}
+
+# id الـ ping الدوري من السيرفر (حتى لا يُطابق pong الخاص به أمر ping من الـ API)
+HEARTBEAT_ID = 'heartbeat'
+# كود إغلاق الاتصال الذي لم يرد على الـ heartbeat
+CLOSE_STALE = 4008
+
+
+def command_timeout(value=None):
+    """مهلة أمر كرقم موجب (بحد أقصى MAX_COMMAND_TIMEOUT)، و ValueError للقيمة غير الصالحة"""
+    if value is None:
+        return COMMAND_TIMEOUT
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid command timeout: {value!r}")
+    if not value > 0:
+        raise ValueError(f"Invalid command timeout: {value!r}")
+    return min(value, MAX_COMMAND_TIMEOUT)
+
 
 class BaskyDeviceConsumer(AsyncWebsocketConsumer):
     """
     WebSocket Consumer للتواصل مع جهاز ESP32
     """
     
-    # قاموس لتخزين جميع الأجهزة المتصلة
-    connected_devices = {}
+    # اسم هذا الـ worker (يظهر في بيانات الاتصال)
+    server_name = f"{socket.gethostname()}:{os.getpid()}"
     
     async def connect(self):
         """عند اتصال جهاز جديد"""
         self.device_id = None
         self.device_ip = None
+        self.sensor_buffer = None
+        # صيغة إطارات السنسورات لهذا الاتصال (json أو binary)
+        self.frame_format = FORMAT_JSON
+        self.last_sequence = None
+        self.frames_lost = 0
+        # بيانات الجلسة المستخدمة مع الإطارات الثنائية
+        self.frame_context = {'exercise': '', 'difficulty': '', 'mode': 'normal'}
+        self.session_started = None
+        # الجلسة النشطة (تُربط بها كل القراءات دون استعلام لكل إطار)
+        self.session_id = None
+        # صف DeviceStatus الحالي وتكراراته التي لم تُكتب بعد
+        self.status_row_id = None
+        self.status_key = None
+        self.status_repeats = 0
+        self.status_last_seen = None
+        self.status_flushed = 0
+        # الأوامر التي تنتظر تأكيد الجهاز: {id: (command, ack_type, reply_channel, sent_at, expires_at)}
+        self.pending_commands = {}
+        self.command_id = None
+        # آخر زمن ذهاب وعودة لكل نوع أمر (ms)
+        self.command_rtt = {}
+        # بيانات الاتصال المنشورة في الـ registry
+        self.presence = None
+        self.presence_published = 0
+        # آخر عينة لم تُبث بعد للـ Dashboard
+        self.dashboard_pending = None
+        self.dashboard_next = 0
+        self.dashboard_timer = None
         self.user = self.scope.get('user')
+        # آخر رسالة من الجهاز (monotonic، للـ heartbeat)
+        self.last_seen = time.monotonic()
+        # التنظيف تم (evict يستدعي disconnect، ثم تستدعيه Channels مرة أخرى)
+        self._cleaned_up = False
         
         # قبول الاتصال
         await self.accept()
+        heartbeat.add(self)
         
         logger.info(f"New WebSocket connection from {self.scope['client']}")
         
         # إرسال رسالة ترحيب
-        await self.send(text_data=json.dumps({
-            'type': 'connection_established',
-            'message': 'Welcome to Basky Server!',
-            'timestamp': datetime.now().isoformat(),
-            'server_version': '1.0.0'
-        }))
+        await self.send(text_data=codec.message(
+            'connection_established',
+            message='Welcome to Basky Server!',
+            server_version='1.0.0',
+            capabilities={
+                'formats': list(SUPPORTED_FORMATS),
+                'binary_frame_version': FRAME_VERSION,
+                'sensor_batch': True,
+                'max_batch_samples': MAX_BATCH_SAMPLES,
+            }
+        ))
     
     async def disconnect(self, close_code):
-        """عند قطع الاتصال"""
-        if self.device_id and self.device_id in self.connected_devices:
-            del self.connected_devices[self.device_id]
+        """عند قطع الاتصال (مرة واحدة فقط)"""
+        if self._cleaned_up:
+            return
+        self._cleaned_up = True
+        heartbeat.remove(self)
+        if self.dashboard_timer is not None:
+            self.dashboard_timer.cancel()
+        
+        # كتابة القراءات المتبقية في الـ buffer
+        if self.sensor_buffer is not None:
+            await self.sensor_buffer.flush()
+        
+        # كتابة تكرارات الحالة الأخيرة
+        try:
+            await self.flush_status_repeats()
+        except Exception as e:
+            logger.error(f"Error saving device status: {e}")
+        
+        # الأوامر التي لم يصل تأكيدها
+        for command_id, (_, _, reply_channel, _, _) in self.pending_commands.items():
+            if reply_channel:
+                await self.channel_layer.send(reply_channel, {
+                    'type': 'command.reply', 'id': command_id, 'status': 'offline'
+                })
+        self.pending_commands.clear()
+        
+        if self.device_id and self.presence is not None:
+            await self.unregister_device()
             logger.info(f"Device {self.device_id} disconnected")
             
             # إشعار المستخدمين بقطع الاتصال
             await self.notify_device_status('offline')
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """استقبال البيانات من الجهاز"""
+        self.last_seen = time.monotonic()
+        if bytes_data is not None:
+            await self.receive_binary(bytes_data)
+            return
+        
         try:
-            data = json.loads(text_data)
+            data = codec.loads(text_data)
             message_type = data.get('type', '')
             
             logger.debug(f"Received: {message_type}")
@@ -61,6 +187,8 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
                 await self.handle_status(data)
             elif message_type == 'sensor_data':
                 await self.handle_sensor_data(data)
+            elif message_type == 'sensor_batch':
+                await self.handle_sensor_batch(data)
             elif message_type == 'session_ack':
                 await self.handle_session_ack(data)
             elif message_type == 'network_info':
@@ -72,13 +200,34 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
             else:
                 logger.warning(f"Unknown message type: {message_type}")
         
-        except json.JSONDecodeError as e:
+        except codec.DecodeError as e:
             logger.error(f"JSON decode error: {e}")
             await self.send_error("Invalid JSON format")
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             await self.send_error(str(e))
     
+    async def receive_binary(self, bytes_data):
+        """استقبال إطار سنسورات ثنائي"""
+        if self.frame_format != FORMAT_BINARY:
+            await self.send_error("Binary frames not negotiated")
+            return
+        
+        try:
+            frame = decode_frame(bytes_data)
+        except FrameError as e:
+            logger.error(f"Binary frame error: {e}")
+            await self.send_error(str(e))
+            return
+        
+        if isinstance(frame, SensorBatch):
+            if len(frame.samples) > MAX_BATCH_SAMPLES:
+                await self.send_error(f"Batch too large (max {MAX_BATCH_SAMPLES} samples)")
+                return
+            await self.handle_sensor_samples(frame.sequence, frame.samples)
+        else:
+            await self.handle_sensor_samples(frame.sequence, [(frame.device_timestamp, frame.values)])
+    
     async def handle_status(self, data):
         """معالجة رسائل الحالة من الجهاز"""
         status = data.get('status', 'unknown')
@@ -89,16 +238,25 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
         
         # تسجيل الجهاز
         if status == 'connected':
-            self.device_id = data.get('device_id', f"device_{id(self)}")
-            self.connected_devices[self.device_id] = {
-                'consumer': self,
-                'status': status,
-                'mode': mode,
-                'connected_at': datetime.now().isoformat(),
-                'last_seen': datetime.now().isoformat()
-            }
+            await self.register_device(data.get('device_id', f"device_{id(self)}"), mode)
             
-            logger.info(f"Device registered: {self.device_id} (mode: {mode})")
+            # اختيار صيغة الإطارات لهذا الاتصال
+            await self.negotiate_format(data.get('format', FORMAT_JSON))
+        else:
+            await self.update_presence(force=True, status=status, mode=mode)
+        
+        self.frame_context['mode'] = mode
+        
+        # آخر حالة معروفة (cache + صف واحد للجهاز)
+        now = timezone.now()
+        await self.update_state(
+            status=status,
+            message=message,
+            mode=mode,
+            ip_address=self.scope['client'][0] if self.scope.get('client') else None,
+            status_at=now,
+            last_seen=now
+        )
         
         # حفظ في قاعدة البيانات
         await self.save_device_status(status, message, mode)
@@ -109,69 +267,160 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
     async def handle_sensor_data(self, data):
         """معالجة بيانات السنسورات"""
         try:
-            # استخراج البيانات
-            shoulder = data.get('shoulder', {})
-            elbow = data.get('elbow', {})
-            wrist = data.get('wrist', {})
-            hand = data.get('hand', {})
-            force = data.get('force', {})
-            
-            exercise = data.get('exercise', '')
-            difficulty = data.get('difficulty', '')
-            session_duration = data.get('session_duration', 0)
-            mode = data.get('mode', 'normal')
-            
             # تحديث آخر ظهور
-            if self.device_id in self.connected_devices:
-                self.connected_devices[self.device_id]['last_seen'] = datetime.now().isoformat()
+            await self.update_presence()
             
             # حفظ في قاعدة البيانات
-            await self.save_sensor_data({
-                'shoulder': shoulder,
-                'elbow': elbow,
-                'wrist': wrist,
-                'hand': hand,
-                'force': force,
-                'exercise': exercise,
-                'difficulty': difficulty,
-                'session_duration': session_duration,
-                'mode': mode,
-                'timestamp': data.get('timestamp', 0)
-            })
+            await self.save_sensor_data(data)
             
             # إرسال للـ Dashboard (إذا كان هناك مستخدمين متابعين)
-            await self.broadcast_to_dashboard(data)
+            await self.broadcast_to_dashboard(sensor_values(data), device_timestamp=data.get('timestamp'))
             
             # معالجة بالـ AI (اختياري)
             # await self.process_with_ai(data)
             
+        except ValueError as e:
+            # قيم غير صالحة: يُحذف هذا الإطار فقط
+            logger.warning(f"Invalid sensor data from {self.device_id}: {e}")
+            await self.send_error(str(e))
         except Exception as e:
             logger.error(f"Error handling sensor data: {e}")
     
+    async def handle_sensor_batch(self, data):
+        """
+        معالجة رسالة sensor_batch (عدة عينات في رسالة واحدة)
+        كل عينة: {"t": device_ms, "v": [13 قيمة]} أو بنفس شكل sensor_data مع "t"
+        """
+        samples = data.get('samples') or []
+        if len(samples) > MAX_BATCH_SAMPLES:
+            await self.send_error(f"Batch too large (max {MAX_BATCH_SAMPLES} samples)")
+            return
+        
+        context = {
+            'exercise': data.get('exercise', self.frame_context['exercise']),
+            'difficulty': data.get('difficulty', self.frame_context['difficulty']),
+            'mode': data.get('mode', self.frame_context['mode']),
+            'session_duration': data.get('session_duration'),
+        }
+        
+        await self.handle_sensor_samples(
+            data.get('sequence'),
+            [(sample.get('t', 0), sample['v'] if 'v' in sample else sensor_values(sample)) for sample in samples],
+            context
+        )
+    
+    async def handle_sensor_samples(self, sequence, samples, context=None):
+        """معالجة عينات سنسورات (إطار ثنائي أو sensor_batch) كعملية تخزين واحدة"""
+        try:
+            if not samples:
+                return
+            
+            # اكتشاف الإطارات المفقودة من الـ sequence
+            if sequence is not None:
+                if self.last_sequence is not None:
+                    gap = (sequence - self.last_sequence - 1) & 0xFFFFFFFF
+                    if 0 < gap < 0x80000000:
+                        self.frames_lost += gap
+                        logger.debug(f"{gap} frames lost from {self.device_id}")
+                self.last_sequence = (sequence + len(samples) - 1) & 0xFFFFFFFF
+            
+            await self.update_presence(frames_lost=self.frames_lost)
+            
+            if self.sensor_buffer is None:
+                logger.warning("Sensor data received before device registration, dropped")
+                return
+            
+            context = context or self.frame_context
+            session_duration = context.get('session_duration')
+            if session_duration is None:
+                session_duration = 0
+                if self.session_started is not None:
+                    session_duration = int(time.monotonic() - self.session_started)
+            
+            timestamps = sample_timestamps([device_timestamp for device_timestamp, _ in samples])
+            readings = []
+            rejected = 0
+            for (_, values), timestamp in zip(samples, timestamps):
+                try:
+                    readings.append(make_sensor_reading(
+                        self.device_id,
+                        values,
+                        exercise=context['exercise'],
+                        difficulty=context['difficulty'],
+                        session_duration=session_duration,
+                        mode=context['mode'],
+                        timestamp=timestamp,
+                        session_id=self.session_id,
+                    ))
+                except ValueError:
+                    rejected += 1
+            
+            # العينات غير الصالحة فقط تُحذف، وليس باقي الدفعة
+            if rejected:
+                logger.warning(f"{rejected} invalid samples from {self.device_id} dropped")
+                await self.send_error(f"{rejected} samples with invalid sensor values dropped")
+            if not readings:
+                return
+            await self.sensor_buffer.extend(readings)
+            
+            # للـ Dashboard نرسل آخر عينة فقط
+            device_timestamp = samples[-1][0]
+            values = [getattr(readings[-1], field) for field in SENSOR_FIELDS]
+            await self.broadcast_to_dashboard(values, self.last_sequence, device_timestamp)
+        
+        except Exception as e:
+            logger.error(f"Error handling sensor samples: {e}")
+    
+    async def negotiate_format(self, requested):
+        """تحديد صيغة إطارات السنسورات (json أو binary)"""
+        self.frame_format = requested if requested in SUPPORTED_FORMATS else FORMAT_JSON
+        self.last_sequence = None
+        
+        await self.send(text_data=codec.message(
+            'format_ack',
+            format=self.frame_format,
+            binary_frame_version=FRAME_VERSION
+        ))
+        
+        logger.info(f"Device {self.device_id} frame format: {self.frame_format}")
+    
     async def handle_session_ack(self, data):
         """تأكيد بدء الجلسة"""
         status = data.get('status', '')
         logger.info(f"Session acknowledgment: {status}")
         
-        await self.send(text_data=json.dumps({
-            'type': 'session_confirmed',
-            'message': 'Session started successfully',
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.resolve_command('session_ack', data)
+        
+        await self.send(text_data=codec.message(
+            'session_confirmed',
+            message='Session started successfully'
+        ))
     
     async def handle_network_info(self, data):
         """معلومات الشبكة من الجهاز"""
         logger.info(f"Network info received: {data}")
         
+        await self.resolve_command('network_info', data)
+        
         # حفظ معلومات الشبكة
-        if self.device_id:
-            self.connected_devices[self.device_id].update({
+        await self.update_presence(
+            force=True,
+            ssid=data.get('ssid', ''),
+            ip=data.get('ip', ''),
+            rssi=data.get('rssi', 0),
+            ws_host=data.get('ws_host', ''),
+            ws_port=data.get('ws_port', 0)
+        )
+        await self.update_state(
+            network={
                 'ssid': data.get('ssid', ''),
                 'ip': data.get('ip', ''),
                 'rssi': data.get('rssi', 0),
                 'ws_host': data.get('ws_host', ''),
-                'ws_port': data.get('ws_port', 0)
-            })
+                'ws_port': data.get('ws_port', 0),
+            },
+            last_seen=timezone.now()
+        )
         
         await self.save_network_info(data)
     
@@ -179,16 +428,173 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
         """تأكيد إعادة ضبط WiFi"""
         logger.info("WiFi reset acknowledged")
         
-        await self.send(text_data=json.dumps({
-            'type': 'wifi_reset_confirmed',
-            'message': 'Device will restart shortly',
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.resolve_command('wifi_reset_ack', data)
+        
+        await self.send(text_data=codec.message(
+            'wifi_reset_confirmed',
+            message='Device will restart shortly'
+        ))
     
     async def handle_pong(self, data):
         """استجابة Ping"""
-        if self.device_id in self.connected_devices:
-            self.connected_devices[self.device_id]['last_seen'] = datetime.now().isoformat()
+        if data.get('id') == HEARTBEAT_ID:
+            # heartbeat: يكفي تجديد presence (last_seen محدث في receive)
+            await self.update_presence()
+            return
+        await self.resolve_command('pong', data)
+        await self.update_presence(force=True)
+        await self.update_state(last_seen=timezone.now())
+    
+    # ==============================================
+    # Registry (presence + channel layer group)
+    # ==============================================
+    
+    async def register_device(self, device_id, mode):
+        """تسجيل الجهاز: الانضمام لـ group الجهاز ونشر بيانات الاتصال"""
+        if self.device_id and self.device_id != device_id and self.presence is not None:
+            await self.unregister_device()
+        
+        self.device_id = device_id
+        if self.sensor_buffer is not None:
+            await self.sensor_buffer.flush()
+        self.sensor_buffer = SensorBuffer(self.device_id)
+        
+        # استكمال جلسة نشطة بدأت قبل (إعادة) الاتصال
+        await self.restore_active_session()
+        
+        await self.channel_layer.group_add(device_group(self.device_id), self.channel_name)
+        
+        now = codec.now_iso()
+        self.presence = {
+            'device_id': self.device_id,
+            'channel_name': self.channel_name,
+            'server': self.server_name,
+            'status': 'connected',
+            'mode': mode,
+            'connected_at': now,
+            'last_seen': now,
+        }
+        await self.update_presence(force=True)
+        
+        logger.info(f"Device registered: {self.device_id} (mode: {mode})")
+    
+    async def unregister_device(self):
+        """مغادرة group الجهاز وحذف بيانات الاتصال"""
+        await self.channel_layer.group_discard(device_group(self.device_id), self.channel_name)
+        await device_registry.aremove(self.device_id, self.channel_name)
+        self.presence = None
+        try:
+            await device_state.aflush(self.device_id)
+        except Exception as e:
+            logger.error(f"Error flushing device state: {e}")
+    
+    async def update_presence(self, force=False, **fields):
+        """تحديث بيانات الاتصال ونشرها (كل PRESENCE_REFRESH ثانية على الأكثر)"""
+        if self.presence is None:
+            return
+        
+        self.presence.update(fields, last_seen=codec.now_iso())
+        
+        now = time.monotonic()
+        if force or now - self.presence_published >= PRESENCE_REFRESH:
+            self.presence_published = now
+            await device_registry.apublish(self.device_id, self.presence)
+    
+    async def update_state(self, **fields):
+        """تحديث آخر حالة معروفة للجهاز (write-through)"""
+        if self.device_id is None:
+            return
+        try:
+            await device_state.aupdate(self.device_id, **fields)
+        except Exception as e:
+            logger.error(f"Error updating device state: {e}")
+    
+    async def device_command(self, event):
+        """أمر وارد عبر الـ channel layer (من أي worker)"""
+        command_type = event['command']
+        command_id = event.get('id')
+        reply_channel = event.get('reply_channel')
+        ack_type = ACK_TYPES.get(command_type)
+        
+        if command_id and ack_type:
+            self.expire_commands()
+            try:
+                timeout = command_timeout(event.get('timeout'))
+            except ValueError:
+                timeout = COMMAND_TIMEOUT
+            now = time.monotonic()
+            self.pending_commands[command_id] = (
+                command_type, ack_type, reply_channel, now, now + timeout
+            )
+        
+        self.command_id = command_id
+        try:
+            await self.run_command(command_type, event.get('data') or {})
+        finally:
+            self.command_id = None
+        
+        # أمر بدون رسالة تأكيد: يكفي أنه أُرسل
+        if reply_channel and not ack_type:
+            await self.channel_layer.send(reply_channel, {
+                'type': 'command.reply', 'id': command_id, 'status': 'sent'
+            })
+    
+    async def resolve_command(self, ack_type, data):
+        """مطابقة تأكيد من الجهاز مع الأمر المنتظر وتسجيل زمن الذهاب والعودة"""
+        command_id = data.get('id')
+        entry = self.pending_commands.pop(command_id, None) if command_id else None
+        if entry is None:
+            # firmware لا يعيد الـ id: أقدم أمر ينتظر نفس نوع التأكيد
+            for pending_id, pending in self.pending_commands.items():
+                if pending[1] == ack_type:
+                    command_id, entry = pending_id, pending
+                    break
+            if entry is None:
+                return
+            del self.pending_commands[command_id]
+        
+        command_type, _, reply_channel, sent_at, _ = entry
+        latency_ms = round((time.monotonic() - sent_at) * 1000, 1)
+        self.command_rtt[command_type] = latency_ms
+        if latency_ms >= SLOW_COMMAND_MS:
+            logger.warning(f"Slow device {self.device_id}: {command_type} took {latency_ms} ms")
+        await self.update_presence(command_rtt_ms=dict(self.command_rtt))
+        
+        if reply_channel:
+            await self.channel_layer.send(reply_channel, {
+                'type': 'command.reply',
+                'id': command_id,
+                'status': 'ok',
+                'latency_ms': latency_ms,
+                'data': {key: value for key, value in data.items() if key not in ('type', 'id')},
+            })
+    
+    def expire_commands(self):
+        """حذف الأوامر التي انتهت مهلتها (حتى لا تُطابق تأكيداً متأخراً لأمر أحدث)"""
+        now = time.monotonic()
+        for command_id in [c for c, entry in self.pending_commands.items() if entry[4] < now]:
+            del self.pending_commands[command_id]
+    
+    async def run_command(self, command_type, command_data):
+        """تنفيذ أمر على هذا الاتصال"""
+        if command_type == 'start_session':
+            await self.send_start_session(command_data)
+        elif command_type == 'stop_session':
+            await self.send_stop_session()
+        elif command_type == 'calibrate':
+            await self.send_calibrate()
+        elif command_type == 'ai_correction':
+            await self.send_ai_correction(command_data)
+        elif command_type == 'motor_control':
+            await self.send_motor_control(command_data)
+        elif command_type == 'get_network_info':
+            await self.send_get_network_info()
+        elif command_type == 'reset_wifi':
+            await self.send_reset_wifi()
+        elif command_type == 'ping':
+            await self.send_ping()
+        else:
+            logger.warning(f"Unknown command type: {command_type}")
     
     # ==============================================
     # أوامر للجهاز
@@ -196,138 +602,184 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
     
     async def send_start_session(self, session_data):
         """إرسال أمر بدء جلسة"""
-        await self.send(text_data=json.dumps({
-            'type': 'start_session',
-            'name': session_data.get('child_name', ''),
-            'role': session_data.get('user_role', 'Parent'),
-            'difficulty': session_data.get('difficulty', 'medium'),
-            'exercise': session_data.get('exercise', 'Stretching'),
-            'timestamp': datetime.now().isoformat()
-        }))
+        self.frame_context['exercise'] = session_data.get('exercise', 'Stretching')
+        self.frame_context['difficulty'] = session_data.get('difficulty', 'medium')
+        self.session_started = time.monotonic()
+        self.session_id = session_data.get('session_id')
+        
+        await self.send(text_data=codec.command(
+            'start_session',
+            self.command_id,
+            name=session_data.get('child_name', ''),
+            role=session_data.get('user_role', 'Parent'),
+            difficulty=session_data.get('difficulty', 'medium'),
+            exercise=session_data.get('exercise', 'Stretching')
+        ))
         
         logger.info(f"Start session command sent: {session_data.get('exercise')}")
     
     async def send_stop_session(self):
         """إرسال أمر إيقاف جلسة"""
-        await self.send(text_data=json.dumps({
-            'type': 'stop_session',
-            'timestamp': datetime.now().isoformat()
-        }))
+        self.session_started = None
+        self.session_id = None
+        
+        await self.send(text_data=codec.command('stop_session', self.command_id))
         
         logger.info("Stop session command sent")
     
     async def send_calibrate(self):
         """إرسال أمر معايرة"""
-        await self.send(text_data=json.dumps({
-            'type': 'calibrate',
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.command('calibrate', self.command_id))
         
         logger.info("Calibrate command sent")
     
     async def send_ai_correction(self, correction_data):
         """إرسال تصحيح من الـ AI"""
-        await self.send(text_data=json.dumps({
-            'type': 'ai_correction',
-            'correction_needed': correction_data.get('needed', False),
-            'shoulder': correction_data.get('shoulder', {}),
-            'elbow': correction_data.get('elbow', {}),
-            'wrist': correction_data.get('wrist', {}),
-            'feedback': correction_data.get('feedback', ''),
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.command(
+            'ai_correction',
+            self.command_id,
+            correction_needed=correction_data.get('needed', False),
+            shoulder=correction_data.get('shoulder', {}),
+            elbow=correction_data.get('elbow', {}),
+            wrist=correction_data.get('wrist', {}),
+            feedback=correction_data.get('feedback', '')
+        ))
         
         logger.info("AI correction sent")
     
     async def send_motor_control(self, motor_data):
         """إرسال تحكم في الموتورات"""
-        await self.send(text_data=json.dumps({
-            'type': 'motor_control',
-            'shoulder': motor_data.get('shoulder', {}),
-            'elbow': motor_data.get('elbow', {}),
-            'wrist': motor_data.get('wrist', {}),
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.command(
+            'motor_control',
+            self.command_id,
+            shoulder=motor_data.get('shoulder', {}),
+            elbow=motor_data.get('elbow', {}),
+            wrist=motor_data.get('wrist', {})
+        ))
     
     async def send_get_network_info(self):
         """طلب معلومات الشبكة"""
-        await self.send(text_data=json.dumps({
-            'type': 'get_network_info',
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.command('get_network_info', self.command_id))
     
     async def send_reset_wifi(self):
         """إعادة ضبط WiFi"""
-        await self.send(text_data=json.dumps({
-            'type': 'reset_wifi',
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.command('reset_wifi', self.command_id))
         
         logger.warning("WiFi reset command sent")
     
     async def send_ping(self):
         """إرسال Ping"""
-        await self.send(text_data=json.dumps({
-            'type': 'ping',
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.command('ping', self.command_id))
+    
+    async def heartbeat(self):
+        """Ping دوري من الـ HeartbeatScheduler"""
+        await self.send(text_data=codec.command('ping', HEARTBEAT_ID))
+    
+    async def evict(self):
+        """طرد اتصال لم يرسل شيئاً خلال HEARTBEAT_MISSES فترات (TCP نصف مفتوح)"""
+        # التنظيف الآن: الـ disconnect من السيرفر قد يتأخر حتى انتهاء مهلة الإغلاق
+        await self.disconnect(CLOSE_STALE)
+        await self.close(code=CLOSE_STALE)
     
     async def send_error(self, error_message):
         """إرسال رسالة خطأ"""
-        await self.send(text_data=json.dumps({
-            'type': 'error',
-            'message': error_message,
-            'timestamp': datetime.now().isoformat()
-        }))
+        await self.send(text_data=codec.message(
+            'error',
+            message=error_message
+        ))
     
     # ==============================================
     # Database Operations
     # ==============================================
     
-    @database_sync_to_async
-    def save_device_status(self, status, message, mode):
-        """حفظ حالة الجهاز في قاعدة البيانات"""
+    async def save_device_status(self, status, message, mode):
+        """
+        حفظ حالة الجهاز: صف جديد فقط عند تغير الحالة أو الـ mode،
+        والتكرار يُجمع في last_seen/repeat_count للصف الحالي ويُكتب كل STATUS_FLUSH_INTERVAL
+        """
         try:
-            from .models import DeviceStatus
+            key = (self.device_id, status, mode)
+            now = timezone.now()
             
-            DeviceStatus.objects.create(
-                device_id=self.device_id,
-                status=status,
-                message=message,
-                mode=mode,
-                ip_address=self.scope['client'][0] if self.scope.get('client') else None
-            )
+            if self.status_row_id is not None and key == self.status_key:
+                self.status_repeats += 1
+                self.status_last_seen = now
+                if time.monotonic() - self.status_flushed >= STATUS_FLUSH_INTERVAL:
+                    await self.flush_status_repeats()
+                return
+            
+            # حالة جديدة: إغلاق تكرارات الصف السابق ثم إنشاء صف
+            await self.flush_status_repeats()
+            self.status_row_id = await self.create_status_row(status, message, mode)
+            self.status_key = key
+            self.status_flushed = time.monotonic()
         except Exception as e:
             logger.error(f"Error saving device status: {e}")
     
     @database_sync_to_async
-    def save_sensor_data(self, data):
-        """حفظ بيانات السنسورات"""
-        try:
-            from .models import SensorReading
-            
-            SensorReading.objects.create(
-                device_id=self.device_id,
-                shoulder_pitch=data['shoulder'].get('pitch', 0),
-                shoulder_roll=data['shoulder'].get('roll', 0),
-                shoulder_yaw=data['shoulder'].get('yaw', 0),
-                elbow_pitch=data['elbow'].get('pitch', 0),
-                elbow_roll=data['elbow'].get('roll', 0),
-                elbow_yaw=data['elbow'].get('yaw', 0),
-                wrist_pitch=data['wrist'].get('pitch', 0),
-                wrist_roll=data['wrist'].get('roll', 0),
-                wrist_yaw=data['wrist'].get('yaw', 0),
-                hand_pitch=data['hand'].get('pitch', 0),
-                hand_roll=data['hand'].get('roll', 0),
-                hand_yaw=data['hand'].get('yaw', 0),
-                force_value=data['force'].get('force', 0),
-                exercise_type=data.get('exercise', ''),
-                difficulty=data.get('difficulty', ''),
-                session_duration=data.get('session_duration', 0),
-                mode=data.get('mode', 'normal')
-            )
-        except Exception as e:
-            logger.error(f"Error saving sensor data: {e}")
+    def create_status_row(self, status, message, mode):
+        """إنشاء صف DeviceStatus (انتقال حالة)"""
+        from .models import DeviceStatus
+        from .summary import record_status
+        
+        row = DeviceStatus.objects.create(
+            device_id=self.device_id,
+            status=status,
+            message=message,
+            mode=mode,
+            ip_address=self.scope['client'][0] if self.scope.get('client') else None
+        )
+        record_status(self.device_id, status, row.timestamp)
+        return row.id
+    
+    async def flush_status_repeats(self):
+        """كتابة التكرارات المتراكمة للصف الحالي"""
+        if not self.status_repeats:
+            return
+        repeats, self.status_repeats = self.status_repeats, 0
+        self.status_flushed = time.monotonic()
+        await self.update_status_row(self.status_row_id, repeats, self.status_last_seen)
+    
+    @database_sync_to_async
+    def update_status_row(self, row_id, repeats, last_seen):
+        from .models import DeviceStatus
+        
+        DeviceStatus.objects.filter(pk=row_id).update(
+            repeat_count=F('repeat_count') + repeats,
+            last_seen=last_seen
+        )
+    
+    async def restore_active_session(self):
+        """تحميل الجلسة النشطة للجهاز (مرة واحدة عند التسجيل)"""
+        session = await self.get_active_session()
+        if session is None:
+            self.session_id = None
+            return
+        
+        self.session_id = session.id
+        self.frame_context['exercise'] = session.exercise_type
+        self.frame_context['difficulty'] = session.difficulty
+        elapsed = (timezone.now() - session.start_time).total_seconds()
+        self.session_started = time.monotonic() - max(0, elapsed)
+        
+        logger.info(f"Device {self.device_id} resumed session {session.id}")
+    
+    @database_sync_to_async
+    def get_active_session(self):
+        """آخر جلسة نشطة للجهاز"""
+        from .models import Session
+        
+        return Session.objects.filter(
+            device__device_id=self.device_id, is_active=True
+        ).only('id', 'exercise_type', 'difficulty', 'start_time').first()
+    
+    async def save_sensor_data(self, data):
+        """إضافة القراءة للـ buffer (تُكتب على دفعات بـ bulk_create)"""
+        if self.sensor_buffer is None:
+            logger.warning("Sensor data received before device registration, dropped")
+            return
+        
+        await self.sensor_buffer.add(build_sensor_reading(self.device_id, data, self.session_id))
     
     @database_sync_to_async
     def save_network_info(self, data):
@@ -351,47 +803,218 @@ class BaskyDeviceConsumer(AsyncWebsocketConsumer):
     
     async def notify_device_status(self, status, message=''):
         """إشعار المستخدمين بحالة الجهاز"""
-        # يمكن إرسال للـ Channel Layer للـ Dashboard
-        pass
+        if not self.device_id:
+            return
+        
+        await self.channel_layer.group_send(dashboard_group(self.device_id), {
+            'type': 'dashboard.status',
+            'device_id': self.device_id,
+            'status': status,
+            'message': message,
+            'timestamp': codec.now_iso(),
+        })
     
-    async def broadcast_to_dashboard(self, data):
-        """بث البيانات للـ Dashboard"""
-        # يمكن استخدام Channel Layers
-        pass
+    async def broadcast_to_dashboard(self, values, sequence=None, device_timestamp=None):
+        """
+        بث آخر عينة للـ Dashboard بحد أقصى DASHBOARD_MAX_FPS،
+        العينات بين مرتين بث تُدمج (نرسل الأحدث فقط)
+        """
+        if not self.device_id:
+            return
+        
+        self.dashboard_pending = {
+            'type': 'dashboard.sample',
+            'device_id': self.device_id,
+            'values': list(values),
+            'sequence': sequence,
+            'device_timestamp': device_timestamp,
+            'timestamp': codec.now_iso(),
+        }
+        
+        wait = self.dashboard_next - time.monotonic()
+        if wait <= 0:
+            await self.publish_dashboard_sample()
+        elif self.dashboard_timer is None:
+            self.dashboard_timer = asyncio.get_running_loop().call_later(
+                wait, lambda: run_in_background(
+                    self.publish_dashboard_sample(), f"dashboard publish for {self.device_id}"
+                )
+            )
+    
+    async def publish_dashboard_sample(self):
+        """إرسال العينة المعلقة لـ group الـ Dashboard"""
+        self.dashboard_timer = None
+        event, self.dashboard_pending = self.dashboard_pending, None
+        if event is None:
+            return
+        
+        self.dashboard_next = time.monotonic() + 1 / DASHBOARD_MAX_FPS
+        await self.channel_layer.group_send(dashboard_group(self.device_id), event)
     
     # ==============================================
     # Utility Methods
     # ==============================================
     
     @classmethod
-    def get_connected_devices(cls):
-        """الحصول على جميع الأجهزة المتصلة"""
-        return cls.connected_devices
+    def get_connected_devices(cls, device_ids):
+        """بيانات الاتصال للأجهزة المتصلة من القائمة (من أي worker)"""
+        return device_registry.get_many(device_ids)
     
     @classmethod
     async def send_command_to_device(cls, device_id, command_type, command_data):
-        """إرسال أمر لجهاز معين"""
-        if device_id in cls.connected_devices:
-            consumer = cls.connected_devices[device_id]['consumer']
-            
-            if command_type == 'start_session':
-                await consumer.send_start_session(command_data)
-            elif command_type == 'stop_session':
-                await consumer.send_stop_session()
-            elif command_type == 'calibrate':
-                await consumer.send_calibrate()
-            elif command_type == 'ai_correction':
-                await consumer.send_ai_correction(command_data)
-            elif command_type == 'motor_control':
-                await consumer.send_motor_control(command_data)
-            elif command_type == 'get_network_info':
-                await consumer.send_get_network_info()
-            elif command_type == 'reset_wifi':
-                await consumer.send_reset_wifi()
-            elif command_type == 'ping':
-                await consumer.send_ping()
-            
-            return True
-        return False
+        """إرسال أمر لجهاز معين عبر الـ channel layer (بدون انتظار التأكيد)"""
+        if await device_registry.aget(device_id) is None:
+            return False
+        
+        await get_channel_layer().group_send(device_group(device_id), {
+            'type': 'device.command',
+            'command': command_type,
+            'data': command_data,
+            'id': uuid.uuid4().hex[:16],
+        })
+        return True
+    
+    @classmethod
+    async def request_device(cls, device_id, command_type, command_data, timeout=None):
+        """
+        إرسال أمر وانتظار تأكيد الجهاز (عبر reply channel في الـ channel layer،
+        فيعمل مهما كان الـ worker المتصل به الجهاز). يرجع:
+        {'id', 'status': ok|sent|timeout|offline, 'latency_ms', 'data'}
+        ValueError إذا كانت timeout غير صالحة (قبل إرسال أي شيء)
+        """
+        timeout = command_timeout(timeout)
+        command_id = uuid.uuid4().hex[:16]
+        if await device_registry.aget(device_id) is None:
+            return {'id': command_id, 'status': 'offline'}
+        
+        channel_layer = get_channel_layer()
+        reply_channel = await channel_layer.new_channel()
+        started = time.monotonic()
+        
+        await channel_layer.group_send(device_group(device_id), {
+            'type': 'device.command',
+            'command': command_type,
+            'data': command_data,
+            'id': command_id,
+            'reply_channel': reply_channel,
+            'timeout': timeout,
+        })
+        
+        try:
+            reply = await asyncio.wait_for(channel_layer.receive(reply_channel), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"No {command_type} confirmation from {device_id} within {timeout}s")
+            return {'id': command_id, 'status': 'timeout'}
+        
+        return {
+            'id': command_id,
+            'status': reply['status'],
+            # زمن الجهاز (من الإرسال للتأكيد) أو الزمن الكلي إن لم يُسجل
+            'latency_ms': reply.get('latency_ms', round((time.monotonic() - started) * 1000, 1)),
+            'data': reply.get('data', {}),
+        }
 
 
+class DeviceStreamConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket Consumer للـ Dashboard في المتصفح: بث مباشر لجهاز واحد
+    
+    ws/device/<device_id>/stream/?max_fps=10
+    كل مشاهد يحدد أقصى معدل تحديث، والعينات الزائدة تُدمج (نرسل الأحدث فقط)
+    """
+    
+    async def connect(self):
+        """الاشتراك في بث الجهاز (لصاحب الجهاز فقط)"""
+        self.device_id = self.scope['url_route']['kwargs']['device_id']
+        self.user = self.scope.get('user')
+        self.pending = None
+        self.next_send = 0
+        self.timer = None
+        self.samples_received = 0
+        self.samples_sent = 0
+        
+        if not self.user or not self.user.is_authenticated or not await self.owns_device():
+            await self.close()
+            return
+        
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.set_rate(query.get('max_fps', [DASHBOARD_DEFAULT_FPS])[0])
+        
+        await self.channel_layer.group_add(dashboard_group(self.device_id), self.channel_name)
+        await self.accept()
+        
+        await self.send(text_data=codec.message(
+            'subscribed',
+            device_id=self.device_id,
+            channels=list(SENSOR_FIELDS),
+            max_fps=self.max_fps
+        ))
+    
+    async def disconnect(self, close_code):
+        if self.timer is not None:
+            self.timer.cancel()
+        await self.channel_layer.group_discard(dashboard_group(self.device_id), self.channel_name)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """تغيير معدل التحديث: {"type": "set_rate", "max_fps": 5}"""
+        try:
+            data = codec.loads(text_data or '')
+        except codec.DecodeError:
+            return
+        
+        if data.get('type') == 'set_rate':
+            self.set_rate(data.get('max_fps'))
+            await self.send(text_data=codec.message('rate_ack', max_fps=self.max_fps))
+    
+    def set_rate(self, max_fps):
+        try:
+            max_fps = float(max_fps)
+        except (TypeError, ValueError):
+            max_fps = DASHBOARD_DEFAULT_FPS
+        self.max_fps = min(max(max_fps, 0.1), DASHBOARD_MAX_FPS)
+        self.interval = 1 / self.max_fps
+    
+    async def dashboard_sample(self, event):
+        """عينة جديدة من الجهاز: إرسال فوراً أو دمجها حتى موعد الإرسال التالي"""
+        self.samples_received += 1
+        self.pending = event
+        
+        wait = self.next_send - time.monotonic()
+        if wait <= 0:
+            await self.send_pending()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(
+                wait, lambda: run_in_background(self.send_pending(), f"dashboard stream for {self.device_id}")
+            )
+    
+    async def send_pending(self):
+        self.timer = None
+        event, self.pending = self.pending, None
+        if event is None:
+            return
+        
+        self.next_send = time.monotonic() + self.interval
+        self.samples_sent += 1
+        await self.send(text_data=codec.message(
+            'sensor_data',
+            device_id=event['device_id'],
+            values=event['values'],
+            sequence=event['sequence'],
+            device_timestamp=event['device_timestamp'],
+            received_at=event['timestamp']
+        ))
+    
+    async def dashboard_status(self, event):
+        """تغيير حالة الجهاز (يُرسل فوراً)"""
+        await self.send(text_data=codec.message(
+            'device_status',
+            device_id=event['device_id'],
+            status=event['status'],
+            message=event['message']
+        ))
+    
+    @database_sync_to_async
+    def owns_device(self):
+        from .models import DeviceConfig
+        
+        return DeviceConfig.objects.filter(device_id=self.device_id, user=self.user).exists()
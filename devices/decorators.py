@@ -0,0 +1,28 @@
+"""
+Decorators لـ async views
+(login_required و csrf_exempt في Django 4.2 يغلفان الـ view بدالة sync فيتحول
+الـ async view إلى sync ويمر عبر thread pool)
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+
+
+def async_login_required(view):
+    """login_required لـ async view"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # تحميل المستخدم من الـ session (استعلام قاعدة بيانات) خارج الـ event loop
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_csrf_exempt(view):
+    """csrf_exempt لـ async view (بدون تغليف)"""
+    view.csrf_exempt = True
+    return view
@@ -0,0 +1,291 @@
+# ==============================================
+# discovery.py - اكتشاف أجهزة Basky على الشبكة المحلية (UDP broadcast)
+# ==============================================
+#
+# الجهاز غير المُعد يرسل كل بضع ثواني رسالة JSON على منفذ DISCOVERY_PORT:
+#   {"type": "announce", "device_id": "basky_...", "mac": "...", "firmware": "...", "ws_port": 8080}
+# الـ DiscoveryService يستمع بـ asyncio datagram endpoint ويحفظ الأجهزة في جدول
+# تنتهي صلاحية كل جهاز فيه بعد DISCOVERY_TTL ثانية من آخر إعلان.
+# الجدول يُنشر في الـ cache المشترك، فصفحة الإعداد تقرأه مباشرة بدون فحص للشبكة
+# مع كل طلب (ومع Redis يقرؤه كل الـ workers، ويستمع worker واحد فقط على المنفذ).
+# مع أكثر من worker يجب أن يكون الـ cache مشتركاً: LocMemCache لكل عملية على حدة.
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+# منفذ UDP الذي تعلن عليه الأجهزة، وعنوان الاستماع
+DISCOVERY_PORT = getattr(settings, 'BASKY_DISCOVERY_PORT', 4210)
+DISCOVERY_HOST = getattr(settings, 'BASKY_DISCOVERY_HOST', '0.0.0.0')
+# مدة بقاء الجهاز في الجدول بعد آخر إعلان (ثواني)
+DISCOVERY_TTL = getattr(settings, 'BASKY_DISCOVERY_TTL', 30)
+# تشغيل المستمع مع تطبيق ASGI، وأقل فترة بين نشر الجدول في الـ cache (ثواني)
+DISCOVERY_ENABLED = getattr(settings, 'BASKY_DISCOVERY_ENABLED', False)
+DISCOVERY_PUBLISH_INTERVAL = getattr(settings, 'BASKY_DISCOVERY_PUBLISH_INTERVAL', 1.0)
+# مدة الاحتفاظ بـ IP السيرفر قبل إعادة حسابه (ثواني)
+SERVER_IP_TTL = getattr(settings, 'BASKY_SERVER_IP_TTL', 300)
+
+CACHE_KEY = 'basky:discovered'
+
+# أقصى طول للحقول النصية في رسالة الإعلان
+ANNOUNCE_MAX_LENGTH = 64
+
+
+# ==============================================
+# Server IP
+# ==============================================
+
+_server_ip = None
+_server_ip_expires = 0
+
+
+def get_server_ip():
+    """الحصول على IP الخاص بالسيرفر (محفوظ لمدة SERVER_IP_TTL)"""
+    global _server_ip, _server_ip_expires
+
+    now = time.monotonic()
+    if _server_ip is not None and now < _server_ip_expires:
+        return _server_ip
+
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # UDP connect لا يرسل شيئاً، فقط يختار الواجهة التي تخرج منها الحزم
+            s.connect(("8.8.8.8", 80))
+            ip = s.getsockname()[0]
+        finally:
+            s.close()
+    except Exception:
+        ip = "127.0.0.1"
+
+    _server_ip, _server_ip_expires = ip, now + SERVER_IP_TTL
+    return ip
+
+
+# ==============================================
+# Discovery table
+# ==============================================
+
+def _valid_text(value, max_length=ANNOUNCE_MAX_LENGTH):
+    return isinstance(value, str) and 0 < len(value) <= max_length and value.isprintable()
+
+
+def _valid_port(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= 65535
+
+
+# الحقول المقبولة من رسالة الإعلان ودالة التحقق من كل حقل
+ANNOUNCE_FIELDS = {
+    'mac': _valid_text,
+    'firmware': _valid_text,
+    'ws_port': _valid_port,
+    'name': _valid_text,
+}
+
+
+def parse_announcement(payload, address):
+    """
+    رسالة إعلان -> بيانات الجهاز (أو None إذا لم تكن رسالة Basky صالحة)
+    الرسالة تأتي من أي جهاز على الشبكة، فكل حقل يُتحقق منه قبل حفظه في الـ cache وعرضه
+    """
+    try:
+        data = codec.loads(payload)
+        ip = str(ipaddress.ip_address(address[0]))
+    except (codec.DecodeError, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('type') != 'announce':
+        return None
+
+    device_id = data.get('device_id')
+    if not _valid_text(device_id, max_length=100):
+        return None
+
+    info = {'device_id': device_id, 'ip': ip}
+    for field, is_valid in ANNOUNCE_FIELDS.items():
+        if field in data:
+            if not is_valid(data[field]):
+                return None
+            info[field] = data[field]
+    return info
+
+
+class DiscoveryTable:
+    """الأجهزة المكتشفة مع انتهاء صلاحية كل جهاز بعد ttl ثانية"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or DISCOVERY_TTL
+        self.devices = {}
+
+    def __len__(self):
+        return len(self.devices)
+
+    def update(self, info, now=None):
+        """تسجيل إعلان: True إذا كان الجهاز جديداً أو تغيرت بياناته"""
+        now = now or time.time()
+        self.prune(now)
+
+        previous = self.devices.get(info['device_id'])
+        entry = dict(info, last_seen=now, expires_at=now + self.ttl)
+        entry['first_seen'] = previous['first_seen'] if previous else now
+        self.devices[info['device_id']] = entry
+
+        if previous is None:
+            return True
+        return any(previous.get(key) != value for key, value in info.items())
+
+    def prune(self, now=None):
+        """حذف الأجهزة المنتهية (يرجع عدد المحذوف)"""
+        now = now or time.time()
+        expired = [device_id for device_id, entry in self.devices.items() if entry['expires_at'] <= now]
+        for device_id in expired:
+            del self.devices[device_id]
+        return len(expired)
+
+    def snapshot(self):
+        return list(self.devices.values())
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """استقبال رسائل الإعلان وتمريرها للـ service"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        info = parse_announcement(data, addr)
+        if info is not None:
+            self.service.announce(info)
+
+    def error_received(self, exc):
+        logger.warning(f"Discovery socket error: {exc}")
+
+
+class DiscoveryService:
+    """
+    مستمع UDP واحد لكل عملية + جدول الأجهزة المكتشفة
+    الجدول يُنشر في الـ cache من task منفصل (وليس من datagram_received على الـ loop):
+    عند ظهور جهاز جديد أو تغير بياناته، وكل DISCOVERY_TTL/3 ثانية لتجديد الموجود
+    """
+
+    def __init__(self, host=None, port=None, ttl=None, cache_backend=None, publish_interval=None):
+        self.host = host or DISCOVERY_HOST
+        self.port = DISCOVERY_PORT if port is None else port
+        self.table = DiscoveryTable(ttl)
+        self.cache = cache_backend or cache
+        self.publish_interval = publish_interval or DISCOVERY_PUBLISH_INTERVAL
+        self.transport = None
+        self.announcements = 0
+        self._loop = None
+        self._thread = None
+        self._publisher = None
+        self._changed = False
+        self._published = 0
+
+    @property
+    def address(self):
+        """العنوان الفعلي للاستماع (مع port=0 يختاره النظام)"""
+        return self.transport.get_extra_info('sockname') if self.transport else None
+
+    async def start(self):
+        """بدء الاستماع على الـ event loop الحالي (مرة واحدة)"""
+        loop = asyncio.get_running_loop()
+        if self.transport is not None and self._loop is loop and not self.transport.is_closing():
+            return True
+
+        self._loop = loop
+        try:
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: DiscoveryProtocol(self),
+                local_addr=(self.host, self.port),
+                allow_broadcast=True,
+            )
+        except OSError as e:
+            # المنفذ مستخدم (غالباً worker آخر يستمع وينشر في الـ cache)
+            self.transport = None
+            logger.info(f"Discovery listener not started on {self.host}:{self.port}: {e}")
+            return False
+
+        self._publisher = loop.create_task(self._run_publisher())
+        logger.info(f"Discovery listening on {self.address[0]}:{self.address[1]}")
+        return True
+
+    def start_in_background(self):
+        """
+        تشغيل المستمع في thread بـ event loop مستقل (مرة واحدة عند تحميل تطبيق ASGI)
+        حتى تكون الأجهزة المكتشفة جاهزة لصفحة الإعداد من البداية
+        """
+        if self._thread is not None:
+            return
+        backend = caches['default'] if self.cache is cache else self.cache
+        if isinstance(backend, LocMemCache):
+            logger.warning("Discovery uses LocMemCache: discovered devices are visible to this worker only")
+        self._thread = threading.Thread(target=self._run_forever, name='basky-discovery', daemon=True)
+        self._thread.start()
+
+    def _run_forever(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            if loop.run_until_complete(self.start()):
+                loop.run_forever()
+        finally:
+            loop.close()
+
+    def stop(self):
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def announce(self, info):
+        """إعلان من جهاز (من الـ protocol): تحديث الجدول فقط، والنشر من الـ publisher"""
+        self.announcements += 1
+        if self.table.update(info):
+            self._changed = True
+            logger.info(f"Discovered device {info['device_id']} at {info['ip']}")
+
+    async def _run_publisher(self):
+        """نشر الجدول في الـ cache كل publish_interval إذا تغير (أو للتجديد)"""
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            refresh_due = self.table and time.monotonic() - self._published >= self.table.ttl / 3
+            if self._changed or refresh_due:
+                try:
+                    await self.publish()
+                except Exception as e:
+                    logger.error(f"Error publishing discovered devices: {e}")
+
+    async def publish(self):
+        """نشر الجدول في الـ cache"""
+        self._changed = False
+        self._published = time.monotonic()
+        self.table.prune()
+        await self.cache.aset(CACHE_KEY, self.table.snapshot(), self.table.ttl)
+
+    def discovered(self):
+        """الأجهزة المكتشفة (من الـ cache، بدون المنتهية)"""
+        return self._live(self.cache.get(CACHE_KEY))
+
+    async def adiscovered(self):
+        return self._live(await self.cache.aget(CACHE_KEY))
+
+    @staticmethod
+    def _live(entries):
+        now = time.time()
+        return [entry for entry in entries or [] if entry['expires_at'] > now]
+
+
+discovery = DiscoveryService()
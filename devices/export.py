@@ -0,0 +1,148 @@
+# ==============================================
+# export.py - تصدير قراءات الجلسات (CSV / NDJSON) كـ stream
+# ==============================================
+#
+# كل المراحل generators: القراءات تُجلب بـ iterator(chunk_size) والـ chunks
+# تُفك واحداً واحداً، ثم تُحوَّل لأسطر ثم (اختيارياً) تُضغط gzip أثناء الإرسال،
+# فالذاكرة ثابتة مهما كان عدد الصفوف.
+#
+# تحت ASGI (daphne) نستخدم async_export: async generator يسحب الأسطر على دفعات
+# من نفس الـ generator داخل thread قاعدة البيانات (sync_to_async)، لأن
+# StreamingHttpResponse تحت ASGI تقرأ الـ iterator العادي كاملاً في الذاكرة.
+
+import csv
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from . import codec
+from .models import SensorChunk, SensorReading
+from .timeseries import unpack_chunk
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMATS = {
+    FORMAT_CSV: 'text/csv; charset=utf-8',
+    FORMAT_NDJSON: 'application/x-ndjson',
+}
+
+# عدد الصفوف في كل جلب من قاعدة البيانات
+CHUNK_SIZE = 2000
+# عدد الأسطر التي تُجمع في كل قطعة ترسل للعميل
+LINES_PER_PIECE = 500
+
+
+def export_filters(device_id, session=None, start=None, end=None):
+    """شروط التصدير (session أو مدى زمني) لـ SensorReading و SensorChunk"""
+    readings = {'device_id': device_id}
+    chunks = {'device_id': device_id}
+    if session is not None:
+        readings['session'] = chunks['session'] = session
+    if start is not None:
+        readings['timestamp__gte'] = start
+        chunks['end_time__gte'] = start
+    if end is not None:
+        readings['timestamp__lt'] = end
+        chunks['start_time__lt'] = end
+    return readings, chunks, start, end
+
+
+def iter_rows(device_id, columns, session=None, start=None, end=None):
+    """
+    (timestamp, *columns) لكل قراءة بالترتيب الزمني:
+    القراءات المضغوطة (الأقدم) أولاً ثم الصفوف
+    """
+    reading_filter, chunk_filter, start, end = export_filters(device_id, session, start, end)
+
+    chunks = SensorChunk.objects.filter(**chunk_filter).order_by('start_time')
+    for chunk in chunks.iterator(chunk_size=10):
+        for sample in unpack_chunk(chunk):
+            if (start is not None and sample.timestamp < start) or (end is not None and sample.timestamp >= end):
+                continue
+            yield (sample.timestamp, *(getattr(sample, column) for column in columns))
+
+    rows = (
+        SensorReading.objects.filter(**reading_filter)
+        .order_by('timestamp', 'id')
+        .values_list('timestamp', *columns)
+    )
+    yield from rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+class _LineBuffer:
+    """كائن شبيه بالملف يرجع ما يُكتب فيه (لاستخدام csv.writer سطراً سطراً)"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, columns):
+    """تحويل الصفوف إلى أسطر CSV (مع سطر العناوين)"""
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(['timestamp', *columns])
+    for timestamp, *values in rows:
+        yield writer.writerow([timestamp.isoformat(), *values])
+
+
+def ndjson_lines(rows, columns):
+    """تحويل الصفوف إلى أسطر JSON (سطر لكل قراءة)"""
+    for timestamp, *values in rows:
+        item = dict(zip(columns, values))
+        item['timestamp'] = timestamp.isoformat()
+        yield codec.dumps(item) + '\n'
+
+
+def export_lines(export_format, rows, columns):
+    """الأسطر بالصيغة المطلوبة"""
+    if export_format == FORMAT_NDJSON:
+        return ndjson_lines(rows, columns)
+    return csv_lines(rows, columns)
+
+
+def encode_pieces(lines, gzip=False):
+    """تجميع الأسطر في قطع bytes (مضغوطة gzip أثناء الإرسال إذا طُلب)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    piece = []
+    for line in lines:
+        piece.append(line)
+        if len(piece) >= LINES_PER_PIECE:
+            data = ''.join(piece).encode()
+            piece = []
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = ''.join(piece).encode()
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def _next_pieces(iterator, count):
+    """سحب حتى count قطعة من الـ iterator (في thread قاعدة البيانات)"""
+    pieces = []
+    for piece in iterator:
+        pieces.append(piece)
+        if len(pieces) >= count:
+            break
+    return pieces
+
+
+async def async_export(pieces, count=4):
+    """
+    تحويل generator التصدير إلى async generator لـ StreamingHttpResponse تحت ASGI.
+    كل السحب يتم في نفس الـ thread (thread_sensitive) لأن الـ cursor مرتبط باتصاله.
+    """
+    iterator = iter(pieces)
+    pull = sync_to_async(_next_pieces, thread_sensitive=True)
+    try:
+        while True:
+            batch = await pull(iterator, count)
+            if not batch:
+                break
+            for piece in batch:
+                yield piece
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
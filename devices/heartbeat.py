@@ -0,0 +1,177 @@
+# ==============================================
+# heartbeat.py - Heartbeat للأجهزة المتصلة وطرد الاتصالات الميتة
+# ==============================================
+#
+# جهاز ESP32 فقد الـ WiFi يترك اتصال TCP نصف مفتوح لا يصل منه disconnect،
+# فيبقى "متصلاً" في الـ registry. لذلك يرسل السيرفر ping لكل اتصال خامل
+# كل HEARTBEAT_INTERVAL ثانية (مع jitter حتى لا تُرسل كل الـ pings معاً)،
+# ويطرد الاتصال الذي لم يصل منه أي شيء خلال HEARTBEAT_MISSES فترات.
+#
+# كل الاتصالات في العملية على timer wheel واحدة يديرها task واحد
+# (وليس task أو call_later لكل اتصال)، والجدولة والإلغاء O(1).
+# last_seen في الـ consumer بـ time.monotonic() (لا يتأثر بتغيير ساعة النظام).
+
+import asyncio
+import logging
+import random
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# الفترة بين الـ heartbeats (ثواني)، ونسبة الـ jitter حولها
+HEARTBEAT_INTERVAL = getattr(settings, 'BASKY_HEARTBEAT_INTERVAL', 20)
+HEARTBEAT_JITTER = getattr(settings, 'BASKY_HEARTBEAT_JITTER', 0.2)
+# عدد الفترات بدون أي رسالة من الجهاز قبل طرده
+HEARTBEAT_MISSES = getattr(settings, 'BASKY_HEARTBEAT_MISSES', 3)
+# دقة الـ timer wheel (ثواني لكل خانة)
+HEARTBEAT_TICK = getattr(settings, 'BASKY_HEARTBEAT_TICK', 1.0)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: خانة لكل tick، والعنصر الأبعد من دورة كاملة
+    يحمل عدد الدورات المتبقية
+    """
+
+    def __init__(self, size):
+        self.slots = [{} for _ in range(size)]
+        self.position = 0
+        # العنصر -> رقم خانته (للإلغاء المباشر)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def schedule(self, item, ticks):
+        """جدولة العنصر بعد ticks خطوة (تستبدل أي جدولة سابقة له)"""
+        self.cancel(item)
+        ticks = max(1, ticks)
+        index = (self.position + ticks) % len(self.slots)
+        self.slots[index][item] = (ticks - 1) // len(self.slots)
+        self.entries[item] = index
+
+    def cancel(self, item):
+        index = self.entries.pop(item, None)
+        if index is not None:
+            del self.slots[index][item]
+
+    def advance(self):
+        """التقدم خطوة واحدة وإرجاع العناصر التي حان وقتها"""
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        due = []
+        for item, rounds in list(slot.items()):
+            if rounds:
+                slot[item] = rounds - 1
+            else:
+                del slot[item]
+                del self.entries[item]
+                due.append(item)
+        return due
+
+
+class HeartbeatScheduler:
+    """
+    Heartbeat لكل اتصالات الأجهزة في العملية (timer wheel واحدة + task واحد)
+    الاتصال يحتاج: last_seen (monotonic)، و heartbeat() و evict()
+    """
+
+    def __init__(self, interval=None, misses=None, jitter=None, tick=None):
+        self.interval = interval or HEARTBEAT_INTERVAL
+        self.misses = misses or HEARTBEAT_MISSES
+        self.jitter = HEARTBEAT_JITTER if jitter is None else jitter
+        self.tick = tick or HEARTBEAT_TICK
+        # دورة كاملة تغطي أطول فترة ممكنة (interval + jitter)
+        self.wheel_size = int(self.interval * (1 + self.jitter) / self.tick) + 2
+
+        self.wheel = TimerWheel(self.wheel_size)
+        # الاتصالات المسجلة حالياً (لا يُعاد جدولة اتصال أُزيل أثناء الـ ping)
+        self.connections = set()
+        # عمليات الطرد الجارية (tasks منفصلة حتى لا يتأخر باقي الـ wheel)
+        self._evictions = set()
+        self.pings_sent = 0
+        self.evicted = 0
+        self._loop = None
+        self._task = None
+
+    def add(self, connection):
+        """إضافة اتصال (يبدأ الـ task عند أول اتصال)"""
+        self._ensure_started()
+        self.connections.add(connection)
+        self._schedule(connection)
+
+    def remove(self, connection):
+        self.connections.discard(connection)
+        self.wheel.cancel(connection)
+
+    def _schedule(self, connection):
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.wheel.schedule(connection, round(delay / self.tick))
+
+    def _ensure_started(self):
+        """تشغيل task الـ wheel على الـ event loop الحالي"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+
+        # اتصالات loop سابق لم تعد موجودة
+        if self._loop is not loop:
+            self.wheel = TimerWheel(self.wheel_size)
+            self.connections = set()
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        """Task الـ wheel: خطوة كل tick حتى لا يبقى اتصال"""
+        next_tick = time.monotonic()
+        while self.wheel:
+            next_tick += self.tick
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+            for connection in self.wheel.advance():
+                try:
+                    await self.check(connection)
+                except Exception as e:
+                    logger.error(f"Heartbeat error for {getattr(connection, 'device_id', None)}: {e}")
+
+    async def check(self, connection):
+        """ping للاتصال الخامل أو طرده إذا تجاوز HEARTBEAT_MISSES فترات"""
+        idle = time.monotonic() - connection.last_seen
+        if idle >= self.interval * self.misses:
+            self.evicted += 1
+            logger.warning(
+                f"Evicting stale device {connection.device_id or connection.scope.get('client')} "
+                f"(silent for {idle:.0f}s)"
+            )
+            self.connections.discard(connection)
+            task = asyncio.get_running_loop().create_task(self._evict(connection))
+            self._evictions.add(task)
+            task.add_done_callback(self._evictions.discard)
+            return
+
+        # جهاز يرسل بيانات حالياً لا يحتاج ping
+        if idle >= self.interval / 2:
+            self.pings_sent += 1
+            await connection.heartbeat()
+        # الاتصال قد يُغلق أثناء إرسال الـ ping
+        if connection in self.connections:
+            self._schedule(connection)
+
+    async def _evict(self, connection):
+        try:
+            await connection.evict()
+        except Exception as e:
+            logger.error(f"Error evicting {getattr(connection, 'device_id', None)}: {e}")
+
+    def stats(self):
+        return {
+            'connections': len(self.connections),
+            'interval': self.interval,
+            'misses': self.misses,
+            'pings_sent': self.pings_sent,
+            'evicted': self.evicted,
+        }
+
+
+heartbeat = HeartbeatScheduler()
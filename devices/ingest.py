@@ -0,0 +1,474 @@
+# ==============================================
+# ingest.py - تجميع قراءات السنسورات وكتابتها على دفعات
+# ==============================================
+#
+# الـ consumer يضيف الإطارات إلى SensorBuffer الخاص بالجهاز، والـ buffer يرسل
+# الدفعة إلى IngestQueue (طابور واحد لكل العملية) حيث يكتبها writer task واحد
+# باتصال قاعدة بيانات واحد، فلا ينتظر الـ consumer الكتابة في قاعدة البيانات.
+
+import asyncio
+import atexit
+import functools
+import logging
+import math
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# حجم الدفعة: عدد الإطارات قبل الكتابة
+BATCH_SIZE = getattr(settings, 'BASKY_INGEST_BATCH_SIZE', 50)
+# أقصى عمر للدفعة بالثواني قبل الكتابة حتى لو لم تمتلئ
+MAX_AGE = getattr(settings, 'BASKY_INGEST_MAX_AGE', 1.0)
+# أقصى عدد عينات في رسالة sensor_batch
+MAX_BATCH_SAMPLES = getattr(settings, 'BASKY_MAX_BATCH_SAMPLES', 200)
+# أقصى عدد دفعات في طابور الكتابة
+QUEUE_SIZE = getattr(settings, 'BASKY_INGEST_QUEUE_SIZE', 1000)
+# سياسة الطابور عند الامتلاء: block, drop_oldest, coalesce
+OVERFLOW_POLICY = getattr(settings, 'BASKY_INGEST_OVERFLOW', 'block')
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+# جميع الـ buffers الحية (للكتابة عند إيقاف السيرفر)
+_live_buffers = weakref.WeakSet()
+# الـ tasks المُشغلة من callbacks (مرجع حتى لا تُحذف قبل انتهائها)
+_background_tasks = set()
+
+
+def run_in_background(coro, description):
+    """تشغيل coroutine من callback (مثل call_later) مع الاحتفاظ بمرجع لها وتسجيل أخطائها"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(functools.partial(_background_task_done, description))
+    return task
+
+
+def _background_task_done(description, task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Error in {description}: {task.exception()}")
+
+
+def sensor_values(data):
+    """استخراج قيم السنسورات من رسالة JSON بترتيب SENSOR_FIELDS"""
+    shoulder = data.get('shoulder') or {}
+    elbow = data.get('elbow') or {}
+    wrist = data.get('wrist') or {}
+    hand = data.get('hand') or {}
+    force = data.get('force') or {}
+
+    return (
+        shoulder.get('pitch', 0), shoulder.get('roll', 0), shoulder.get('yaw', 0),
+        elbow.get('pitch', 0), elbow.get('roll', 0), elbow.get('yaw', 0),
+        wrist.get('pitch', 0), wrist.get('roll', 0), wrist.get('yaw', 0),
+        hand.get('pitch', 0), hand.get('roll', 0), hand.get('yaw', 0),
+        force.get('force', 0),
+    )
+
+
+def clean_values(values):
+    """
+    تحويل قيم السنسورات إلى float والتحقق منها (13 قيمة محدودة)
+    ValueError للقيم غير الصالحة (null, نص, NaN, inf) حتى لا تصل لطابور الكتابة
+    """
+    from .models import SENSOR_FIELDS
+
+    try:
+        values = [float(value) for value in values]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid sensor value")
+    if len(values) != len(SENSOR_FIELDS):
+        raise ValueError(f"Expected {len(SENSOR_FIELDS)} sensor values, got {len(values)}")
+    if not all(map(math.isfinite, values)):
+        raise ValueError("Non-finite sensor value")
+    return values
+
+
+def make_sensor_reading(device_id, values, exercise='', difficulty='', session_duration=0,
+                        mode='normal', timestamp=None, session_id=None):
+    """إنشاء SensorReading (بدون حفظ) من قيم السنسورات (ValueError للقيم غير الصالحة)"""
+    from .models import SENSOR_FIELDS, SensorReading
+
+    values = clean_values(values)
+
+    reading = SensorReading(
+        device_id=device_id,
+        session_id=session_id,
+        exercise_type=exercise,
+        difficulty=difficulty,
+        session_duration=session_duration,
+        mode=mode,
+        timestamp=timestamp or timezone.now(),
+    )
+    for field, value in zip(SENSOR_FIELDS, values):
+        setattr(reading, field, value)
+    return reading
+
+
+def build_sensor_reading(device_id, data, session_id=None):
+    """تحويل رسالة sensor_data (JSON) إلى SensorReading (بدون حفظ)"""
+    return make_sensor_reading(
+        device_id,
+        sensor_values(data),
+        exercise=data.get('exercise', ''),
+        difficulty=data.get('difficulty', ''),
+        session_duration=data.get('session_duration', 0),
+        mode=data.get('mode', 'normal'),
+        session_id=session_id,
+    )
+
+
+def sample_timestamps(device_timestamps, received_at=None):
+    """
+    حساب وقت كل عينة في دفعة من timestamps الجهاز (ms):
+    آخر عينة = وقت الاستقبال، والباقي بالفرق عنها
+    """
+    received_at = received_at or timezone.now()
+    if not device_timestamps:
+        return []
+    last = device_timestamps[-1]
+    return [
+        received_at - timedelta(milliseconds=(last - t) & 0xFFFFFFFF)
+        for t in device_timestamps
+    ]
+
+
+def apply_session_counters(readings):
+    """
+    تحديث عدادات الجلسات لدفعة قراءات: total_readings, first/last_sample_at, duration
+    (استعلام واحد للقراءة و bulk_update واحد)
+    """
+    from .models import Session
+
+    batches = {}
+    for reading in readings:
+        if reading.session_id is None:
+            continue
+        entry = batches.get(reading.session_id)
+        if entry is None:
+            batches[reading.session_id] = [1, reading.timestamp, reading.timestamp]
+        else:
+            entry[0] += 1
+            if reading.timestamp < entry[1]:
+                entry[1] = reading.timestamp
+            if reading.timestamp > entry[2]:
+                entry[2] = reading.timestamp
+    if not batches:
+        return 0
+
+    sessions = Session.objects.filter(pk__in=batches).only(
+        'start_time', 'end_time', 'duration', 'total_readings', 'first_sample_at', 'last_sample_at'
+    )
+    for session in sessions:
+        count, first, last = batches[session.pk]
+        session.total_readings += count
+        if session.first_sample_at is None or first < session.first_sample_at:
+            session.first_sample_at = first
+        if session.last_sample_at is None or last > session.last_sample_at:
+            session.last_sample_at = last
+        # الجلسة المنتهية تحتفظ بالمدة التي حسبها end_session
+        if session.end_time is None:
+            session.duration = max(0, int((session.last_sample_at - session.start_time).total_seconds()))
+
+    Session.objects.bulk_update(
+        sessions, ['total_readings', 'first_sample_at', 'last_sample_at', 'duration']
+    )
+    return len(sessions)
+
+
+def write_readings(readings):
+    """كتابة دفعة قراءات وتحديث الـ rollups وعدادات الجلسات والملخصات في transaction واحدة"""
+    from .models import SensorReading
+    from .rollups import apply_rollups
+    from .summary import record_readings
+
+    with transaction.atomic():
+        SensorReading.objects.bulk_create(readings, batch_size=500)
+        try:
+            with transaction.atomic():
+                apply_session_counters(readings)
+        except Exception as e:
+            logger.error(f"Error updating session counters for {len(readings)} readings: {e}")
+        try:
+            with transaction.atomic():
+                record_readings(readings)
+        except Exception as e:
+            logger.error(f"Error updating device summaries for {len(readings)} readings: {e}")
+        try:
+            with transaction.atomic():
+                apply_rollups(readings)
+        except Exception as e:
+            logger.error(f"Error updating rollups for {len(readings)} readings: {e}")
+    return len(readings)
+
+
+class SensorBuffer:
+    """
+    Buffer لكل جهاز: يجمع الإطارات ويكتبها بـ bulk_create
+    عند الوصول لحجم الدفعة أو انتهاء عمرها
+    """
+
+    def __init__(self, device_id, batch_size=None, max_age=None):
+        self.device_id = device_id
+        self.batch_size = batch_size or BATCH_SIZE
+        self.max_age = MAX_AGE if max_age is None else max_age
+        self.readings = []
+        self.first_added = None
+        # القراءات المُرسلة لطابور الكتابة (المكتوب فعلاً في ingest_queue.rows_written)
+        self.rows_queued = 0
+        self._timer = None
+        _live_buffers.add(self)
+
+    def __len__(self):
+        return len(self.readings)
+
+    async def add(self, reading):
+        """إضافة قراءة وكتابة الدفعة إذا امتلأت أو انتهى عمرها"""
+        if not self.readings:
+            self.first_added = time.monotonic()
+            self._schedule_timer()
+        self.readings.append(reading)
+
+        if self.is_due():
+            await self.flush()
+
+    async def extend(self, readings):
+        """إضافة دفعة قراءات (sensor_batch) كعملية واحدة"""
+        if not readings:
+            return
+        if not self.readings:
+            self.first_added = time.monotonic()
+            self._schedule_timer()
+        self.readings.extend(readings)
+
+        if self.is_due():
+            await self.flush()
+
+    def is_due(self):
+        """هل يجب كتابة الدفعة الآن؟"""
+        if len(self.readings) >= self.batch_size:
+            return True
+        return bool(self.readings) and time.monotonic() - self.first_added >= self.max_age
+
+    def take(self):
+        """سحب القراءات الحالية وتفريغ الـ buffer"""
+        readings, self.readings = self.readings, []
+        self.first_added = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return readings
+
+    async def flush(self):
+        """إرسال القراءات المتجمعة إلى طابور الكتابة"""
+        readings = self.take()
+        if not readings:
+            return 0
+        await ingest_queue.put(self.device_id, readings)
+        self.rows_queued += len(readings)
+        return len(readings)
+
+    def flush_sync(self):
+        """كتابة متزامنة (تُستخدم عند إيقاف السيرفر)"""
+        readings = self.take()
+        if not readings:
+            return 0
+        try:
+            return write_readings(readings)
+        except Exception as e:
+            logger.error(f"Error writing {len(readings)} readings for {self.device_id}: {e}")
+            return 0
+
+    def _schedule_timer(self):
+        """جدولة كتابة الدفعة عند انتهاء عمرها (للأجهزة البطيئة)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer = loop.call_later(self.max_age, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if self.readings:
+            run_in_background(self.flush(), f"timed flush for {self.device_id}")
+
+
+class IngestQueue:
+    """
+    طابور كتابة واحد لكل العملية (asyncio.Queue محدود الحجم)
+    يفرغه writer task واحد يكتب عبر thread واحد (اتصال قاعدة بيانات واحد)
+    """
+
+    def __init__(self, maxsize=None, policy=None):
+        self.maxsize = maxsize or QUEUE_SIZE
+        self.policy = policy or OVERFLOW_POLICY
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown ingest overflow policy: {self.policy}")
+        # أقصى عدد قراءات في دفعة مدمجة (coalesce) لجهاز واحد
+        self.max_coalesced = BATCH_SIZE * 10
+
+        self.queue = None
+        self.dropped_frames = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        self._loop = None
+        self._writer = None
+        # آخر دفعة في الطابور لكل جهاز (لسياسة coalesce)
+        self._queued_by_device = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='basky-ingest')
+
+    # ------------------------------------------
+    # Producer
+    # ------------------------------------------
+
+    async def put(self, device_id, readings):
+        """إضافة دفعة قراءات للطابور حسب سياسة الامتلاء"""
+        self._ensure_started()
+        item = (device_id, readings)
+
+        if self.policy == OVERFLOW_BLOCK:
+            await self.queue.put(item)
+        elif not self.queue.full():
+            self.queue.put_nowait(item)
+        elif self.policy == OVERFLOW_COALESCE and device_id in self._queued_by_device:
+            # دمج القراءات مع دفعة الجهاز الموجودة في الطابور
+            queued = self._queued_by_device[device_id]
+            queued.extend(readings)
+            overflow = len(queued) - self.max_coalesced
+            if overflow > 0:
+                del queued[:overflow]
+                self.dropped_frames += overflow
+            return
+        else:
+            self._drop_oldest()
+            self.queue.put_nowait(item)
+
+        self._queued_by_device[device_id] = readings
+
+    def _drop_oldest(self):
+        """حذف أقدم دفعة في الطابور"""
+        device_id, readings = self.queue.get_nowait()
+        self.queue.task_done()
+        self._forget(device_id, readings)
+        self.dropped_frames += len(readings)
+        logger.warning(f"Ingest queue full, dropped {len(readings)} frames from {device_id}")
+
+    def _forget(self, device_id, readings):
+        if self._queued_by_device.get(device_id) is readings:
+            del self._queued_by_device[device_id]
+
+    # ------------------------------------------
+    # Writer
+    # ------------------------------------------
+
+    def _ensure_started(self):
+        """إنشاء الطابور والـ writer task على الـ event loop الحالي"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._writer is not None and not self._writer.done():
+            return
+
+        # الطابور مرتبط بالـ event loop، ننقل أي دفعات متبقية من loop سابق
+        leftover = self._take_all()
+        self._loop = loop
+        self.queue = asyncio.Queue(self.maxsize)
+        for item in leftover:
+            self.queue.put_nowait(item)
+        self._writer = loop.create_task(self._run_writer())
+
+    async def _run_writer(self):
+        """Writer task: يسحب الدفعات ويكتبها في transaction واحدة"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            # دمج كل ما هو متاح في الطابور في كتابة واحدة
+            while not self.queue.empty() and len(items) < 50:
+                items.append(self.queue.get_nowait())
+
+            readings = []
+            for device_id, batch in items:
+                self._forget(device_id, batch)
+                readings.extend(batch)
+
+            try:
+                self.rows_written += await loop.run_in_executor(self._executor, self._write, readings)
+            except Exception as e:
+                logger.error(f"Error writing {len(readings)} readings, retrying per device: {e}")
+                # دفعة جهاز واحد لا تُسقط بيانات باقي الأجهزة المدمجة معها
+                for device_id, batch in items:
+                    try:
+                        self.rows_written += await loop.run_in_executor(self._executor, self._write, batch)
+                    except Exception as e:
+                        self.write_errors += 1
+                        self.dropped_frames += len(batch)
+                        logger.error(f"Error writing {len(batch)} readings from {device_id}: {e}")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    @staticmethod
+    def _write(readings):
+        from django.db import close_old_connections
+
+        close_old_connections()
+        return write_readings(readings)
+
+    def _take_all(self):
+        items = []
+        while self.queue is not None and not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        self._queued_by_device.clear()
+        return items
+
+    async def join(self):
+        """انتظار كتابة كل الدفعات الموجودة في الطابور"""
+        if self.queue is not None:
+            await self.queue.join()
+
+    def drain_sync(self):
+        """كتابة متزامنة لكل ما في الطابور (عند إيقاف السيرفر)"""
+        readings = []
+        for _, batch in self._take_all():
+            readings.extend(batch)
+        if not readings:
+            return 0
+        written = write_readings(readings)
+        self.rows_written += written
+        return written
+
+    def stats(self):
+        """إحصائيات الطابور"""
+        return {
+            'policy': self.policy,
+            'max_size': self.maxsize,
+            'depth': self.queue.qsize() if self.queue is not None else 0,
+            'dropped_frames': self.dropped_frames,
+            'rows_written': self.rows_written,
+            'write_errors': self.write_errors,
+        }
+
+
+ingest_queue = IngestQueue()
+
+
+@atexit.register
+def flush_all_buffers():
+    """كتابة كل الـ buffers والطابور المتبقي عند إيقاف السيرفر"""
+    total = 0
+    try:
+        total += ingest_queue.drain_sync()
+    except Exception as e:
+        logger.error(f"Error draining ingest queue on shutdown: {e}")
+    for buffer in list(_live_buffers):
+        total += buffer.flush_sync()
+    if total:
+        logger.info(f"Flushed {total} buffered readings on shutdown")
+    return total
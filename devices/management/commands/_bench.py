@@ -0,0 +1,62 @@
+"""
+أدوات مشتركة لأوامر الـ benchmark
+"""
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def benchmark_database(on_disk=True):
+    """
+    إنشاء قاعدة بيانات اختبار مؤقتة للـ benchmark ثم حذفها.
+    on_disk=True يستخدم ملف SQLite حقيقي حتى تظهر تكلفة الـ commit.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    tmp_dir = None
+    if on_disk and connection.vendor == 'sqlite':
+        tmp_dir = tempfile.mkdtemp(prefix='basky_bench_')
+        test_settings['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        if tmp_dir:
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+            os.rmdir(tmp_dir)
+
+
+class Timer:
+    """قياس الوقت المنقضي"""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def percentile(values, pct):
+    """حساب percentile من قائمة قيم"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def with_scope(app, **extra):
+    """تطبيق ASGI مع إضافة قيم للـ scope (client, user ...)"""
+    async def wrapped(scope, receive, send):
+        return await app(dict(scope, **extra), receive, send)
+    return wrapped
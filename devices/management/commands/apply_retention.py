@@ -0,0 +1,44 @@
+"""
+تطبيق سياسات الاحتفاظ على جداول بيانات الأجهزة (BASKY_RETENTION)
+
+    python manage.py apply_retention
+    python manage.py apply_retention --table sensor_readings --batch-size 5000
+    python manage.py apply_retention --enable-incremental-vacuum   # مرة واحدة (SQLite)
+
+مثال cron (كل ليلة 3:00):
+    0 3 * * * cd /path/to/BasKy && python manage.py apply_retention
+"""
+
+from django.core.management.base import BaseCommand
+
+from devices.retention import RETENTION_POLICIES, enable_incremental_vacuum, run_retention
+
+
+class Command(BaseCommand):
+    help = 'Archive and delete telemetry older than the configured retention, in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', action='append', choices=list(RETENTION_POLICIES),
+                            help='Only process this table (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to sleep between batches')
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help='Switch SQLite to auto_vacuum=INCREMENTAL (runs a full VACUUM once)')
+
+    def handle(self, *args, **options):
+        if options['enable_incremental_vacuum']:
+            if enable_incremental_vacuum():
+                self.stdout.write(self.style.SUCCESS('SQLite auto_vacuum set to INCREMENTAL'))
+
+        results = run_retention(
+            tables=options['table'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+        )
+
+        self.stdout.write(f"{'table':<20} {'archived':>10} {'deleted':>10} {'seconds':>9} {'rows/s':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['table']:<20} {result['archived']:>10} {result['deleted']:>10} "
+                f"{result['seconds']:>9.2f} {result['rows_per_second']:>9}"
+            )
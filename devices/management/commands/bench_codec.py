@@ -0,0 +1,99 @@
+"""
+Microbenchmark لترميز وفك ترميز كل رسائل الـ WebSocket
+
+    python manage.py bench_codec --number 20000
+"""
+
+import json
+import timeit
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from devices import codec
+
+JOINT = {'pitch': 12.345678, 'roll': -45.678901, 'yaw': 170.123456}
+
+# الرسائل المرسلة للجهاز: (type, fields)
+OUTBOUND = [
+    ('connection_established', {
+        'message': 'Welcome to Basky Server!',
+        'server_version': '1.0.0',
+        'capabilities': {'formats': ['json', 'binary'], 'binary_frame_version': 1,
+                         'sensor_batch': True, 'max_batch_samples': 200},
+    }),
+    ('format_ack', {'format': 'binary', 'binary_frame_version': 1}),
+    ('session_confirmed', {'message': 'Session started successfully'}),
+    ('wifi_reset_confirmed', {'message': 'Device will restart shortly'}),
+    ('start_session', {'name': 'طفل', 'role': 'Parent', 'difficulty': 'medium', 'exercise': 'Stretching'}),
+    ('stop_session', {}),
+    ('calibrate', {}),
+    ('ai_correction', {'correction_needed': True, 'shoulder': JOINT, 'elbow': JOINT, 'wrist': JOINT,
+                       'feedback': 'Raise your elbow'}),
+    ('motor_control', {'shoulder': JOINT, 'elbow': JOINT, 'wrist': JOINT}),
+    ('get_network_info', {}),
+    ('reset_wifi', {}),
+    ('ping', {}),
+    ('error', {'message': 'Invalid JSON format'}),
+]
+
+# الرسائل المستقبلة من الجهاز
+INBOUND = {
+    'status': {'type': 'status', 'status': 'connected', 'device_id': 'basky_192_168_1_50',
+               'message': 'Device ready', 'mode': 'normal'},
+    'sensor_data': {'type': 'sensor_data', 'shoulder': JOINT, 'elbow': JOINT, 'wrist': JOINT, 'hand': JOINT,
+                    'force': {'force': 12.5}, 'exercise': 'Stretching', 'difficulty': 'medium',
+                    'session_duration': 42, 'mode': 'normal', 'timestamp': 123456},
+    'sensor_batch': {'type': 'sensor_batch', 'sequence': 100, 'exercise': 'Stretching',
+                     'samples': [{'t': 123456 + 10 * i, 'v': [12.345678] * 13} for i in range(10)]},
+    'session_ack': {'type': 'session_ack', 'status': 'started'},
+    'network_info': {'type': 'network_info', 'ssid': 'Clinic', 'ip': '192.168.1.50', 'rssi': -60,
+                     'ws_host': '192.168.1.10', 'ws_port': 8000, 'connected': True},
+    'wifi_reset_ack': {'type': 'wifi_reset_ack'},
+    'pong': {'type': 'pong'},
+}
+
+
+def baseline_dumps(message_type, fields):
+    """المسار القديم: dict جديد + json.dumps + datetime.now().isoformat()"""
+    return json.dumps({'type': message_type, **fields, 'timestamp': datetime.now().isoformat()})
+
+
+def codec_dumps(message_type, fields):
+    if not fields and message_type in codec.STATIC_MESSAGES:
+        return codec.envelope(message_type)
+    return codec.message(message_type, **fields)
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark the WebSocket message codec (stdlib json vs codec layer)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20000, help='Iterations per message')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        backends = [codec.get_codec('json')]
+        if codec.orjson is not None:
+            backends.append(codec.get_codec('orjson'))
+
+        self.stdout.write(f"codec in use: {codec.codec.name}\n")
+        self.stdout.write(f"{'encode':<24} {'baseline us':>12} {'codec us':>10} {'speedup':>8}")
+        for message_type, fields in OUTBOUND:
+            before = self.time(lambda: baseline_dumps(message_type, fields), number)
+            after = self.time(lambda: codec_dumps(message_type, dict(fields)), number)
+            self.stdout.write(f"{message_type:<24} {before:>12.2f} {after:>10.2f} {before / after:>7.1f}x")
+
+        self.stdout.write('')
+        header = ''.join(f" {backend.name + ' us':>12}" for backend in backends)
+        self.stdout.write(f"{'decode':<24}{header}")
+        for message_type, payload in INBOUND.items():
+            text = json.dumps(payload)
+            timings = ''.join(
+                f" {self.time(lambda: backend.loads(text), number):>12.2f}" for backend in backends
+            )
+            self.stdout.write(f"{message_type:<24}{timings}")
+
+    def time(self, func, number):
+        """متوسط زمن الاستدعاء بالميكروثانية"""
+        return min(timeit.repeat(func, number=number, repeat=3)) / number * 1_000_000
@@ -0,0 +1,140 @@
+"""
+Benchmark لـ API التحكم تحت ASGI: الـ async views مقابل المسار القديم
+(sync view → thread pool → async_to_sync(send_command_to_device))
+
+    python manage.py bench_control --requests 500 --concurrency 1 10 50 100
+"""
+
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+from django.test import Client, override_settings
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+
+from devices import views
+from devices.consumers import BaskyDeviceConsumer
+from devices.models import DeviceConfig
+
+from ._bench import benchmark_database, percentile, with_scope
+
+DEVICE_ID = 'bench_control_device'
+
+
+@csrf_exempt
+@login_required
+def sync_ping_device_api(request, device_id):
+    """نسخة من ping_device_api قبل تحويلها إلى async (للمقارنة فقط)"""
+    success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(device_id, 'ping', {})
+    return JsonResponse({'success': success})
+
+
+# URLconf الـ benchmark: نفس الـ endpoint بالمسارين
+urlpatterns = [
+    path('sync/<str:device_id>/ping/', sync_ping_device_api),
+    path('async/<str:device_id>/ping/', views.ping_device_api),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare latency/throughput of async control views against the sync async_to_sync path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per run')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100])
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True), override_settings(
+            ROOT_URLCONF=__name__,
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        ):
+            user = get_user_model().objects.create_user(
+                email='bench@basky.local', password='bench', national_id='bench'
+            )
+            DeviceConfig.objects.create(device_id=DEVICE_ID, user=user)
+            client = Client()
+            client.force_login(user)
+            cookie = f"sessionid={client.cookies['sessionid'].value}"
+
+            asyncio.run(self.run(cookie, options))
+
+    async def run(self, cookie, options):
+        # جهاز متصل يستقبل الأوامر (ويُفرغ رسائله في الخلفية)
+        device = WebsocketCommunicator(with_scope(BaskyDeviceConsumer.as_asgi(), client=('127.0.0.1', 40000)), '/ws/')
+        await device.connect()
+        await device.receive_from()
+        await device.send_json_to({'type': 'status', 'status': 'connected', 'device_id': DEVICE_ID})
+        await device.receive_from()
+        drain = asyncio.ensure_future(self.drain(device))
+
+        handler = ASGIHandler()
+        self.stdout.write(f"{'path':<6} {'concurrency':>11} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for concurrency in options['concurrency']:
+            for name in ('sync', 'async'):
+                url = f'/{name}/{DEVICE_ID}/ping/'
+                await self.request(handler, url, cookie)  # warm-up
+                latencies, errors, elapsed = await self.load(handler, url, cookie, options['requests'], concurrency)
+                self.stdout.write(
+                    f"{name:<6} {concurrency:>11} {len(latencies) / elapsed:>9.0f} "
+                    f"{percentile(latencies, 50):>9.2f} {percentile(latencies, 99):>9.2f} {errors:>7}"
+                )
+
+        drain.cancel()
+        await asyncio.gather(drain, return_exceptions=True)
+        await device.disconnect()
+
+    async def drain(self, device):
+        while True:
+            await device.receive_from(timeout=None)
+
+    async def load(self, handler, url, cookie, total, concurrency):
+        """إرسال total طلب بحد أقصى concurrency طلب في نفس الوقت"""
+        latencies = []
+        errors = 0
+        remaining = iter(range(total))
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                ok = await self.request(handler, url, cookie)
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def request(self, handler, url, cookie):
+        """طلب POST واحد عبر ASGIHandler مباشرة (بدون شبكة)"""
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'POST', 'scheme': 'http', 'path': url, 'raw_path': url.encode(),
+            'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        response = {}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['body'] = response.get('body', b'') + message.get('body', b'')
+
+        await handler(scope, receive, send)
+        return response.get('status') == 200 and json.loads(response['body']).get('success') is True
@@ -0,0 +1,110 @@
+"""
+Load test لبث الـ Dashboard: جهاز واحد يرسل بمعدل عالٍ وعدة مشاهدين بمعدل محدود
+
+    python manage.py bench_dashboard --viewers 50 --rate 100 --max-fps 10 --duration 5
+"""
+
+import asyncio
+import json
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from devices.ingest import ingest_queue
+from devices.models import DeviceConfig
+from devices.protocol import encode_sensor_frame
+from devices.routing import websocket_urlpatterns
+
+from ._bench import benchmark_database, percentile, with_scope
+
+DEVICE_ID = 'bench_dashboard_device'
+
+
+class Viewer:
+    """مشاهد Dashboard واحد: يستقبل الرسائل ويسجل المعدل والتأخير"""
+
+    def __init__(self, communicator):
+        self.communicator = communicator
+        self.samples = 0
+        self.lags = []
+
+    async def run(self, started):
+        # يعمل حتى يُلغى (timeout=None لأن انتهاء المهلة يوقف التطبيق في WebsocketCommunicator)
+        while True:
+            message = json.loads(await self.communicator.receive_from(timeout=None))
+            if message['type'] == 'sensor_data':
+                self.samples += 1
+                now_ms = (time.monotonic() - started) * 1000
+                self.lags.append(now_ms - message['device_timestamp'])
+
+
+class Command(BaseCommand):
+    help = 'Load test dashboard fan-out: one device streaming to many rate-limited viewers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viewers', type=int, default=50)
+        parser.add_argument('--rate', type=float, default=100, help='Device samples per second')
+        parser.add_argument('--max-fps', type=float, default=10, help='Viewer max update rate')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds')
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=False):
+            user = get_user_model().objects.create_user(
+                email='bench@basky.local', password='bench', national_id='bench'
+            )
+            DeviceConfig.objects.create(device_id=DEVICE_ID, user=user)
+            asyncio.run(self.run(user, options))
+
+    async def run(self, user, options):
+        app = with_scope(URLRouter(websocket_urlpatterns), client=('127.0.0.1', 40000), user=user)
+
+        device = WebsocketCommunicator(app, '/ws/')
+        await device.connect()
+        await device.receive_from()
+        await device.send_json_to({'type': 'status', 'status': 'connected', 'device_id': DEVICE_ID, 'format': 'binary'})
+        await device.receive_from()
+
+        viewers = []
+        for _ in range(options['viewers']):
+            communicator = WebsocketCommunicator(app, f"/ws/device/{DEVICE_ID}/stream/?max_fps={options['max_fps']}")
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError('Viewer connection rejected')
+            await communicator.receive_from()  # subscribed
+            viewers.append(Viewer(communicator))
+
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(viewer.run(started)) for viewer in viewers]
+
+        interval = 1 / options['rate']
+        sent = 0
+        while time.monotonic() - started < options['duration']:
+            device_ms = int((time.monotonic() - started) * 1000)
+            await device.send_to(bytes_data=encode_sensor_frame(sent, device_ms, [float(sent)] * 13))
+            sent += 1
+            next_at = started + sent * interval
+            await asyncio.sleep(max(0, next_at - time.monotonic()))
+        elapsed = time.monotonic() - started
+
+        await asyncio.sleep(0.5)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for viewer in viewers:
+            await viewer.communicator.disconnect()
+        await device.disconnect()
+        await ingest_queue.join()
+
+        rates = [viewer.samples / elapsed for viewer in viewers]
+        lags = [lag for viewer in viewers for lag in viewer.lags]
+        delivered = sum(viewer.samples for viewer in viewers)
+
+        self.stdout.write(f"device samples sent:      {sent} ({sent / elapsed:.0f}/s)")
+        self.stdout.write(f"viewers:                  {len(viewers)} @ max {options['max_fps']} fps")
+        self.stdout.write(f"viewer fps min/avg/max:   {min(rates):.1f} / {sum(rates) / len(rates):.1f} / {max(rates):.1f}")
+        self.stdout.write(f"messages delivered:       {delivered} (without downsampling: {sent * len(viewers)})")
+        self.stdout.write(f"lag p50 / p99 (ms):       {percentile(lags, 50):.1f} / {percentile(lags, 99):.1f}")
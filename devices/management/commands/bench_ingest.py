@@ -0,0 +1,101 @@
+"""
+Benchmark لكتابة قراءات السنسورات: إطار لكل create() مقابل SensorBuffer + طابور الكتابة
+
+    python manage.py bench_ingest --devices 1 10 100 --frames 200
+"""
+
+import asyncio
+import random
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+
+from devices.ingest import SensorBuffer, build_sensor_reading, ingest_queue
+from devices.models import SensorReading
+
+from ._bench import Timer, benchmark_database
+
+
+def fake_frame():
+    """إطار sensor_data عشوائي بنفس شكل رسالة الجهاز"""
+    def joint():
+        return {
+            'pitch': random.uniform(-90, 90),
+            'roll': random.uniform(-90, 90),
+            'yaw': random.uniform(-180, 180),
+        }
+
+    return {
+        'type': 'sensor_data',
+        'shoulder': joint(),
+        'elbow': joint(),
+        'wrist': joint(),
+        'hand': joint(),
+        'force': {'force': random.uniform(0, 50)},
+        'exercise': 'Stretching',
+        'difficulty': 'medium',
+        'session_duration': 0,
+        'mode': 'normal',
+    }
+
+
+@database_sync_to_async
+def save_one(reading):
+    """المسار القديم: create() لكل إطار"""
+    reading.save()
+
+
+async def run_per_frame(device_id, frames):
+    for frame in frames:
+        await save_one(build_sensor_reading(device_id, frame))
+
+
+async def run_buffered(device_id, frames, batch_size):
+    buffer = SensorBuffer(device_id, batch_size=batch_size)
+    for frame in frames:
+        await buffer.add(build_sensor_reading(device_id, frame))
+    await buffer.flush()
+    await ingest_queue.join()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark sensor ingestion rows/sec (per-frame create vs buffered bulk_create)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--frames', type=int, default=200, help='Frames per device')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--in-memory', action='store_true', help='Use in-memory SQLite instead of a temp file')
+
+    def handle(self, *args, **options):
+        frames = [fake_frame() for _ in range(options['frames'])]
+
+        with benchmark_database(on_disk=not options['in_memory']):
+            self.stdout.write(f"{'devices':>8} {'rows':>8} {'per-frame rows/s':>18} {'buffered rows/s':>18} {'speedup':>8}")
+            for device_count in options['devices']:
+                ingest_queue.dropped_frames = 0
+                device_ids = [f'bench_{i}' for i in range(device_count)]
+                rows = device_count * len(frames)
+
+                before = self.measure((run_per_frame(d, frames) for d in device_ids), rows)
+                after = self.measure((run_buffered(d, frames, options['batch_size']) for d in device_ids), rows)
+
+                self.stdout.write(
+                    f"{device_count:>8} {rows:>8} {rows / before:>18.0f} {rows / after:>18.0f} {before / after:>7.1f}x"
+                )
+                if ingest_queue.dropped_frames:
+                    self.stdout.write(f"{'':>8} dropped by ingest queue: {ingest_queue.dropped_frames}")
+
+    def measure(self, coroutines, expected_rows):
+        """تشغيل كل الأجهزة بالتوازي وإرجاع الوقت المستغرق"""
+        async def run_all():
+            await asyncio.gather(*coroutines)
+
+        with Timer() as timer:
+            asyncio.run(run_all())
+
+        written = SensorReading.objects.count()
+        if written != expected_rows:
+            self.stderr.write(f"Expected {expected_rows} rows, found {written}")
+        SensorReading.objects.all().delete()
+        return timer.elapsed
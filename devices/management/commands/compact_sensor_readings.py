@@ -0,0 +1,55 @@
+"""
+ضغط القراءات القديمة من SensorReading إلى SensorChunk
+
+    python manage.py compact_sensor_readings --days 7
+    python manage.py compact_sensor_readings --days 1 --device basky_192_168_1_50
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from devices.models import SensorChunk, SensorReading
+from devices.timeseries import compact_readings
+
+
+class Command(BaseCommand):
+    help = 'Pack raw sensor readings older than N days into SensorChunk rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Compact readings older than this')
+        parser.add_argument('--device', action='append', help='Device id (repeatable, default: all)')
+        parser.add_argument('--chunk-seconds', type=int, default=None)
+        parser.add_argument('--max-samples', type=int, default=None)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        device_ids = options['device'] or (
+            SensorReading.objects.filter(timestamp__lt=before)
+            .order_by().values_list('device_id', flat=True).distinct()
+        )
+
+        chunks_before = SensorChunk.objects.count()
+        started = time.monotonic()
+        total = 0
+        for device_id in device_ids:
+            compacted = compact_readings(
+                device_id, before,
+                chunk_seconds=options['chunk_seconds'],
+                max_samples=options['max_samples'],
+            )
+            total += compacted
+            if compacted:
+                self.stdout.write(f"{device_id}: {compacted} readings compacted")
+
+        elapsed = time.monotonic() - started
+        chunk_bytes = SensorChunk.objects.aggregate(total=Sum(Length('data')))['total'] or 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {total} readings into {SensorChunk.objects.count() - chunks_before} chunks "
+            f"in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s); "
+            f"chunk data now {chunk_bytes / 1024:.0f} KiB"
+        ))
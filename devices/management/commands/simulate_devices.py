@@ -0,0 +1,275 @@
+"""
+محاكي أجهزة ESP32 ومولد حمل للـ ingest: N جهاز وهمي متصل بالـ BaskyDeviceConsumer
+داخل نفس العملية (WebsocketCommunicator) على قاعدة بيانات اختبار مؤقتة
+
+    python manage.py simulate_devices --devices 100 --rate 50 --format binary-batch --duration 30
+    python manage.py simulate_devices --devices 20 --sessions --jitter 20 --churn 0.02
+
+التقرير: العينات المرسلة، الصفوف المكتوبة في قاعدة البيانات، معدل الكتابة،
+وزمن العينة حتى commit صفها (p50/p99)، وزمن تأكيد أوامر الجلسات.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from devices.consumers import BaskyDeviceConsumer
+from devices.ingest import MAX_BATCH_SAMPLES, ingest_queue
+from devices.models import DeviceConfig, SensorReading, Session
+from devices.protocol import encode_sensor_batch, encode_sensor_frame
+
+from ._bench import benchmark_database, percentile, with_scope
+
+FORMATS = ('json', 'batch', 'binary', 'binary-batch')
+JOINTS = ('shoulder', 'elbow', 'wrist', 'hand')
+
+
+def sensor_message(values, **fields):
+    """رسالة sensor_data بنفس شكل رسالة الجهاز"""
+    message = {'type': 'sensor_data', **fields}
+    for index, joint in enumerate(JOINTS):
+        pitch, roll, yaw = values[index * 3:index * 3 + 3]
+        message[joint] = {'pitch': pitch, 'roll': roll, 'yaw': yaw}
+    message['force'] = {'force': values[12]}
+    return message
+
+
+class CommitTracker:
+    """
+    زمن كل عينة حتى commit صفها: يغلف كتابة طابور الـ ingest ويطابق
+    الصفوف المكتوبة لكل جهاز (بالترتيب) مع أوقات إنشاء عيناته
+    """
+
+    def __init__(self):
+        self.sample_times = defaultdict(list)
+        self.committed = defaultdict(int)
+        self.latencies = []
+        self.rows = 0
+        self.last_commit = None
+
+    def install(self, queue):
+        write = queue._write
+
+        def tracked_write(readings):
+            written = write(readings)
+            now = time.monotonic()
+            for reading in readings:
+                times = self.sample_times[reading.device_id]
+                index = self.committed[reading.device_id]
+                self.committed[reading.device_id] += 1
+                if index < len(times):
+                    self.latencies.append((now - times[index]) * 1000)
+            self.rows += written
+            self.last_commit = now
+            return written
+
+        queue._write = tracked_write
+        return write
+
+
+class SimulatedDevice:
+    """جهاز وهمي: يتصل، يرد على الأوامر، ويرسل العينات بالمعدل المطلوب"""
+
+    def __init__(self, app, device_id, options, tracker):
+        self.app = app
+        self.device_id = device_id
+        self.options = options
+        self.tracker = tracker
+        self.communicator = None
+        self.reader = None
+        self.sequence = 0
+        self.sent = 0
+        self.reconnects = 0
+        self.errors = 0
+
+    async def connect(self):
+        binary = self.options['format'].startswith('binary')
+        self.communicator = WebsocketCommunicator(self.app, '/ws/')
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError(f'{self.device_id}: connection rejected')
+        await self.communicator.receive_from()  # connection_established
+        await self.communicator.send_json_to({
+            'type': 'status', 'status': 'connected', 'device_id': self.device_id,
+            'format': 'binary' if binary else 'json',
+        })
+        await self.communicator.receive_from()  # format_ack
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def disconnect(self):
+        self.reader.cancel()
+        await asyncio.gather(self.reader, return_exceptions=True)
+        await self.communicator.disconnect()
+
+    async def read(self):
+        """الرد على الأوامر مثل الـ firmware (session_ack / pong)"""
+        while True:
+            message = json.loads(await self.communicator.receive_from(timeout=None))
+            reply = {'start_session': 'session_ack', 'ping': 'pong'}.get(message['type'])
+            if message['type'] == 'error':
+                self.errors += 1
+            elif reply:
+                await self.communicator.send_json_to({'type': reply, 'id': message.get('id'), 'status': 'ok'})
+
+    async def run(self, started, duration):
+        """إرسال العينات حتى انتهاء المدة (مجموعة كل batch عينة في رسالة)"""
+        rate = self.options['rate']
+        batch = self.options['batch_size'] if self.options['format'].endswith('batch') else 1
+        jitter = self.options['jitter'] / 1000
+        churn = self.options['churn']
+        times = self.tracker.sample_times[self.device_id]
+        generated = 0
+
+        while time.monotonic() - started < duration:
+            # موعد آخر عينة في المجموعة + تأخير الشبكة
+            due = started + (generated + batch) / rate
+            await asyncio.sleep(max(0, due - time.monotonic()) + random.uniform(0, jitter))
+
+            samples = []
+            for index in range(generated, generated + batch):
+                values = [random.uniform(-90, 90) for _ in range(12)] + [random.uniform(0, 50)]
+                samples.append((int(index * 1000 / rate), values))
+                times.append(started + (index + 1) / rate)
+            generated += batch
+
+            await self.send(samples)
+            self.sent += len(samples)
+
+            # انقطاع وإعادة اتصال (churn: احتمال الانقطاع في الثانية)
+            if churn and random.random() < churn * batch / rate:
+                await self.disconnect()
+                await asyncio.sleep(random.uniform(0.1, 1.0))
+                await self.connect()
+                self.reconnects += 1
+
+    async def send(self, samples):
+        payload = self.options['format']
+        if payload == 'json':
+            for device_ms, values in samples:
+                await self.communicator.send_json_to(sensor_message(values, mode='normal'))
+        elif payload == 'batch':
+            await self.communicator.send_json_to({
+                'type': 'sensor_batch',
+                'sequence': self.sequence,
+                'samples': [{'t': device_ms, 'v': values} for device_ms, values in samples],
+            })
+        elif payload == 'binary':
+            for device_ms, values in samples:
+                await self.communicator.send_to(bytes_data=encode_sensor_frame(self.sequence, device_ms, values))
+                self.sequence += 1
+        else:
+            await self.communicator.send_to(bytes_data=encode_sensor_batch(self.sequence, samples))
+        if payload.endswith('batch'):
+            self.sequence += len(samples)
+
+
+class Command(BaseCommand):
+    help = 'Simulate N ESP32 devices against BaskyDeviceConsumer and report ingest throughput/latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=20)
+        parser.add_argument('--rate', type=float, default=50, help='Samples per second per device')
+        parser.add_argument('--format', choices=FORMATS, default='json', help='Sensor payload format')
+        parser.add_argument('--batch-size', type=int, default=10, help='Samples per message (batch formats)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds')
+        parser.add_argument('--sessions', action='store_true', help='Start a session on every device first')
+        parser.add_argument('--jitter', type=float, default=0, help='Max network delay per message (ms)')
+        parser.add_argument('--churn', type=float, default=0,
+                            help='Probability per second that a device disconnects and reconnects')
+        parser.add_argument('--in-memory', action='store_true', help='Use in-memory SQLite instead of a temp file')
+
+    def handle(self, *args, **options):
+        options['batch_size'] = max(1, min(options['batch_size'], MAX_BATCH_SAMPLES))
+
+        with benchmark_database(on_disk=not options['in_memory']), override_settings(
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        ):
+            user = get_user_model().objects.create_user(
+                email='sim@basky.local', password='sim', national_id='sim'
+            )
+            device_ids = [f'sim_{index:04d}' for index in range(options['devices'])]
+            DeviceConfig.objects.bulk_create([DeviceConfig(device_id=d, user=user) for d in device_ids])
+
+            tracker = CommitTracker()
+            original_write = tracker.install(ingest_queue)
+            try:
+                asyncio.run(self.run(user, device_ids, tracker, options))
+            finally:
+                ingest_queue._write = original_write
+
+            self.report(tracker, options)
+
+    async def run(self, user, device_ids, tracker, options):
+        app = with_scope(BaskyDeviceConsumer.as_asgi(), client=('127.0.0.1', 40000))
+        self.devices = [SimulatedDevice(app, device_id, options, tracker) for device_id in device_ids]
+
+        connect_started = time.monotonic()
+        await asyncio.gather(*(device.connect() for device in self.devices))
+        self.connect_seconds = time.monotonic() - connect_started
+
+        self.command_latencies = []
+        self.command_failures = 0
+        if options['sessions']:
+            await asyncio.gather(*(self.start_session(user, device) for device in self.devices))
+
+        started = time.monotonic()
+        await asyncio.gather(*(device.run(started, options['duration']) for device in self.devices))
+        self.send_seconds = time.monotonic() - started
+
+        if options['sessions']:
+            await asyncio.gather(*(
+                BaskyDeviceConsumer.request_device(device.device_id, 'stop_session', {})
+                for device in self.devices
+            ))
+        await asyncio.gather(*(device.disconnect() for device in self.devices))
+        await ingest_queue.join()
+        self.elapsed = (tracker.last_commit or time.monotonic()) - started
+
+    async def start_session(self, user, device):
+        """بدء جلسة كما يفعل start_session_api وتسجيل زمن التأكيد"""
+        config = await DeviceConfig.objects.aget(device_id=device.device_id)
+        session = await Session.objects.acreate(
+            device=config, user=user, child_name='sim', exercise_type='Stretching',
+            difficulty='medium', is_active=True
+        )
+        result = await BaskyDeviceConsumer.request_device(device.device_id, 'start_session', {
+            'child_name': session.child_name, 'difficulty': session.difficulty,
+            'exercise': session.exercise_type, 'session_id': session.id,
+        })
+        if result['status'] == 'ok':
+            self.command_latencies.append(result['latency_ms'])
+        else:
+            self.command_failures += 1
+
+    def report(self, tracker, options):
+        sent = sum(device.sent for device in self.devices)
+        rows = SensorReading.objects.count()
+        latencies = tracker.latencies
+
+        self.stdout.write(
+            f"devices:                   {len(self.devices)} x {options['rate']:g}/s "
+            f"({options['format']}, batch {options['batch_size'] if options['format'].endswith('batch') else 1})"
+        )
+        self.stdout.write(f"connect all (s):           {self.connect_seconds:.2f}")
+        self.stdout.write(f"samples sent:              {sent} ({sent / self.send_seconds:.0f}/s)")
+        self.stdout.write(f"rows committed:            {rows} ({rows / self.elapsed:.0f}/s)")
+        self.stdout.write(f"sample->commit p50/p99 ms: {percentile(latencies, 50):.1f} / {percentile(latencies, 99):.1f}")
+        self.stdout.write(f"dropped by ingest queue:   {ingest_queue.dropped_frames}")
+        self.stdout.write(f"reconnects:                {sum(device.reconnects for device in self.devices)}")
+        self.stdout.write(f"device errors:             {sum(device.errors for device in self.devices)}")
+        if options['sessions']:
+            linked = SensorReading.objects.filter(session__isnull=False).count()
+            self.stdout.write(
+                f"session ack p50/p99 ms:    {percentile(self.command_latencies, 50):.1f} / "
+                f"{percentile(self.command_latencies, 99):.1f} ({self.command_failures} failed)"
+            )
+            self.stdout.write(f"rows linked to sessions:   {linked}")
+        if rows != sent:
+            self.stderr.write(f"Expected {sent} rows, found {rows}")
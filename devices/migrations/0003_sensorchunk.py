@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0002_sensorreading_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('exercise_type', models.CharField(blank=True, max_length=50)),
+                ('difficulty', models.CharField(blank=True, max_length=20)),
+                ('mode', models.CharField(default='normal', max_length=20)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('sample_count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('stats', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Sensor Chunk',
+                'verbose_name_plural': 'Sensor Chunks',
+                'ordering': ['-start_time'],
+                'indexes': [models.Index(fields=['device_id', '-start_time'], name='devices_sen_device__8a84c1_idx')],
+            },
+        ),
+    ]
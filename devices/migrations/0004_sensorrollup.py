@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0003_sensorchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('exercise_type', models.CharField(blank=True, max_length=50)),
+                ('resolution', models.IntegerField(choices=[(1, '1 second'), (60, '1 minute')])),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('stats', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Sensor Rollup',
+                'verbose_name_plural': 'Sensor Rollups',
+                'ordering': ['-bucket_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sensorrollup',
+            constraint=models.UniqueConstraint(fields=('device_id', 'resolution', 'bucket_start', 'exercise_type'), name='unique_sensor_rollup_bucket'),
+        ),
+    ]
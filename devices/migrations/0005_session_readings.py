@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0004_sensorrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorchunk',
+            name='session',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chunks', to='devices.session'),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='session',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='readings', to='devices.session'),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='first_sample_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='last_sample_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='sensorchunk',
+            index=models.Index(fields=['session', 'start_time'], name='devices_sen_session_d21dd8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['session', 'timestamp'], name='devices_sen_session_c00a17_idx'),
+        ),
+    ]
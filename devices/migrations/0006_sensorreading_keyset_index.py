@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_session_readings'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sensorreading',
+            name='devices_sen_device__6e3463_idx',
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['device_id', '-timestamp', '-id'], name='devices_sen_device__c04b50_idx'),
+        ),
+    ]
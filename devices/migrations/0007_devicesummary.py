@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0006_sensorreading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('total_readings', models.BigIntegerField(default=0)),
+                ('last_reading_at', models.DateTimeField(blank=True, null=True)),
+                ('total_sessions', models.IntegerField(default=0)),
+                ('completed_sessions', models.IntegerField(default=0)),
+                ('total_session_duration', models.BigIntegerField(default=0)),
+                ('last_status', models.CharField(blank=True, max_length=50)),
+                ('last_status_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Device Summary',
+                'verbose_name_plural': 'Device Summaries',
+            },
+        ),
+    ]
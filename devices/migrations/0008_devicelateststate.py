@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_devicesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceLatestState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(blank=True, max_length=50)),
+                ('message', models.TextField(blank=True)),
+                ('mode', models.CharField(default='normal', max_length=20)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('status_at', models.DateTimeField(blank=True, null=True)),
+                ('network', models.JSONField(blank=True, default=dict)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Device Latest State',
+                'verbose_name_plural': 'Device Latest States',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0008_devicelateststate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicestatus',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='devicestatus',
+            name='repeat_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -2,7 +2,7 @@ from django.db import models
 
 # Create your models here.
 
-from django.db import models
+from django.db import models, transaction
 from core.models import CustomUser
 from django.utils import timezone
 
@@ -28,6 +28,16 @@ class DeviceConfig(models.Model):
     
     def __str__(self):
         return f"{self.device_name} ({self.device_id})"
+    
+    def delete(self, *args, **kwargs):
+        """
+        حذف الجهاز مع ملخصه: الجلسات تُحذف بالـ cascade بدون Session.delete،
+        والجهاز المضاف لاحقاً بنفس الـ device_id يُبنى ملخصه من الجداول من جديد
+        """
+        device_id = self.device_id
+        result = super().delete(*args, **kwargs)
+        DeviceSummary.objects.filter(device_id=device_id).delete()
+        return result
 
 
 class DeviceStatus(models.Model):
@@ -38,6 +48,9 @@ class DeviceStatus(models.Model):
     mode = models.CharField(max_length=20, default='normal')  # normal, demo
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # نفس الحالة تكررت بعد timestamp: عدد التكرارات وآخر ظهور لها
+    last_seen = models.DateTimeField(null=True, blank=True)
+    repeat_count = models.IntegerField(default=0)
     
     class Meta:
         ordering = ['-timestamp']
@@ -48,6 +61,16 @@ class DeviceStatus(models.Model):
         return f"{self.device_id} - {self.status} at {self.timestamp}"
 
 
+# أعمدة السنسورات بالترتيب (shoulder, elbow, wrist, hand ثم force)
+SENSOR_FIELDS = (
+    'shoulder_pitch', 'shoulder_roll', 'shoulder_yaw',
+    'elbow_pitch', 'elbow_roll', 'elbow_yaw',
+    'wrist_pitch', 'wrist_roll', 'wrist_yaw',
+    'hand_pitch', 'hand_roll', 'hand_yaw',
+    'force_value',
+)
+
+
 class SensorReading(models.Model):
     """قراءات السنسورات"""
     device_id = models.CharField(max_length=100, db_index=True)
@@ -81,15 +104,24 @@ class SensorReading(models.Model):
     session_duration = models.IntegerField(default=0)  # seconds
     mode = models.CharField(max_length=20, default='normal')
     
-    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    # الجلسة النشطة للجهاز وقت الاستقبال (null خارج الجلسات)
+    session = models.ForeignKey(
+        'Session', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='readings', db_index=False
+    )
+    
+    # وقت الاستقبال (يُحدد عند وصول الإطار وليس عند الكتابة في قاعدة البيانات)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
     
     class Meta:
         ordering = ['-timestamp']
         verbose_name = "Sensor Reading"
         verbose_name_plural = "Sensor Readings"
         indexes = [
-            models.Index(fields=['device_id', '-timestamp']),
+            # يخدم أيضاً keyset pagination على (device_id, timestamp, id)
+            models.Index(fields=['device_id', '-timestamp', '-id']),
             models.Index(fields=['exercise_type', '-timestamp']),
+            models.Index(fields=['session', 'timestamp']),
         ]
     
     def __str__(self):
@@ -107,6 +139,9 @@ class Session(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
     duration = models.IntegerField(default=0)  # seconds
     total_readings = models.IntegerField(default=0)
+    # أول وآخر عينة مسجلة (تُحدَّث مع كل دفعة يكتبها الـ ingest writer)
+    first_sample_at = models.DateTimeField(null=True, blank=True)
+    last_sample_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     
     class Meta:
@@ -117,10 +152,154 @@ class Session(models.Model):
     def __str__(self):
         return f"{self.child_name} - {self.exercise_type} ({self.start_time})"
     
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        super().save(*args, **kwargs)
+        if created:
+            from .summary import record_session_created
+            record_session_created(self.device.device_id)
+        self.invalidate_stats()
+    
+    def delete(self, *args, **kwargs):
+        from .summary import record_session_deleted
+        
+        device_id = self.device.device_id
+        result = super().delete(*args, **kwargs)
+        record_session_deleted(device_id, not self.is_active, self.duration)
+        self.invalidate_stats()
+        return result
+    
+    def invalidate_stats(self):
+        """حذف إحصائيات جلسات الجهاز من الـ cache بعد الـ commit"""
+        from .stats import invalidate_session_stats
+        
+        device_pk = self.device_id
+        transaction.on_commit(lambda: invalidate_session_stats(device_pk))
+    
     def end_session(self):
         """إنهاء الجلسة"""
         self.end_time = timezone.now()
         self.duration = int((self.end_time - self.start_time).total_seconds())
         self.is_active = False
-        self.save()
+        # بدون total_readings/first/last_sample_at حتى لا نكتب فوق عدادات الـ ingest writer
+        self.save(update_fields=['end_time', 'duration', 'is_active'])
+        
+        from .summary import record_session_ended
+        record_session_ended(self.device.device_id, self.duration)
+
+
+
+class SensorChunk(models.Model):
+    """قراءات مضغوطة: نافذة زمنية من قراءات جهاز واحد في صف واحد"""
+    device_id = models.CharField(max_length=100)
+    exercise_type = models.CharField(max_length=50, blank=True)
+    difficulty = models.CharField(max_length=20, blank=True)
+    mode = models.CharField(max_length=20, default='normal')
+    session = models.ForeignKey(
+        'Session', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='chunks', db_index=False
+    )
+    
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    sample_count = models.IntegerField(default=0)
+    
+    # offsets (µs من start_time) + session_duration + قناة float32 لكل عمود في SENSOR_FIELDS
+    data = models.BinaryField()
+    # {field: [min, max, mean]} لكل قناة
+    stats = models.JSONField(default=dict)
+    
+    class Meta:
+        ordering = ['-start_time']
+        verbose_name = "Sensor Chunk"
+        verbose_name_plural = "Sensor Chunks"
+        indexes = [
+            models.Index(fields=['device_id', '-start_time']),
+            models.Index(fields=['session', 'start_time']),
+        ]
+    
+    def __str__(self):
+        return f"{self.device_id} - {self.sample_count} samples at {self.start_time}"
+
+
+class SensorRollup(models.Model):
+    """ملخص القراءات لكل ثانية / دقيقة (min, max, sum لكل قناة)"""
+    RESOLUTION_SECOND = 1
+    RESOLUTION_MINUTE = 60
+    RESOLUTION_CHOICES = [
+        (RESOLUTION_SECOND, '1 second'),
+        (RESOLUTION_MINUTE, '1 minute'),
+    ]
+    
+    device_id = models.CharField(max_length=100)
+    exercise_type = models.CharField(max_length=50, blank=True)
+    resolution = models.IntegerField(choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    # {field: [min, max, sum]} لكل قناة في SENSOR_FIELDS
+    stats = models.JSONField(default=dict)
+    
+    class Meta:
+        ordering = ['-bucket_start']
+        verbose_name = "Sensor Rollup"
+        verbose_name_plural = "Sensor Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device_id', 'resolution', 'bucket_start', 'exercise_type'],
+                name='unique_sensor_rollup_bucket',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.device_id} - {self.resolution}s at {self.bucket_start}"
 
+
+class DeviceSummary(models.Model):
+    """ملخص الجهاز للـ Dashboard (يُحدَّث تدريجياً مع الكتابة، انظر summary.py)"""
+    device_id = models.CharField(max_length=100, unique=True)
+    
+    total_readings = models.BigIntegerField(default=0)
+    last_reading_at = models.DateTimeField(null=True, blank=True)
+    
+    total_sessions = models.IntegerField(default=0)
+    completed_sessions = models.IntegerField(default=0)
+    # مجموع مدد الجلسات المكتملة (seconds) لحساب المتوسط
+    total_session_duration = models.BigIntegerField(default=0)
+    
+    last_status = models.CharField(max_length=50, blank=True)
+    last_status_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Device Summary"
+        verbose_name_plural = "Device Summaries"
+    
+    def __str__(self):
+        return f"{self.device_id} - {self.total_readings} readings, {self.total_sessions} sessions"
+    
+    @property
+    def avg_session_duration(self):
+        """متوسط مدة الجلسات المكتملة"""
+        if not self.completed_sessions:
+            return 0
+        return self.total_session_duration / self.completed_sessions
+
+
+class DeviceLatestState(models.Model):
+    """آخر حالة معروفة للجهاز (صف واحد لكل جهاز، انظر state.py)"""
+    device_id = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=50, blank=True)
+    message = models.TextField(blank=True)
+    mode = models.CharField(max_length=20, default='normal')
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    status_at = models.DateTimeField(null=True, blank=True)
+    # آخر network_info من الجهاز (ssid, ip, rssi, ws_host, ws_port)
+    network = models.JSONField(default=dict, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Device Latest State"
+        verbose_name_plural = "Device Latest States"
+    
+    def __str__(self):
+        return f"{self.device_id} - {self.status} at {self.status_at}"
@@ -0,0 +1,126 @@
+# ==============================================
+# probe.py - فحص الوصول للأجهزة (asyncio) مع cache
+# ==============================================
+#
+# بدلاً من تشغيل ping في subprocess داخل view متزامن (يحجز worker حتى 3 ثواني):
+# فتح اتصال TCP لمنفذ الـ WebSocket أو الـ HTTP في الجهاز بـ asyncio مع مهلة،
+# وإذا حُدد مسار HTTP يُرسل طلب HEAD ويُقرأ سطر الحالة.
+# النتائج تُحفظ في الـ cache لمدة قصيرة، وعدة أجهزة تُفحص في نفس الوقت
+# (بحد أقصى PROBE_CONCURRENCY اتصال مفتوح).
+
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# مهلة فحص المنفذ الواحد (ثواني)
+PROBE_TIMEOUT = getattr(settings, 'BASKY_PROBE_TIMEOUT', 2.0)
+# مدة الاحتفاظ بنتيجة الفحص في الـ cache (ثواني)
+PROBE_CACHE_TTL = getattr(settings, 'BASKY_PROBE_CACHE_TTL', 10)
+# أقصى عدد فحوص في نفس الوقت
+PROBE_CONCURRENCY = getattr(settings, 'BASKY_PROBE_CONCURRENCY', 50)
+# المنافذ الافتراضية (بعد منفذ الـ WebSocket الخاص بالجهاز)
+PROBE_PORTS = getattr(settings, 'BASKY_PROBE_PORTS', (80,))
+
+KEY_PREFIX = 'basky:probe:'
+
+
+def check_http_path(http_path):
+    """مسار HEAD يجب أن يبدأ بـ / وبدون مسافات أو رموز تحكم (حتى لا يُحقن في الطلب)"""
+    if not isinstance(http_path, str) or not http_path.startswith('/') or any(
+        char.isspace() or not char.isprintable() for char in http_path
+    ):
+        raise ValueError(f"Invalid HTTP path: {http_path!r}")
+    return http_path
+
+
+def probe_key(host, ports, http_path=None):
+    return f"{KEY_PREFIX}{host}:{','.join(map(str, ports))}:{http_path or ''}"
+
+
+async def probe_port(host, port, timeout=None, http_path=None):
+    """
+    فحص منفذ واحد: (reachable, latency_ms, error)
+    مع http_path يجب أن يرد الجهاز بسطر حالة HTTP
+    """
+    if http_path:
+        check_http_path(http_path)
+    timeout = timeout or PROBE_TIMEOUT
+    started = time.monotonic()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        if http_path:
+            writer.write(f'HEAD {http_path} HTTP/1.0\r\nHost: {host}\r\n\r\n'.encode())
+            await writer.drain()
+            remaining = timeout - (time.monotonic() - started)
+            status_line = await asyncio.wait_for(reader.readline(), max(remaining, 0.01))
+            if not status_line.startswith(b'HTTP/'):
+                return False, None, 'invalid http response'
+        return True, round((time.monotonic() - started) * 1000, 1), None
+    except asyncio.TimeoutError:
+        return False, None, 'timeout'
+    except OSError as e:
+        return False, None, e.strerror or str(e)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def probe(host, ports=None, timeout=None, http_path=None, use_cache=True):
+    """
+    فحص الجهاز على عدة منافذ في نفس الوقت (أول منفذ يرد يكفي)
+    النتيجة: {'host', 'reachable', 'port', 'latency_ms', 'error', 'cached'}
+    """
+    if http_path:
+        check_http_path(http_path)
+    ports = tuple(dict.fromkeys(ports or PROBE_PORTS))
+    key = probe_key(host, ports, http_path)
+    if use_cache:
+        result = await cache.aget(key)
+        if result is not None:
+            return dict(result, cached=True)
+
+    # أول منفذ يرد ينهي الفحص وتُلغى بقية المنافذ (لا ننتظر مهلة منفذ لا يرد)
+    tasks = [asyncio.ensure_future(probe_port(host, port, timeout, http_path)) for port in ports]
+    ports_by_task = dict(zip(tasks, ports))
+    pending = set(tasks)
+    result = None
+    try:
+        while pending and result is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            reachable = [(task.result()[1], ports_by_task[task]) for task in done if task.result()[0]]
+            if reachable:
+                latency_ms, port = min(reachable)
+                result = {'host': host, 'reachable': True, 'port': port, 'latency_ms': latency_ms, 'error': None}
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if result is None:
+        result = {'host': host, 'reachable': False, 'port': None, 'latency_ms': None, 'error': tasks[0].result()[2]}
+
+    await cache.aset(key, result, PROBE_CACHE_TTL)
+    return dict(result, cached=False)
+
+
+async def probe_many(targets, timeout=None, http_path=None, use_cache=True):
+    """
+    فحص عدة أجهزة في نفس الوقت
+    targets: {key: (host, ports)} والنتيجة {key: نتيجة probe}
+    """
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+    async def run_one(host, ports):
+        async with semaphore:
+            return await probe(host, ports, timeout, http_path, use_cache)
+
+    results = await asyncio.gather(*(run_one(host, ports) for host, ports in targets.values()))
+    return dict(zip(targets, results))
+
+
+def device_ports(device):
+    """منافذ فحص جهاز: منفذ الـ WebSocket الخاص به ثم المنافذ الافتراضية"""
+    return tuple(dict.fromkeys([device.ws_port, *PROBE_PORTS]))
@@ -0,0 +1,132 @@
+# ==============================================
+# protocol.py - إطارات السنسورات الثنائية (Binary Frames)
+# ==============================================
+#
+# شكل الإطار (little-endian، 64 بايت):
+#
+#   offset  size  field
+#   0       2     magic            b'BK'
+#   2       1     version          FRAME_VERSION
+#   3       1     message type     MSG_SENSOR_DATA
+#   4       4     sequence         uint32
+#   8       4     device timestamp uint32 (ms منذ تشغيل الجهاز)
+#   12      52    13 x float32     بترتيب SENSOR_FIELDS
+#
+# إطار sensor_batch (MSG_SENSOR_BATCH) يحمل عدة عينات:
+#
+#   offset  size  field
+#   0       2     magic            b'BK'
+#   2       1     version          FRAME_VERSION
+#   3       1     message type     MSG_SENSOR_BATCH
+#   4       4     first sequence   uint32
+#   8       2     sample count     uint16
+#   10      56*N  N x (uint32 device timestamp + 13 x float32)
+#
+# الجهاز يطلب الصيغة الثنائية في رسالة status/connected بـ "format": "binary"
+# والسيرفر يرد بـ format_ack.
+
+import math
+import struct
+from collections import namedtuple
+
+FRAME_MAGIC = b'BK'
+FRAME_VERSION = 1
+
+MSG_SENSOR_DATA = 1
+MSG_SENSOR_BATCH = 2
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+SUPPORTED_FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+SENSOR_CHANNEL_COUNT = 13
+
+HEADER = struct.Struct('<2sBB')
+SENSOR_FRAME = struct.Struct(f'<2sBBII{SENSOR_CHANNEL_COUNT}f')
+BATCH_HEADER = struct.Struct('<2sBBIH')
+BATCH_SAMPLE = struct.Struct(f'<I{SENSOR_CHANNEL_COUNT}f')
+
+SensorFrame = namedtuple('SensorFrame', ['sequence', 'device_timestamp', 'values'])
+# samples: قائمة (device_timestamp, values)
+SensorBatch = namedtuple('SensorBatch', ['sequence', 'samples'])
+
+
+class FrameError(ValueError):
+    """إطار ثنائي غير صالح"""
+
+
+def encode_sensor_frame(sequence, device_timestamp, values):
+    """ترميز إطار sensor_data ثنائي (للمحاكي والاختبارات)"""
+    return SENSOR_FRAME.pack(
+        FRAME_MAGIC, FRAME_VERSION, MSG_SENSOR_DATA,
+        sequence & 0xFFFFFFFF, device_timestamp & 0xFFFFFFFF, *values
+    )
+
+
+def encode_sensor_batch(sequence, samples):
+    """ترميز إطار sensor_batch ثنائي من قائمة (device_timestamp, values)"""
+    parts = [BATCH_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, MSG_SENSOR_BATCH, sequence & 0xFFFFFFFF, len(samples))]
+    for device_timestamp, values in samples:
+        parts.append(BATCH_SAMPLE.pack(device_timestamp & 0xFFFFFFFF, *values))
+    return b''.join(parts)
+
+
+def decode_frame(data):
+    """فك ترميز أي إطار ثنائي حسب نوعه (SensorFrame أو SensorBatch)"""
+    if len(data) < HEADER.size:
+        raise FrameError(f"Invalid frame size: {len(data)}")
+
+    magic, version, msg_type = HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise FrameError("Invalid frame magic")
+    if version != FRAME_VERSION:
+        raise FrameError(f"Unsupported frame version: {version}")
+
+    if msg_type == MSG_SENSOR_DATA:
+        return decode_sensor_frame(data)
+    if msg_type == MSG_SENSOR_BATCH:
+        return decode_sensor_batch(data)
+    raise FrameError(f"Unknown frame type: {msg_type}")
+
+
+def decode_sensor_batch(data):
+    """فك ترميز إطار sensor_batch ثنائي"""
+    if len(data) < BATCH_HEADER.size:
+        raise FrameError(f"Invalid batch size: {len(data)}")
+
+    magic, version, msg_type, sequence, count = BATCH_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION or msg_type != MSG_SENSOR_BATCH:
+        raise FrameError("Invalid batch header")
+
+    body = memoryview(data)[BATCH_HEADER.size:]
+    if len(body) != count * BATCH_SAMPLE.size:
+        raise FrameError(f"Batch length mismatch: {count} samples in {len(body)} bytes")
+
+    samples = [(sample[0], sample[1:]) for sample in BATCH_SAMPLE.iter_unpack(body)]
+    for _, values in samples:
+        check_finite(values)
+    return SensorBatch(sequence, samples)
+
+
+def decode_sensor_frame(data):
+    """فك ترميز إطار sensor_data ثنائي في خطوة واحدة"""
+    if len(data) != SENSOR_FRAME.size:
+        raise FrameError(f"Invalid frame size: {len(data)} (expected {SENSOR_FRAME.size})")
+
+    magic, version, msg_type, sequence, device_timestamp, *values = SENSOR_FRAME.unpack_from(data)
+
+    if magic != FRAME_MAGIC:
+        raise FrameError("Invalid frame magic")
+    if version != FRAME_VERSION:
+        raise FrameError(f"Unsupported frame version: {version}")
+    if msg_type != MSG_SENSOR_DATA:
+        raise FrameError(f"Unknown frame type: {msg_type}")
+
+    check_finite(values)
+    return SensorFrame(sequence, device_timestamp, values)
+
+
+def check_finite(values):
+    """رفض الإطار الذي يحمل NaN أو inf (لا يُخزن في أعمدة القراءات)"""
+    if not all(map(math.isfinite, values)):
+        raise FrameError("Non-finite sensor value")
@@ -0,0 +1,99 @@
+# ==============================================
+# registry.py - سجل الأجهزة المتصلة (مشترك بين كل الـ workers)
+# ==============================================
+#
+# كل جهاز متصل:
+#   - ينضم لـ group في الـ channel layer باسم device_group(device_id)،
+#     والأوامر تصل له عبر group_send من أي worker.
+#   - يكتب بيانات الاتصال (presence) في الـ cache المشترك بمدة صلاحية
+#     PRESENCE_TTL، ويجددها أثناء الاتصال.
+#
+# مع InMemoryChannelLayer و LocMemCache (الافتراضي) يعمل داخل عملية واحدة،
+# ومع Redis يعمل عبر عدة workers.
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+# مدة صلاحية presence بالثواني (تنتهي تلقائياً لو توقف الـ worker)
+PRESENCE_TTL = getattr(settings, 'BASKY_PRESENCE_TTL', 120)
+# أقل فترة بين تحديثات presence لنفس الجهاز
+PRESENCE_REFRESH = getattr(settings, 'BASKY_PRESENCE_REFRESH', 15)
+
+KEY_PREFIX = 'basky:presence:'
+
+# أسماء الـ groups في Channels: ASCII فقط وأقل من 100 حرف
+MAX_GROUP_NAME = 99
+
+
+def group_name(prefix, device_id):
+    """
+    اسم group صالح لـ device_id: إذا احتاج تعديلاً أو قصاً يُضاف hash قصير
+    للـ id الأصلي حتى لا يتشارك جهازان نفس الـ group
+    """
+    raw = str(device_id)
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', raw)
+    if name != raw or len(prefix) + len(name) > MAX_GROUP_NAME:
+        digest = hashlib.sha1(raw.encode()).hexdigest()[:8]
+        name = f'{name[:MAX_GROUP_NAME - len(prefix) - len(digest) - 1]}.{digest}'
+    return prefix + name
+
+
+def device_group(device_id):
+    """اسم الـ group الخاص بالجهاز في الـ channel layer"""
+    return group_name('device.', device_id)
+
+
+def dashboard_group(device_id):
+    """اسم الـ group لمشاهدي الـ Dashboard لجهاز معين"""
+    return group_name('dashboard.', device_id)
+
+
+def presence_key(device_id):
+    return f'{KEY_PREFIX}{device_id}'
+
+
+class DeviceRegistry:
+    """قراءة وكتابة presence الأجهزة في الـ cache"""
+
+    def __init__(self, cache_backend=None):
+        self.cache = cache_backend or cache
+
+    # ------------------------------------------
+    # Sync (views)
+    # ------------------------------------------
+
+    def get(self, device_id):
+        """بيانات اتصال جهاز أو None إذا لم يكن متصلاً"""
+        return self.cache.get(presence_key(device_id))
+
+    def get_many(self, device_ids):
+        """بيانات اتصال عدة أجهزة: {device_id: info} للمتصل منها فقط"""
+        keys = {presence_key(device_id): device_id for device_id in device_ids}
+        found = self.cache.get_many(list(keys))
+        return {keys[key]: info for key, info in found.items()}
+
+    def is_connected(self, device_id):
+        return self.get(device_id) is not None
+
+    # ------------------------------------------
+    # Async (consumers)
+    # ------------------------------------------
+
+    async def aget(self, device_id):
+        return await self.cache.aget(presence_key(device_id))
+
+    async def apublish(self, device_id, info):
+        """كتابة/تجديد presence الجهاز"""
+        await self.cache.aset(presence_key(device_id), info, PRESENCE_TTL)
+
+    async def aremove(self, device_id, channel_name):
+        """حذف presence الجهاز إذا كان مسجلاً بنفس الاتصال"""
+        info = await self.aget(device_id)
+        if info is not None and info.get('channel_name') == channel_name:
+            await self.cache.adelete(presence_key(device_id))
+
+
+device_registry = DeviceRegistry()
@@ -0,0 +1,156 @@
+# ==============================================
+# retention.py - سياسات الاحتفاظ ببيانات الأجهزة
+# ==============================================
+#
+# run_retention() هي المهمة القابلة للجدولة (cron / celery beat / أي scheduler)
+# وأمر manage.py apply_retention يستدعيها.
+#
+# الحذف يتم على دفعات صغيرة، كل دفعة في transaction مستقلة مع فاصل قصير،
+# حتى لا تحجز قاعدة البيانات (SQLite) قفل كتابة طويل أثناء استقبال القراءات.
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DeviceStatus, SensorChunk, SensorReading, SensorRollup
+from .summary import refresh_reading_totals
+from .timeseries import compact_readings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICIES = {
+    # القراءات الخام: تُضغط إلى SensorChunk (archive) ثم تُحذف
+    'sensor_readings': {'days': 7, 'archive': True},
+    'sensor_chunks': {'days': 365},
+    'sensor_rollups_1s': {'days': 7},
+    'sensor_rollups_60s': {'days': 365},
+    'device_status': {'days': 30},
+}
+
+RETENTION_POLICIES = getattr(settings, 'BASKY_RETENTION', DEFAULT_POLICIES)
+BATCH_SIZE = getattr(settings, 'BASKY_RETENTION_BATCH_SIZE', 2000)
+BATCH_PAUSE = getattr(settings, 'BASKY_RETENTION_BATCH_PAUSE', 0.05)
+
+
+def delete_in_batches(queryset, batch_size=None, pause=None):
+    """حذف صفوف الـ queryset على دفعات، كل دفعة في transaction مستقلة"""
+    batch_size = batch_size or BATCH_SIZE
+    pause = BATCH_PAUSE if pause is None else pause
+    model = queryset.model
+    deleted = 0
+
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            model.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        reclaim_space()
+
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def archive_readings(before, batch_size=None, pause=None):
+    """ضغط القراءات الأقدم من before إلى SensorChunk لكل جهاز"""
+    pause = BATCH_PAUSE if pause is None else pause
+    device_ids = list(
+        SensorReading.objects.filter(timestamp__lt=before)
+        .order_by().values_list('device_id', flat=True).distinct()
+    )
+    archived = 0
+    for device_id in device_ids:
+        archived += compact_readings(device_id, before, batch_size=batch_size or BATCH_SIZE)
+        reclaim_space()
+        if pause:
+            time.sleep(pause)
+    return archived
+
+
+def reclaim_space(pages=1000):
+    """إرجاع الصفحات الفارغة لنظام الملفات (SQLite مع auto_vacuum=INCREMENTAL فقط)"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] == 2:
+            cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+
+
+def enable_incremental_vacuum():
+    """
+    تفعيل auto_vacuum=INCREMENTAL في SQLite (يتطلب VACUUM كامل مرة واحدة،
+    وهو يحجز قاعدة البيانات طوال مدته)
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+    return True
+
+
+def retention_querysets(now=None):
+    """الجداول وسياساتها: {name: (queryset الأقدم من المدة, policy)}"""
+    now = now or timezone.now()
+    cutoff = {name: now - timedelta(days=policy['days']) for name, policy in RETENTION_POLICIES.items()}
+
+    tables = {
+        'sensor_readings': lambda before: SensorReading.objects.filter(timestamp__lt=before),
+        'sensor_chunks': lambda before: SensorChunk.objects.filter(end_time__lt=before),
+        'sensor_rollups_1s': lambda before: SensorRollup.objects.filter(
+            resolution=SensorRollup.RESOLUTION_SECOND, bucket_start__lt=before),
+        'sensor_rollups_60s': lambda before: SensorRollup.objects.filter(
+            resolution=SensorRollup.RESOLUTION_MINUTE, bucket_start__lt=before),
+        # صفوف الحالة تمتد حتى last_seen (تكرارات نفس الحالة)
+        'device_status': lambda before: DeviceStatus.objects.annotate(
+            seen=Coalesce('last_seen', 'timestamp')).filter(seen__lt=before),
+    }
+    return {
+        name: (tables[name](cutoff[name]), RETENTION_POLICIES[name], cutoff[name])
+        for name in RETENTION_POLICIES if name in tables
+    }
+
+
+def run_retention(tables=None, batch_size=None, pause=None, now=None):
+    """
+    تطبيق سياسات الاحتفاظ. يرجع نتيجة لكل جدول:
+    {'table', 'archived', 'deleted', 'seconds', 'rows_per_second'}
+    """
+    results = []
+    for name, (queryset, policy, before) in retention_querysets(now).items():
+        if tables and name not in tables:
+            continue
+
+        started = time.monotonic()
+        archived = 0
+        if policy.get('archive') and name == 'sensor_readings':
+            archived = archive_readings(before, batch_size=batch_size, pause=pause)
+        deleted = delete_in_batches(queryset, batch_size=batch_size, pause=pause)
+        elapsed = time.monotonic() - started
+
+        processed = archived + deleted
+        result = {
+            'table': name,
+            'archived': archived,
+            'deleted': deleted,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(processed / elapsed) if elapsed else 0,
+        }
+        results.append(result)
+        if processed:
+            logger.info(f"Retention {name}: archived {archived}, deleted {deleted} in {elapsed:.1f}s")
+    
+    # الضغط لا يغير عدد القراءات، أما الحذف فيغيره
+    if any(r['deleted'] for r in results if r['table'] in ('sensor_readings', 'sensor_chunks')):
+        refresh_reading_totals()
+    return results
@@ -0,0 +1,136 @@
+# ==============================================
+# rollups.py - ملخصات القراءات لكل ثانية / دقيقة
+# ==============================================
+#
+# تُحدَّث تدريجياً مع كل دفعة قراءات يكتبها الـ ingest writer:
+# نحسب min/max/sum/count للدفعة في الذاكرة ثم ندمجها مع الـ buckets الموجودة.
+# استعلامات المدى الطويل (ساعات) تقرأ من هنا بدلاً من ملايين الصفوف.
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+from .models import SENSOR_FIELDS, SensorRollup
+
+RESOLUTIONS = (SensorRollup.RESOLUTION_SECOND, SensorRollup.RESOLUTION_MINUTE)
+
+
+def bucket_start(timestamp, resolution):
+    """بداية الـ bucket الذي يقع فيه الوقت"""
+    seconds = int(timestamp.timestamp()) // resolution * resolution
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def merge_stats(stats, other):
+    """دمج {field: [min, max, sum]}"""
+    for field, (low, high, total) in other.items():
+        current = stats.get(field)
+        if current is None:
+            stats[field] = [low, high, total]
+        else:
+            current[0] = min(current[0], low)
+            current[1] = max(current[1], high)
+            current[2] += total
+    return stats
+
+
+def aggregate_readings(readings):
+    """حساب الـ buckets لدفعة قراءات: {(device, exercise, resolution, bucket): [count, stats]}"""
+    buckets = {}
+    for reading in readings:
+        for resolution in RESOLUTIONS:
+            key = (reading.device_id, reading.exercise_type, resolution,
+                   bucket_start(reading.timestamp, resolution))
+            entry = buckets.get(key)
+            if entry is None:
+                entry = buckets[key] = [0, {}]
+            entry[0] += 1
+            stats = entry[1]
+            for field in SENSOR_FIELDS:
+                value = getattr(reading, field)
+                current = stats.get(field)
+                if current is None:
+                    stats[field] = [value, value, value]
+                else:
+                    if value < current[0]:
+                        current[0] = value
+                    if value > current[1]:
+                        current[1] = value
+                    current[2] += value
+    return buckets
+
+
+def apply_rollups(readings):
+    """دمج دفعة قراءات في جدول الـ rollups (يُستدعى داخل transaction الكتابة)"""
+    buckets = aggregate_readings(readings)
+    if not buckets:
+        return 0
+
+    # جلب الـ buckets الموجودة في استعلام واحد
+    condition = Q()
+    for device_id, exercise_type, resolution in {key[:3] for key in buckets}:
+        starts = [key[3] for key in buckets if key[:3] == (device_id, exercise_type, resolution)]
+        condition |= Q(
+            device_id=device_id, exercise_type=exercise_type, resolution=resolution,
+            bucket_start__gte=min(starts), bucket_start__lte=max(starts),
+        )
+    existing = {
+        (r.device_id, r.exercise_type, r.resolution, r.bucket_start): r
+        for r in SensorRollup.objects.filter(condition)
+    }
+
+    to_update, to_create = [], []
+    for key, (count, stats) in buckets.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            to_create.append(SensorRollup(
+                device_id=key[0], exercise_type=key[1], resolution=key[2], bucket_start=key[3],
+                count=count, stats=stats,
+            ))
+        else:
+            rollup.count += count
+            rollup.stats = merge_stats(rollup.stats, stats)
+            to_update.append(rollup)
+
+    SensorRollup.objects.bulk_create(to_create)
+    SensorRollup.objects.bulk_update(to_update, ['count', 'stats'])
+    return len(buckets)
+
+
+def rollup_series(device_id, start, end, resolution=None, exercise_type=None):
+    """
+    سلسلة ملخصات الجهاز بين start و end (الأقدم أولاً)
+    resolution الافتراضي: ثانية لمدى ساعة أو أقل، ودقيقة لما هو أطول
+    """
+    if resolution is None:
+        resolution = RESOLUTIONS[0] if end - start <= timedelta(hours=1) else RESOLUTIONS[-1]
+
+    rollups = SensorRollup.objects.filter(
+        device_id=device_id, resolution=resolution,
+        bucket_start__gte=bucket_start(start, resolution), bucket_start__lt=end,
+    ).order_by('bucket_start')
+    if exercise_type is not None:
+        rollups = rollups.filter(exercise_type=exercise_type)
+
+    # دمج أنواع التمارين المختلفة في نفس الـ bucket
+    series = {}
+    for rollup in rollups.values_list('bucket_start', 'count', 'stats'):
+        bucket, count, stats = rollup
+        entry = series.get(bucket)
+        if entry is None:
+            series[bucket] = [count, {field: list(values) for field, values in stats.items()}]
+        else:
+            entry[0] += count
+            merge_stats(entry[1], stats)
+
+    return [
+        {
+            'bucket': bucket.isoformat(),
+            'count': count,
+            **{
+                field: {'min': low, 'max': high, 'mean': total / count}
+                for field, (low, high, total) in stats.items()
+            },
+        }
+        for bucket, (count, stats) in series.items()
+    ], resolution
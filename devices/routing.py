@@ -4,4 +4,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/$', consumers.BaskyDeviceConsumer.as_asgi()),
+    re_path(r'ws/device/(?P<device_id>[^/]+)/stream/$', consumers.DeviceStreamConsumer.as_asgi()),
 ]
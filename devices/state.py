@@ -0,0 +1,112 @@
+# ==============================================
+# state.py - آخر حالة معروفة لكل جهاز (cache + صف DeviceLatestState)
+# ==============================================
+#
+# الـ consumer يحدّث الحالة مع كل status / network_info / pong:
+# تُكتب في الـ cache المشترك أولاً ثم تُحفظ في صف واحد لكل جهاز
+# بـ upsert (INSERT ... ON CONFLICT DO UPDATE).
+# الـ API يقرأ من الـ cache، ومن الصف عند عدم وجودها (بعد إعادة تشغيل الـ cache)،
+# ولا يلمس جدول DeviceStatus (السجل التاريخي).
+#
+# رسائل keepalive (pong، status متكرر) تغير الأوقات فقط: تُكتب في الـ cache فوراً،
+# أما الصف فيُحدّث عند تغير حقل آخر، أو كل PERSIST_INTERVAL ثانية على الأكثر،
+# وعند قطع الاتصال (aflush).
+
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+STATE_FIELDS = ('status', 'message', 'mode', 'ip_address', 'status_at', 'network', 'last_seen')
+# حقول تتغير مع كل رسالة (لا تستدعي كتابة الصف فوراً)
+VOLATILE_FIELDS = ('status_at', 'last_seen')
+
+# أقصى مدة (ثواني) قبل حفظ تغير الأوقات فقط في الصف
+PERSIST_INTERVAL = getattr(settings, 'BASKY_STATE_PERSIST_INTERVAL', 60)
+# مدة بقاء الحالة في الـ cache: بعدها تُقرأ من الصف (حتى لا تبقى نسخة قديمة
+# في cache عملية لا تصلها تحديثات الجهاز). أطول من PERSIST_INTERVAL حتى لا
+# تضيع الأوقات التي لم تُحفظ بعد
+STATE_CACHE_TTL = max(getattr(settings, 'BASKY_STATE_CACHE_TTL', 300), PERSIST_INTERVAL * 2)
+
+KEY_PREFIX = 'basky:state:'
+
+
+def state_key(device_id):
+    return f'{KEY_PREFIX}{device_id}'
+
+
+class DeviceStateStore:
+    """قراءة وكتابة آخر حالة للأجهزة"""
+
+    def __init__(self, cache_backend=None):
+        self.cache = cache_backend or cache
+        # آخر حفظ للصف لكل جهاز (monotonic)، والأجهزة التي لم تُحفظ أوقاتها بعد
+        self._persisted = {}
+        self._dirty = set()
+
+    def get(self, device_id):
+        """آخر حالة للجهاز (dict) أو None إذا لم تُسجل له حالة"""
+        state = self.cache.get(state_key(device_id))
+        if state is None:
+            state = self.load(device_id)
+            if state is not None:
+                self.cache.set(state_key(device_id), state, STATE_CACHE_TTL)
+        return state
+
+    def load(self, device_id):
+        """قراءة الحالة من الصف المحفوظ"""
+        from .models import DeviceLatestState
+
+        row = DeviceLatestState.objects.filter(device_id=device_id).values(*STATE_FIELDS).first()
+        return row
+
+    def persist(self, device_id, state):
+        """حفظ الحالة في صف الجهاز (upsert في استعلام واحد)"""
+        from .models import DeviceLatestState
+
+        DeviceLatestState.objects.bulk_create(
+            [DeviceLatestState(device_id=device_id, **state)],
+            update_conflicts=True,
+            unique_fields=['device_id'],
+            update_fields=list(state),
+        )
+
+    async def aupdate(self, device_id, **fields):
+        """
+        دمج حقول جديدة في حالة الجهاز وكتابتها في الـ cache،
+        والصف فقط عند تغير حقل غير الأوقات أو مرور PERSIST_INTERVAL
+        """
+        state = await self.cache.aget(state_key(device_id))
+        if state is None:
+            state = await sync_to_async(self.load)(device_id) or {}
+        changed = any(
+            state.get(field) != value for field, value in fields.items() if field not in VOLATILE_FIELDS
+        )
+        state.update(fields)
+
+        await self.cache.aset(state_key(device_id), state, STATE_CACHE_TTL)
+
+        last = self._persisted.get(device_id)
+        if changed or last is None or time.monotonic() - last >= PERSIST_INTERVAL:
+            await self._apersist(device_id, state)
+        else:
+            self._dirty.add(device_id)
+        return state
+
+    async def aflush(self, device_id):
+        """حفظ الأوقات التي لم تُكتب في الصف بعد (عند قطع الاتصال)"""
+        if device_id in self._dirty:
+            state = await self.cache.aget(state_key(device_id))
+            if state is not None:
+                await self._apersist(device_id, state)
+        self._persisted.pop(device_id, None)
+        self._dirty.discard(device_id)
+
+    async def _apersist(self, device_id, state):
+        await sync_to_async(self.persist)(device_id, state)
+        self._persisted[device_id] = time.monotonic()
+        self._dirty.discard(device_id)
+
+
+device_state = DeviceStateStore()
@@ -0,0 +1,88 @@
+# ==============================================
+# stats.py - إحصائيات الجلسات لكل جهاز (مع cache)
+# ==============================================
+#
+# كل الإحصائيات من استعلام واحد: تجميع حسب (exercise_type, difficulty)
+# مع conditional aggregation للجلسات المكتملة، ثم نجمع المستويات في Python.
+# النتيجة تُحفظ في الـ cache لكل جهاز وتُحذف عند إنشاء/إنهاء/حذف جلسة
+# (Session.save / Session.delete)، فتحديثات الـ Dashboard المتكررة لا تلمس الجدول.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum
+
+# مدة الاحتفاظ القصوى في الـ cache (الإلغاء يتم عند تغير الجلسات)
+STATS_TTL = getattr(settings, 'BASKY_SESSION_STATS_TTL', 3600)
+
+KEY_PREFIX = 'basky:session_stats:'
+
+
+def stats_key(device_pk):
+    """مفتاح الـ cache لإحصائيات جهاز"""
+    return f"{KEY_PREFIX}{device_pk}"
+
+
+def compute_session_stats(device_pk):
+    """حساب إحصائيات جلسات الجهاز في استعلام واحد"""
+    from .models import Session
+
+    completed = Q(is_active=False)
+    groups = (
+        Session.objects.filter(device_id=device_pk)
+        .order_by()
+        .values('exercise_type', 'difficulty')
+        .annotate(
+            total=Count('id'),
+            completed=Count('id', filter=completed),
+            duration_sum=Sum('duration', filter=completed),
+            duration_max=Max('duration', filter=completed),
+        )
+    )
+
+    total_sessions = 0
+    completed_sessions = 0
+    duration_sum = 0
+    max_duration = 0
+    by_exercise = {}
+    by_difficulty = {}
+    for group in groups:
+        total_sessions += group['total']
+        if not group['completed']:
+            continue
+        completed_sessions += group['completed']
+        duration_sum += group['duration_sum']
+        max_duration = max(max_duration, group['duration_max'])
+        for totals, name in ((by_exercise, group['exercise_type']), (by_difficulty, group['difficulty'])):
+            entry = totals.setdefault(name, [0, 0])
+            entry[0] += group['completed']
+            entry[1] += group['duration_sum']
+
+    return {
+        'total_sessions': total_sessions,
+        'completed_sessions': completed_sessions,
+        'avg_duration': round(duration_sum / completed_sessions, 2) if completed_sessions else 0,
+        'max_duration': max_duration,
+        'exercise_stats': [
+            {'exercise_type': name, 'count': count, 'avg_duration': total / count}
+            for name, (count, total) in sorted(by_exercise.items())
+        ],
+        'difficulty_stats': [
+            {'difficulty': name, 'count': count, 'avg_duration': total / count}
+            for name, (count, total) in sorted(by_difficulty.items())
+        ],
+    }
+
+
+def session_stats(device_pk):
+    """إحصائيات جلسات الجهاز من الـ cache (أو حسابها وحفظها)"""
+    key = stats_key(device_pk)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_session_stats(device_pk)
+        cache.set(key, stats, STATS_TTL)
+    return stats
+
+
+def invalidate_session_stats(device_pk):
+    """حذف إحصائيات الجهاز من الـ cache (عند تغير جلساته)"""
+    cache.delete(stats_key(device_pk))
@@ -0,0 +1,144 @@
+# ==============================================
+# summary.py - ملخص الجهاز (DeviceSummary) للـ Dashboard
+# ==============================================
+#
+# بدلاً من COUNT(*) على ملايين القراءات مع كل تحميل للـ Dashboard، نحدّث صف
+# الملخص تدريجياً من أماكن الكتابة نفسها:
+#   - ingest writer: total_readings, last_reading_at (مع كل دفعة)
+#   - Session.save / end_session / delete: عدد الجلسات ومجموع المدد
+#   - consumer: آخر حالة للجهاز
+# إذا لم يوجد صف للجهاز بعد، يُبنى مرة واحدة من الجداول (rebuild_device_summary).
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateTimeField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import DeviceStatus, DeviceSummary, Session
+from .timeseries import count_readings
+
+
+def rebuild_device_summary(device_id):
+    """حساب ملخص الجهاز من الجداول وحفظه (للأجهزة الجديدة أو بعد حذف بيانات)"""
+    from .models import SensorChunk, SensorReading
+
+    sessions = Session.objects.filter(device__device_id=device_id).aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(is_active=False)),
+        duration=Sum('duration', filter=Q(is_active=False)),
+    )
+    last_row = SensorReading.objects.filter(device_id=device_id).order_by('-timestamp').values_list(
+        'timestamp', flat=True
+    ).first()
+    last_chunk = SensorChunk.objects.filter(device_id=device_id).order_by('-start_time').values_list(
+        'end_time', flat=True
+    ).first()
+    last_status = DeviceStatus.objects.filter(device_id=device_id).order_by('-timestamp').values_list(
+        'status', 'timestamp'
+    ).first() or ('', None)
+
+    summary, _ = DeviceSummary.objects.update_or_create(
+        device_id=device_id,
+        defaults={
+            'total_readings': count_readings(device_id),
+            'last_reading_at': last_row or last_chunk,
+            'total_sessions': sessions['total'],
+            'completed_sessions': sessions['completed'],
+            'total_session_duration': sessions['duration'] or 0,
+            'last_status': last_status[0],
+            'last_status_at': last_status[1],
+        }
+    )
+    return summary
+
+
+def refresh_reading_totals():
+    """
+    إعادة حساب total_readings لكل الملخصات (بعد حذف قراءات بسياسات الاحتفاظ)
+    الصف مقفل (select_for_update) أثناء العد حتى لا تضيع زيادات الـ ingest writer
+    """
+    for summary in DeviceSummary.objects.only('device_id').iterator():
+        with transaction.atomic():
+            if not DeviceSummary.objects.select_for_update().filter(pk=summary.pk).exists():
+                continue
+            DeviceSummary.objects.filter(pk=summary.pk).update(
+                total_readings=count_readings(summary.device_id)
+            )
+
+
+def get_device_summary(device_id):
+    """ملخص الجهاز (استعلام واحد بالـ index، أو بناؤه إذا لم يوجد)"""
+    summary = DeviceSummary.objects.filter(device_id=device_id).first()
+    if summary is None:
+        summary = rebuild_device_summary(device_id)
+    return summary
+
+
+def _update_summary(device_id, **updates):
+    """تحديث صف الملخص بـ F expressions (أو بناؤه من الجداول إذا لم يوجد)"""
+    updated = DeviceSummary.objects.filter(device_id=device_id).update(
+        updated_at=timezone.now(), **updates
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                rebuild_device_summary(device_id)
+        except IntegrityError:
+            # أنشأه طرف آخر في نفس اللحظة
+            DeviceSummary.objects.filter(device_id=device_id).update(**updates)
+
+
+def record_readings(readings):
+    """إضافة دفعة قراءات للملخصات (يُستدعى داخل transaction الـ ingest writer)"""
+    devices = {}
+    for reading in readings:
+        entry = devices.get(reading.device_id)
+        if entry is None:
+            devices[reading.device_id] = [1, reading.timestamp]
+        else:
+            entry[0] += 1
+            if reading.timestamp > entry[1]:
+                entry[1] = reading.timestamp
+
+    # UPDATE بـ F expressions (وليس قراءة ثم bulk_update) حتى لا تضيع تحديثات
+    # refresh_reading_totals أو الجلسات من thread أو عملية أخرى
+    now = timezone.now()
+    for device_id, (count, last) in devices.items():
+        last = Value(last, output_field=DateTimeField())
+        updated = DeviceSummary.objects.filter(device_id=device_id).update(
+            total_readings=F('total_readings') + count,
+            last_reading_at=Greatest(Coalesce('last_reading_at', last), last),
+            updated_at=now,
+        )
+        if not updated:
+            # الدفعة نفسها محفوظة بالفعل فتُحسب في الـ rebuild
+            rebuild_device_summary(device_id)
+    return len(devices)
+
+
+def record_session_created(device_id):
+    """جلسة جديدة للجهاز"""
+    _update_summary(device_id, total_sessions=F('total_sessions') + 1)
+
+
+def record_session_ended(device_id, duration):
+    """انتهاء جلسة للجهاز بمدة duration"""
+    _update_summary(
+        device_id,
+        completed_sessions=F('completed_sessions') + 1,
+        total_session_duration=F('total_session_duration') + duration,
+    )
+
+
+def record_session_deleted(device_id, completed, duration):
+    """حذف جلسة للجهاز"""
+    updates = {'total_sessions': F('total_sessions') - 1}
+    if completed:
+        updates['completed_sessions'] = F('completed_sessions') - 1
+        updates['total_session_duration'] = F('total_session_duration') - duration
+    _update_summary(device_id, **updates)
+
+
+def record_status(device_id, status, timestamp=None):
+    """آخر حالة للجهاز"""
+    _update_summary(device_id, last_status=status, last_status_at=timestamp or timezone.now())
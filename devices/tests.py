@@ -1,3 +1,1043 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import math
+import socket
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from .codec import get_codec, now_iso
+from .consumers import CLOSE_STALE, HEARTBEAT_ID, BaskyDeviceConsumer, DeviceStreamConsumer
+from .discovery import DiscoveryService, get_server_ip, parse_announcement
+from .heartbeat import HeartbeatScheduler
+from .ingest import (
+    OVERFLOW_BLOCK, OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST, IngestQueue, SensorBuffer, flush_all_buffers,
+    ingest_queue, make_sensor_reading, sample_timestamps,
+)
+from .models import (
+    SENSOR_FIELDS, DeviceConfig, DeviceLatestState, DeviceStatus, DeviceSummary, SensorChunk, SensorReading, Session,
+)
+from .probe import probe
+from .protocol import (
+    BATCH_HEADER, FRAME_MAGIC, FRAME_VERSION, FrameError, SensorBatch, SensorFrame, decode_frame, decode_sensor_frame,
+    encode_sensor_batch, encode_sensor_frame,
+)
+from .registry import dashboard_group, device_registry
+from .retention import delete_in_batches, run_retention
+from .rollups import apply_rollups, bucket_start, rollup_series
+from .routing import websocket_urlpatterns
+from .state import DeviceStateStore, state_key
+from .stats import session_stats
+from .summary import get_device_summary, record_readings, refresh_reading_totals
+from .timeseries import decode_cursor, encode_cursor, pack_chunk, readings_page, unpack_chunk
+from .views import get_device_list
+
+device_app = BaskyDeviceConsumer.as_asgi()
+
+
+async def device_asgi(scope, receive, send):
+    """الـ consumer مع عنوان العميل (WebsocketCommunicator لا يضيفه)"""
+    scope = dict(scope, client=('127.0.0.1', 40000))
+    return await device_app(scope, receive, send)
+
+
+async def connect_device(device_id, **status):
+    """فتح اتصال جهاز وتسجيله برسالة status/connected"""
+    communicator = WebsocketCommunicator(device_asgi, '/ws/')
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()  # connection_established
+    await communicator.send_json_to({'type': 'status', 'status': 'connected', 'device_id': device_id, **status})
+    await communicator.receive_json_from()  # format_ack
+    return communicator
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class DeviceRegistryTests(TransactionTestCase):
+
+    async def test_presence_and_command_routing(self):
+        communicator = await connect_device('basky_test_1')
+
+        presence = device_registry.get_many(['basky_test_1', 'basky_missing'])
+        self.assertEqual(list(presence), ['basky_test_1'])
+        self.assertEqual(presence['basky_test_1']['status'], 'connected')
+
+        sent = await BaskyDeviceConsumer.send_command_to_device('basky_test_1', 'calibrate', {})
+        self.assertTrue(sent)
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['type'], 'calibrate')
+
+        await communicator.disconnect()
+        self.assertIsNone(device_registry.get('basky_test_1'))
+
+    async def test_command_to_offline_device(self):
+        sent = await BaskyDeviceConsumer.send_command_to_device('basky_offline', 'ping', {})
+        self.assertFalse(sent)
+
+    async def test_command_ack_correlation(self):
+        communicator = await connect_device('basky_test_cmd')
+
+        requests = [
+            asyncio.ensure_future(BaskyDeviceConsumer.request_device('basky_test_cmd', 'ping', {}, timeout=1))
+            for _ in range(2)
+        ]
+        pings = [await communicator.receive_json_from() for _ in requests]
+        # التأكيدات بترتيب عكسي: كل رد يُطابق أمره بالـ id
+        for ping in reversed(pings):
+            await communicator.send_json_to({'type': 'pong', 'id': ping['id'], 'seq': ping['id']})
+
+        results = await asyncio.gather(*requests)
+        self.assertEqual({result['status'] for result in results}, {'ok'})
+        self.assertEqual(
+            sorted((result['id'], result['data']['seq']) for result in results),
+            sorted((ping['id'], ping['id']) for ping in pings)
+        )
+        await communicator.disconnect()
+
+    async def test_command_timeout(self):
+        communicator = await connect_device('basky_test_slow')
+
+        result = await BaskyDeviceConsumer.request_device(
+            'basky_test_slow', 'start_session', {'exercise': 'Stretching'}, timeout=0.1
+        )
+        self.assertEqual(result['status'], 'timeout')
+        message = await communicator.receive_json_from()
+        self.assertEqual((message['type'], message['id']), ('start_session', result['id']))
+
+        with self.assertRaises(ValueError):
+            await BaskyDeviceConsumer.request_device('basky_test_slow', 'ping', {}, timeout='abc')
+        await communicator.disconnect()
+
+    async def test_heartbeat_evicts_silent_device(self):
+        scheduler = HeartbeatScheduler(interval=0.2, misses=2, jitter=0, tick=0.05)
+        with mock.patch('devices.consumers.heartbeat', scheduler):
+            communicator = await connect_device('basky_test_hb')
+
+            ping = await communicator.receive_json_from(timeout=1)
+            self.assertEqual((ping['type'], ping['id']), ('ping', HEARTBEAT_ID))
+            await communicator.send_json_to({'type': 'pong', 'id': HEARTBEAT_ID})
+            self.assertIsNotNone(device_registry.get('basky_test_hb'))
+
+            # الجهاز لا يرد بعد ذلك (اتصال نصف مفتوح)
+            while True:
+                output = await communicator.receive_output(timeout=2)
+                if output['type'] == 'websocket.close':
+                    break
+            self.assertEqual(output['code'], CLOSE_STALE)
+            self.assertIsNone(device_registry.get('basky_test_hb'))
+            self.assertEqual(scheduler.evicted, 1)
+            self.assertEqual(len(scheduler.wheel), 0)
+            self.assertFalse(scheduler.connections)
+
+    async def test_repeated_status_collapsed(self):
+        communicator = await connect_device('basky_test_status')
+
+        @sync_to_async
+        def status_rows():
+            return list(
+                DeviceStatus.objects.filter(device_id='basky_test_status').order_by('id')
+                .values_list('status', 'mode', 'repeat_count', 'last_seen')
+            )
+
+        async def wait_for_rows(count):
+            deadline = time.monotonic() + 1
+            while len(rows := await status_rows()) < count:
+                self.assertLess(time.monotonic(), deadline)
+                await asyncio.sleep(0.01)
+            return rows
+
+        for _ in range(3):
+            await communicator.send_json_to({'type': 'status', 'status': 'ready'})
+        rows = await wait_for_rows(2)
+        self.assertEqual([row[:3] for row in rows], [('connected', 'normal', 0), ('ready', 'normal', 0)])
+
+        # تغير الـ mode: صف جديد، وتكرارات الصف السابق تُكتب قبله
+        await communicator.send_json_to({'type': 'status', 'status': 'ready', 'mode': 'calibration'})
+        rows = await wait_for_rows(3)
+        self.assertEqual([row[:3] for row in rows], [
+            ('connected', 'normal', 0), ('ready', 'normal', 2), ('ready', 'calibration', 0)
+        ])
+        self.assertIsNotNone(rows[1][3])
+
+        # التكرارات المتبقية تُكتب عند قطع الاتصال
+        for _ in range(2):
+            await communicator.send_json_to({'type': 'status', 'status': 'ready', 'mode': 'calibration'})
+        await communicator.disconnect()
+        rows = await status_rows()
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2][2], 2)
+
+    async def test_buffer_flushed_on_disconnect(self):
+        communicator = await connect_device('basky_test_buffer')
+        await communicator.send_json_to({'type': 'sensor_data', 'force': {'force': 5}})
+        await communicator.disconnect()
+        await ingest_queue.join()
+        reading = await SensorReading.objects.aget(device_id='basky_test_buffer')
+        self.assertEqual(reading.force_value, 5)
+
+
+class DeviceListTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='owner@basky.local', password='test', national_id='list-test'
+        )
+
+    def add_device(self, index):
+        device = DeviceConfig.objects.create(device_id=f'basky_list_{index}', user=self.user)
+        DeviceStatus.objects.create(device_id=device.device_id, status='connected')
+        DeviceStatus.objects.create(device_id=device.device_id, status='ready')
+        SensorReading.objects.bulk_create([
+            make_sensor_reading(device.device_id, [index] * 13) for _ in range(3)
+        ])
+        Session.objects.create(
+            device=device, child_name='test', exercise_type='Stretching', difficulty='easy',
+            is_active=index % 2 == 0
+        )
+        return device
+
+    def test_query_count_constant(self):
+        self.add_device(0)
+        with self.assertNumQueries(1):
+            devices = get_device_list(self.user)
+        self.assertEqual(len(devices), 1)
+
+        for index in range(1, 20):
+            self.add_device(index)
+        with self.assertNumQueries(1):
+            devices = get_device_list(self.user)
+        self.assertEqual(len(devices), 20)
+
+    def test_annotations(self):
+        self.add_device(0)
+        self.add_device(1)
+
+        devices = {device.device_id: device for device in get_device_list(self.user)}
+        self.assertEqual(devices['basky_list_0'].last_status, 'ready')
+        self.assertIsNotNone(devices['basky_list_0'].last_reading_at)
+        self.assertTrue(devices['basky_list_0'].has_active_session)
+        self.assertFalse(devices['basky_list_1'].has_active_session)
+        self.assertFalse(devices['basky_list_1'].is_connected)
+
+
+class FakeAnnouncer(asyncio.DatagramProtocol):
+    """جهاز وهمي يرسل رسائل إعلان UDP مثل ESP32 غير مُعد"""
+
+    @classmethod
+    async def create(cls, address):
+        loop = asyncio.get_running_loop()
+        transport, announcer = await loop.create_datagram_endpoint(cls, remote_addr=address)
+        return announcer
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def announce(self, device_id, **fields):
+        self.transport.sendto(json.dumps({'type': 'announce', 'device_id': device_id, **fields}).encode())
+
+    def close(self):
+        self.transport.close()
+
+
+class DiscoveryTests(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    async def wait_for(self, condition, timeout=1):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            await asyncio.sleep(0.01)
+
+    async def test_announcements_expire(self):
+        service = DiscoveryService(host='127.0.0.1', port=0, ttl=0.3, publish_interval=0.02)
+        self.assertTrue(await service.start())
+        announcer = await FakeAnnouncer.create(service.address)
+        try:
+            announcer.announce('basky_new', mac='AA:BB', ws_port=8080)
+            announcer.transport.sendto(b'not json')
+            announcer.transport.sendto(json.dumps({'type': 'status'}).encode())
+            await self.wait_for(lambda: service.announcements)
+            await self.wait_for(lambda: service._published)
+
+            devices = await service.adiscovered()
+            self.assertEqual([device['device_id'] for device in devices], ['basky_new'])
+            self.assertEqual(devices[0]['ip'], '127.0.0.1')
+            self.assertEqual(devices[0]['mac'], 'AA:BB')
+
+            # الجهاز يتوقف عن الإعلان بعد إعداده
+            await asyncio.sleep(0.35)
+            self.assertEqual(await service.adiscovered(), [])
+
+            announcer.announce('basky_other')
+            await self.wait_for(lambda: service.announcements == 2)
+            self.assertEqual(list(service.table.devices), ['basky_other'])
+        finally:
+            announcer.close()
+            service.stop()
+
+    def test_server_ip_cached(self):
+        with mock.patch('devices.discovery._server_ip', None), \
+                mock.patch('devices.discovery.socket.socket', wraps=socket.socket) as sockets:
+            first = get_server_ip()
+            self.assertEqual(get_server_ip(), first)
+        self.assertEqual(sockets.call_count, 1)
+
+    def test_invalid_announcements_ignored(self):
+        address = ('192.168.1.20', 4210)
+
+        def announcement(**fields):
+            return json.dumps({'type': 'announce', 'device_id': 'basky_new', **fields}).encode()
+
+        info = parse_announcement(announcement(mac='AA:BB', ws_port=8080, name='Basky'), address)
+        self.assertEqual(info, {'device_id': 'basky_new', 'ip': '192.168.1.20', 'mac': 'AA:BB', 'ws_port': 8080,
+                                'name': 'Basky'})
+
+        invalid = [
+            b'{"type": "announce", "device_id": "\xff"}',
+            announcement(ws_port=0),
+            announcement(ws_port=70000),
+            announcement(ws_port=True),
+            announcement(ws_port='8080'),
+            announcement(name='x' * 65),
+            announcement(name='<b>\n</b>'),
+            announcement(firmware=['1.0']),
+            json.dumps({'type': 'announce', 'device_id': 123}).encode(),
+        ]
+        for name in ('json', 'orjson'):
+            with mock.patch('devices.discovery.codec.loads', get_codec(name).loads):
+                for payload in invalid:
+                    self.assertIsNone(parse_announcement(payload, address), payload)
+        self.assertIsNone(parse_announcement(announcement(), ('not-an-ip', 4210)))
+
+
+class ProtocolTests(TestCase):
+    values = [float(index) for index in range(12)] + [12.5]
+
+    def test_frame_round_trip(self):
+        frame = decode_sensor_frame(encode_sensor_frame(7, 1234, self.values))
+        self.assertIsInstance(frame, SensorFrame)
+        self.assertEqual((frame.sequence, frame.device_timestamp), (7, 1234))
+        self.assertEqual(list(frame.values), self.values)
+
+    def test_invalid_frames_rejected(self):
+        frame = encode_sensor_frame(1, 1, self.values)
+        invalid = {
+            'short': frame[:3],
+            'long': frame + b'\x00',
+            'magic': b'XX' + frame[2:],
+            'version': FRAME_MAGIC + bytes([FRAME_VERSION + 1]) + frame[3:],
+            'type': frame[:3] + b'\x09' + frame[4:],
+        }
+        for name, data in invalid.items():
+            with self.subTest(name), self.assertRaises(FrameError):
+                decode_sensor_frame(data)
+
+    def test_batch_round_trip(self):
+        batch = decode_frame(encode_sensor_batch(0xFFFFFFFF, [(10, self.values), (20, self.values[::-1])]))
+        self.assertIsInstance(batch, SensorBatch)
+        self.assertEqual(batch.sequence, 0xFFFFFFFF)
+        self.assertEqual([t for t, _ in batch.samples], [10, 20])
+        self.assertEqual(list(batch.samples[1][1]), self.values[::-1])
+        self.assertIsInstance(decode_frame(encode_sensor_frame(1, 1, self.values)), SensorFrame)
+
+    def test_invalid_batches_rejected(self):
+        batch = encode_sensor_batch(1, [(1, self.values)])
+        invalid = {
+            'short': batch[:3],
+            'header': batch[:BATCH_HEADER.size - 1],
+            'length': batch[:-4],
+            'type': batch[:3] + b'\x09' + batch[4:],
+        }
+        for name, data in invalid.items():
+            with self.subTest(name), self.assertRaises(FrameError):
+                decode_frame(data)
+
+    def test_non_finite_values_rejected(self):
+        for data in (
+            encode_sensor_frame(1, 1, [math.nan] + self.values[1:]),
+            encode_sensor_batch(1, [(1, self.values), (2, self.values[:-1] + [math.inf])]),
+        ):
+            with self.assertRaises(FrameError):
+                decode_frame(data)
+
+
+class IngestTests(TestCase):
+
+    def test_sample_timestamps_wraparound(self):
+        received_at = timezone.now()
+        # عداد ms في الجهاز يلتف بعد 2^32
+        timestamps = sample_timestamps([0xFFFFFFF0, 0xFFFFFFFA, 4], received_at)
+        self.assertEqual(
+            [received_at - timestamp for timestamp in timestamps],
+            [timedelta(milliseconds=20), timedelta(milliseconds=10), timedelta(0)]
+        )
+        self.assertEqual(sample_timestamps([]), [])
+
+    def make_queue(self, policy, maxsize=2, fail_on=None):
+        """طابور بكتابة وهمية تسجل الدفعات (وتفشل إذا احتوت fail_on)"""
+        queue = IngestQueue(maxsize=maxsize, policy=policy)
+        queue.writes = []
+
+        def write(readings):
+            if fail_on in readings:
+                raise RuntimeError('write failed')
+            queue.writes.append(list(readings))
+            return len(readings)
+
+        queue._write = write
+        self.addCleanup(queue._executor.shutdown)
+        return queue
+
+    async def test_block_keeps_every_batch(self):
+        queue = self.make_queue(OVERFLOW_BLOCK, maxsize=1)
+        for index in range(4):
+            await queue.put('basky_a', [index])
+        await queue.join()
+        self.assertEqual(sum(queue.writes, []), [0, 1, 2, 3])
+        self.assertEqual(queue.dropped_frames, 0)
+
+    async def test_drop_oldest(self):
+        queue = self.make_queue(OVERFLOW_DROP_OLDEST)
+        await queue.put('basky_a', [1, 2])
+        await queue.put('basky_b', [3])
+        await queue.put('basky_c', [4])
+        await queue.join()
+        self.assertEqual(queue.writes, [[3, 4]])
+        self.assertEqual(queue.dropped_frames, 2)
+
+    async def test_coalesce(self):
+        queue = self.make_queue(OVERFLOW_COALESCE)
+        queue.max_coalesced = 3
+        await queue.put('basky_a', [1])
+        await queue.put('basky_b', [2])
+        # الطابور ممتلئ: تُدمج مع دفعة basky_a الموجودة (وتُحذف الأقدم فوق max_coalesced)
+        await queue.put('basky_a', [3, 4, 5])
+        await queue.join()
+        self.assertEqual(queue.writes, [[3, 4, 5, 2]])
+        self.assertEqual(queue.dropped_frames, 1)
+
+    async def test_write_failure_counted(self):
+        queue = self.make_queue(OVERFLOW_DROP_OLDEST, maxsize=10, fail_on='bad')
+        await queue.put('basky_a', ['bad'])
+        await queue.join()
+        # الـ writer يستمر بعد فشل الكتابة
+        await queue.put('basky_a', ['ok'])
+        await queue.join()
+        self.assertEqual(queue.writes, [['ok']])
+        self.assertEqual((queue.write_errors, queue.dropped_frames), (1, 1))
+
+    async def test_write_failure_drops_only_failing_device(self):
+        queue = self.make_queue(OVERFLOW_DROP_OLDEST, maxsize=10, fail_on='bad')
+        await queue.put('basky_a', ['ok'])
+        await queue.put('basky_b', ['bad', 'bad2'])
+        await queue.join()
+        self.assertEqual(queue.writes, [['ok']])
+        self.assertEqual(queue.rows_written, 1)
+        self.assertEqual((queue.write_errors, queue.dropped_frames), (1, 2))
+
+    def test_invalid_sensor_values_rejected(self):
+        for values in ([None] * 13, ['abc'] * 13, [math.nan] * 13, [0] * 12):
+            with self.subTest(values=values[0]), self.assertRaises(ValueError):
+                make_sensor_reading('basky_bad', values)
+
+    def readings(self, count):
+        return [make_sensor_reading('basky_buffer', [index] * 13) for index in range(count)]
+
+    async def test_buffer_flushes_when_full(self):
+        queue = self.make_queue(OVERFLOW_BLOCK)
+        with mock.patch('devices.ingest.ingest_queue', queue):
+            buffer = SensorBuffer('basky_buffer', batch_size=3, max_age=10)
+            readings = self.readings(4)
+            await buffer.extend(readings[:2])
+            self.assertEqual(buffer.rows_queued, 0)
+            await buffer.add(readings[2])
+            await buffer.add(readings[3])
+            await queue.join()
+        self.assertEqual(queue.writes, [readings[:3]])
+        self.assertEqual((buffer.rows_queued, buffer.take()), (3, readings[3:]))
+
+    async def test_buffer_flushes_on_timer(self):
+        queue = self.make_queue(OVERFLOW_BLOCK)
+        with mock.patch('devices.ingest.ingest_queue', queue):
+            buffer = SensorBuffer('basky_buffer', batch_size=10, max_age=0.05)
+            readings = self.readings(2)
+            await buffer.extend(readings)
+            await asyncio.sleep(0.15)
+            await queue.join()
+            self.assertEqual(queue.writes, [readings])
+            self.assertIsNone(buffer._timer)
+
+            # فشل الكتابة من الـ timer يُسجل (وليس task بدون مرجع)
+            with mock.patch.object(queue, 'put', side_effect=RuntimeError('queue closed')), \
+                    self.assertLogs('devices.ingest', 'ERROR') as logs:
+                await buffer.extend(self.readings(1))
+                await asyncio.sleep(0.15)
+        self.assertIn('timed flush for basky_buffer: queue closed', logs.output[0])
+
+    def test_flush_all_buffers_on_exit(self):
+        with mock.patch('devices.ingest._live_buffers', set()), \
+                mock.patch('devices.ingest.ingest_queue', self.make_queue(OVERFLOW_BLOCK)):
+            buffer = SensorBuffer('basky_buffer', max_age=10)
+            buffer.readings = self.readings(2)
+            self.assertEqual(flush_all_buffers(), 2)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(SensorReading.objects.filter(device_id='basky_buffer').count(), 2)
+
+
+class TimeseriesTests(TestCase):
+
+    def test_chunk_round_trip(self):
+        start = timezone.now()
+        readings = [
+            make_sensor_reading(
+                'basky_chunk', [index + value / 10 for value in range(13)], exercise='Stretching',
+                session_duration=index, timestamp=start + timedelta(microseconds=index * 12345)
+            )
+            for index in range(50)
+        ]
+        chunk = pack_chunk(readings)
+        self.assertEqual(chunk.sample_count, 50)
+
+        restored = unpack_chunk(chunk)
+        self.assertEqual([r.timestamp for r in restored], [r.timestamp for r in readings])
+        self.assertEqual([r.session_duration for r in restored], list(range(50)))
+        self.assertEqual(restored[0].exercise_type, 'Stretching')
+        for original, reading in zip(readings, restored):
+            for field in SENSOR_FIELDS:
+                self.assertAlmostEqual(getattr(reading, field), getattr(original, field), places=4)
+
+    def test_cursor_pages_with_equal_timestamps(self):
+        now = timezone.now()
+        # 5 قراءات بنفس الوقت بين قراءتين أحدث وأقدم
+        times = [now + timedelta(seconds=1)] + [now] * 5 + [now - timedelta(seconds=1)]
+        SensorReading.objects.bulk_create([
+            make_sensor_reading('basky_pages', [0] * 13, timestamp=timestamp) for timestamp in times
+        ])
+        expected = list(
+            SensorReading.objects.filter(device_id='basky_pages').order_by('-timestamp', '-id')
+            .values_list('timestamp', 'id')
+        )
+
+        pages = [readings_page('basky_pages', [], limit=2)]
+        while pages[-1]:
+            last = pages[-1][-1]
+            cursor = encode_cursor(last[0], last[1])
+            self.assertEqual(decode_cursor(cursor), (last[0], last[1]))
+            pages.append(readings_page('basky_pages', [], limit=2, before=decode_cursor(cursor)))
+        self.assertEqual(sum(pages, []), expected)
+
+        # prev من أول الصفحة الثالثة يرجع الصفحة الثانية
+        first = pages[2][0]
+        self.assertEqual(readings_page('basky_pages', [], limit=2, after=(first[0], first[1])), pages[1])
+
+
+class SessionStatsTests(TestCase):
+
+    def test_cache_invalidated_on_session_changes(self):
+        user = get_user_model().objects.create_user(
+            email='stats@basky.local', password='test', national_id='stats-test'
+        )
+        device = DeviceConfig.objects.create(device_id='basky_stats', user=user)
+        self.assertEqual(session_stats(device.pk)['total_sessions'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            session = Session.objects.create(
+                device=device, child_name='test', exercise_type='Stretching', difficulty='easy'
+            )
+        self.assertEqual(session_stats(device.pk)['total_sessions'], 1)
+        self.assertEqual(session_stats(device.pk)['completed_sessions'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            session.end_session()
+        stats = session_stats(device.pk)
+        self.assertEqual(stats['completed_sessions'], 1)
+        self.assertEqual(stats['exercise_stats'][0]['exercise_type'], 'Stretching')
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class BulkCommandTests(TransactionTestCase):
+
+    async def test_status_per_device(self):
+        user = await sync_to_async(get_user_model().objects.create_user)(
+            email='bulk@basky.local', password='test', national_id='bulk-test'
+        )
+        for device_id in ('basky_bulk_on', 'basky_bulk_off'):
+            await DeviceConfig.objects.acreate(device_id=device_id, user=user)
+        await sync_to_async(self.async_client.force_login)(user)
+        communicator = await connect_device('basky_bulk_on')
+
+        request = asyncio.ensure_future(self.async_client.post('/devices/api/devices/command/', {
+            'device_ids': ['basky_bulk_on', 'basky_bulk_off', 'basky_not_mine'], 'command': 'ping', 'timeout': 1,
+        }, content_type='application/json'))
+        ping = await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'pong', 'id': ping['id']})
+
+        response = (await request).json()
+        statuses = {result['device_id']: result['status'] for result in response['results']}
+        self.assertEqual(statuses, {'basky_bulk_on': 'ok', 'basky_bulk_off': 'offline', 'basky_not_mine': 'not_found'})
+        self.assertEqual(response['delivered'], 1)
+        await communicator.disconnect()
+
+
+class DeviceSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='summary@basky.local', password='test', national_id='summary-test'
+        )
+        self.device = DeviceConfig.objects.create(device_id='basky_summary', user=self.user)
+
+    def add_readings(self, *timestamps):
+        readings = [make_sensor_reading('basky_summary', [0] * 13, timestamp=timestamp) for timestamp in timestamps]
+        SensorReading.objects.bulk_create(readings)
+        record_readings(readings)
+
+    def test_readings_added_to_stored_totals(self):
+        now = timezone.now()
+        self.add_readings(now, now - timedelta(seconds=1))
+        self.assertEqual(get_device_summary('basky_summary').total_readings, 2)
+
+        # تحديث من مكان آخر بين الدفعتين لا يضيع
+        DeviceSummary.objects.filter(device_id='basky_summary').update(total_readings=10)
+        self.add_readings(now - timedelta(seconds=5))
+        summary = get_device_summary('basky_summary')
+        self.assertEqual(summary.total_readings, 11)
+        self.assertEqual(summary.last_reading_at, now)
+
+        refresh_reading_totals()
+        self.assertEqual(get_device_summary('basky_summary').total_readings, 3)
+
+    def test_deleted_device_summary_removed(self):
+        Session.objects.create(
+            device=self.device, child_name='test', exercise_type='Stretching', difficulty='easy'
+        )
+        self.assertEqual(get_device_summary('basky_summary').total_sessions, 1)
+
+        self.device.delete()
+        self.assertFalse(DeviceSummary.objects.filter(device_id='basky_summary').exists())
+
+        # نفس الـ device_id يُضاف من جديد بدون جلسات الجهاز القديم
+        DeviceConfig.objects.create(device_id='basky_summary', user=self.user)
+        self.assertEqual(get_device_summary('basky_summary').total_sessions, 0)
+
+
+class ProbeTests(TestCase):
+
+    async def start_server(self, reply):
+        async def handle(reader, writer):
+            await reader.readline()
+            if reply:
+                writer.write(b'HTTP/1.0 200 OK\r\n\r\n')
+                await writer.drain()
+            else:
+                # منفذ لا يرد: يُبقي الاتصال مفتوحاً حتى يغلقه الطرف الآخر
+                await reader.read()
+            writer.close()
+
+        return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+    async def test_first_reachable_port_wins(self):
+        async with await self.start_server(reply=False) as silent, await self.start_server(reply=True) as server:
+            silent_port = silent.sockets[0].getsockname()[1]
+            open_port = server.sockets[0].getsockname()[1]
+            started = time.monotonic()
+            result = await probe('127.0.0.1', [silent_port, open_port], timeout=2, http_path='/', use_cache=False)
+            self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(result['reachable'])
+        self.assertEqual(result['port'], open_port)
+        self.assertIsNone(result['error'])
+
+    async def test_unreachable_reports_first_error(self):
+        async with await self.start_server(reply=False) as silent:
+            silent_port = silent.sockets[0].getsockname()[1]
+            result = await probe('127.0.0.1', [silent_port], timeout=0.2, http_path='/', use_cache=False)
+        self.assertFalse(result['reachable'])
+        self.assertEqual(result['error'], 'timeout')
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='export@basky.local', password='test', national_id='export-test'
+        )
+        self.device = DeviceConfig.objects.create(device_id='basky_export', user=self.user)
+        self.session = Session.objects.create(
+            device=self.device, child_name='test', exercise_type='Stretching', difficulty='easy'
+        )
+        self.start = timezone.now().replace(microsecond=0)
+        SensorReading.objects.bulk_create([
+            make_sensor_reading('basky_export', [index] * 13, timestamp=self.start + timedelta(seconds=index),
+                                session_id=self.session.pk if index < 2 else None)
+            for index in range(3)
+        ])
+        self.client.force_login(self.user)
+
+    def export(self, device_id='basky_export', **params):
+        return self.client.get(f'/devices/api/device/{device_id}/export/', params)
+
+    def test_csv_range(self):
+        response = self.export(start=self.start.isoformat(), fields='force')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'timestamp,force_value')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['0.0', '1.0', '2.0'])
+
+    def test_ndjson_session(self):
+        response = self.export(session=self.session.pk, format='ndjson', fields='force,exercise')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        items = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([item['force_value'] for item in items], [0, 1])
+        self.assertEqual(set(items[0]), {'timestamp', 'force_value', 'exercise_type'})
+
+    def test_gzip(self):
+        response = self.export(session=self.session.pk, compress='gzip', fields='force')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz"'))
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.export(session=self.session.pk, start='yesterday').status_code, 400)
+        self.assertEqual(self.export(start=self.start.isoformat(), end='soon').status_code, 400)
+        self.assertEqual(self.export(start=self.start.isoformat(), end='2024-13-40T00:00:00').status_code, 400)
+        self.assertEqual(self.export().status_code, 400)
+        self.assertEqual(self.export(session='abc').status_code, 400)
+
+    def test_other_users_device_hidden(self):
+        other = get_user_model().objects.create_user(
+            email='other@basky.local', password='test', national_id='export-other'
+        )
+        DeviceConfig.objects.create(device_id='basky_export_other', user=other)
+        self.assertEqual(self.export('basky_export_other', start=self.start.isoformat()).status_code, 404)
+
+        other_device = DeviceConfig.objects.get(device_id='basky_export_other')
+        other_session = Session.objects.create(
+            device=other_device, child_name='test', exercise_type='Stretching', difficulty='easy'
+        )
+        self.assertEqual(self.export(session=other_session.pk).status_code, 404)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SessionIngestTests(TransactionTestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    async def send_samples(self, communicator, count):
+        """دفعة عينات + عينة غير صالحة (رسالة الخطأ تؤكد أن الدفعة عولجت)"""
+        samples = [{'t': index * 10, 'v': [index] * 13} for index in range(count)]
+        with self.assertLogs('devices.consumers', 'WARNING'):
+            await communicator.send_json_to({'type': 'sensor_batch', 'samples': samples + [{'t': 0, 'v': ['x'] * 13}]})
+            error = await communicator.receive_json_from()
+        self.assertEqual(error['type'], 'error')
+
+    async def test_readings_linked_to_session(self):
+        user = await sync_to_async(get_user_model().objects.create_user)(
+            email='session@basky.local', password='test', national_id='session-ingest'
+        )
+        device = await DeviceConfig.objects.acreate(device_id='basky_test_session', user=user)
+        session = await Session.objects.acreate(
+            device=device, child_name='test', exercise_type='Stretching', difficulty='easy'
+        )
+        communicator = await connect_device('basky_test_session')
+
+        await BaskyDeviceConsumer.send_command_to_device(
+            'basky_test_session', 'start_session', {'session_id': session.pk, 'exercise': 'Stretching'}
+        )
+        self.assertEqual((await communicator.receive_json_from())['type'], 'start_session')
+        await self.send_samples(communicator, 3)
+
+        # الجلسة تنتهي قبل كتابة القراءات المتجمعة (كما يفعل stop_session_api)
+        await sync_to_async(session.end_session)()
+        ended = await Session.objects.aget(pk=session.pk)
+        await self.send_samples(communicator, 2)
+
+        await BaskyDeviceConsumer.send_command_to_device('basky_test_session', 'stop_session', {})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'stop_session')
+        await self.send_samples(communicator, 1)
+        await communicator.disconnect()
+        await ingest_queue.join()
+
+        readings = SensorReading.objects.filter(device_id='basky_test_session')
+        self.assertEqual(await readings.filter(session=session).acount(), 5)
+        self.assertEqual(await readings.filter(session=None).acount(), 1)
+
+        session = await Session.objects.aget(pk=session.pk)
+        last = await readings.filter(session=session).order_by('-timestamp').afirst()
+        self.assertEqual(session.total_readings, 5)
+        self.assertEqual(session.last_sample_at, last.timestamp)
+        # القراءات المتأخرة لا تغير نهاية الجلسة ومدتها
+        self.assertFalse(session.is_active)
+        self.assertEqual((session.end_time, session.duration), (ended.end_time, ended.duration))
+
+
+class RollupTests(TestCase):
+
+    def reading(self, timestamp, value, exercise='Stretching'):
+        return make_sensor_reading('basky_rollup', [value] * 13, exercise=exercise, timestamp=timestamp)
+
+    def test_buckets_merged_across_flushes(self):
+        minute = bucket_start(timezone.now() - timedelta(minutes=5), 60)
+        first = minute + timedelta(seconds=5)
+        apply_rollups([self.reading(first, 1), self.reading(first + timedelta(milliseconds=200), 3)])
+        apply_rollups([
+            self.reading(first + timedelta(milliseconds=500), 5),
+            self.reading(first + timedelta(seconds=1), -1, exercise='Reaching'),
+        ])
+
+        seconds, resolution = rollup_series('basky_rollup', minute, minute + timedelta(minutes=1), resolution=1)
+        self.assertEqual(resolution, 1)
+        self.assertEqual([bucket['count'] for bucket in seconds], [3, 1])
+        self.assertEqual(seconds[0]['bucket'], first.isoformat())
+        self.assertEqual(seconds[0]['force_value'], {'min': 1, 'max': 5, 'mean': 3})
+        self.assertEqual(seconds[1]['force_value'], {'min': -1, 'max': -1, 'mean': -1})
+
+        # نوعا التمرين يُدمجان في نفس الدقيقة، ويُفصلان مع exercise_type
+        minutes, _ = rollup_series('basky_rollup', minute, minute + timedelta(minutes=1), resolution=60)
+        self.assertEqual(len(minutes), 1)
+        self.assertEqual(minutes[0]['count'], 4)
+        self.assertEqual(minutes[0]['shoulder_pitch'], {'min': -1, 'max': 5, 'mean': 2})
+        minutes, _ = rollup_series(
+            'basky_rollup', minute, minute + timedelta(minutes=1), resolution=60, exercise_type='Stretching'
+        )
+        self.assertEqual(minutes[0]['count'], 3)
+
+    def test_api_rejects_unknown_resolution(self):
+        user = get_user_model().objects.create_user(
+            email='rollup@basky.local', password='test', national_id='rollup-test'
+        )
+        DeviceConfig.objects.create(device_id='basky_rollup', user=user)
+        self.client.force_login(user)
+        apply_rollups([self.reading(timezone.now() - timedelta(minutes=1), 2)])
+
+        url = '/devices/api/device/basky_rollup/rollups/'
+        for resolution in ('abc', '5', '-1'):
+            self.assertEqual(self.client.get(url, {'resolution': resolution}).status_code, 400)
+        response = self.client.get(url, {'resolution': '60'}).json()
+        self.assertTrue(response['success'])
+        self.assertEqual((response['resolution'], response['count']), (60, 1))
+        self.assertEqual(self.client.get('/devices/api/device/basky_missing/rollups/').status_code, 404)
+
+
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.readings = [
+            make_sensor_reading('basky_retention', [index] * 13, timestamp=now - timedelta(days=10, seconds=index))
+            for index in range(3)
+        ] + [make_sensor_reading('basky_retention', [0] * 13, timestamp=now)]
+        SensorReading.objects.bulk_create(self.readings)
+        record_readings(self.readings)
+
+    def test_delete_in_batches(self):
+        old = timezone.now() - timedelta(days=40)
+        for _ in range(5):
+            DeviceStatus.objects.create(device_id='basky_retention', status='ready')
+        DeviceStatus.objects.update(timestamp=old)
+        DeviceStatus.objects.create(device_id='basky_retention', status='ready')
+
+        with mock.patch('devices.retention.reclaim_space') as reclaim_space:
+            deleted = delete_in_batches(DeviceStatus.objects.filter(timestamp__lt=old + timedelta(days=1)),
+                                        batch_size=2, pause=0)
+        self.assertEqual(deleted, 5)
+        self.assertEqual(reclaim_space.call_count, 3)
+        self.assertEqual(DeviceStatus.objects.count(), 1)
+
+    def test_deleted_readings_refresh_totals(self):
+        with mock.patch('devices.retention.RETENTION_POLICIES', {'sensor_readings': {'days': 7}}):
+            results = run_retention(batch_size=2, pause=0)
+        self.assertEqual([(r['table'], r['archived'], r['deleted']) for r in results], [('sensor_readings', 0, 3)])
+        self.assertEqual(SensorReading.objects.count(), 1)
+        self.assertEqual(get_device_summary('basky_retention').total_readings, 1)
+
+    def test_archived_readings_keep_totals(self):
+        results = run_retention(tables=['sensor_readings'], pause=0)
+        self.assertEqual([(r['archived'], r['deleted']) for r in results], [(3, 0)])
+        self.assertEqual(SensorReading.objects.count(), 1)
+        self.assertTrue(SensorChunk.objects.filter(device_id='basky_retention').exists())
+        self.assertEqual(get_device_summary('basky_retention').total_readings, 4)
+
+
+class DeviceStateTests(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    async def stored(self):
+        return await DeviceLatestState.objects.filter(device_id='basky_state').values('status', 'last_seen').aget()
+
+    async def test_volatile_fields_persisted_lazily(self):
+        store = DeviceStateStore()
+        times = [timezone.now() + timedelta(seconds=index) for index in range(4)]
+
+        await store.aupdate('basky_state', status='ready', last_seen=times[0])
+        self.assertEqual(await self.stored(), {'status': 'ready', 'last_seen': times[0]})
+
+        # الأوقات فقط: في الـ cache وليس في الصف
+        await store.aupdate('basky_state', last_seen=times[1])
+        self.assertEqual((await self.stored())['last_seen'], times[0])
+        self.assertEqual((await sync_to_async(store.get)('basky_state'))['last_seen'], times[1])
+
+        await store.aupdate('basky_state', status='busy', last_seen=times[2])
+        self.assertEqual(await self.stored(), {'status': 'busy', 'last_seen': times[2]})
+
+        await store.aupdate('basky_state', last_seen=times[3])
+        await store.aflush('basky_state')
+        self.assertEqual((await self.stored())['last_seen'], times[3])
+
+    async def test_cached_state_expires(self):
+        store = DeviceStateStore()
+        await store.aupdate('basky_state', status='ready')
+        await cache.aclear()
+        await DeviceLatestState.objects.filter(device_id='basky_state').aupdate(status='offline')
+
+        with mock.patch('devices.state.STATE_CACHE_TTL', 0.05):
+            self.assertEqual((await sync_to_async(store.get)('basky_state'))['status'], 'offline')
+        await DeviceLatestState.objects.filter(device_id='basky_state').aupdate(status='busy')
+        await asyncio.sleep(0.1)
+        self.assertIsNone(await cache.aget(state_key('basky_state')))
+        self.assertEqual((await sync_to_async(store.get)('basky_state'))['status'], 'busy')
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class DeviceStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='stream@basky.local', password='test', national_id='stream-test'
+        )
+        DeviceConfig.objects.create(device_id='basky_stream', user=self.user)
+
+    async def subscribe(self, user, max_fps=2):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/device/basky_stream/stream/?max_fps={max_fps}'
+        )
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        if connected:
+            subscribed = await communicator.receive_json_from()
+            self.assertEqual((subscribed['type'], subscribed['max_fps']), ('subscribed', max_fps))
+        return connected, communicator
+
+    async def publish(self, value):
+        await get_channel_layer().group_send(dashboard_group('basky_stream'), {
+            'type': 'dashboard.sample', 'device_id': 'basky_stream', 'values': [value] * 13,
+            'sequence': value, 'device_timestamp': None, 'timestamp': timezone.now().isoformat(),
+        })
+
+    async def test_other_user_rejected(self):
+        other = await sync_to_async(get_user_model().objects.create_user)(
+            email='viewer@basky.local', password='test', national_id='stream-other'
+        )
+        connected, _ = await self.subscribe(other)
+        self.assertFalse(connected)
+
+    async def test_samples_throttled_to_max_fps(self):
+        connected, communicator = await self.subscribe(self.user)
+        self.assertTrue(connected)
+
+        for value in range(3):
+            await self.publish(value)
+        first = await communicator.receive_json_from()
+        self.assertEqual(first['sequence'], 0)
+        # العينات بين مرتين إرسال تُدمج: الأحدث فقط بعد 1/max_fps
+        started = time.monotonic()
+        latest = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(latest['sequence'], 2)
+        self.assertGreater(time.monotonic() - started, 0.3)
+        self.assertTrue(await communicator.receive_nothing(0.6))
+        await communicator.disconnect()
+
+    async def test_pending_timer_cancelled_on_disconnect(self):
+        send_pending = DeviceStreamConsumer.send_pending
+        with mock.patch.object(DeviceStreamConsumer, 'send_pending', autospec=True,
+                               side_effect=send_pending) as sends:
+            connected, communicator = await self.subscribe(self.user)
+            await self.publish(0)
+            await communicator.receive_json_from()
+            await self.publish(1)
+            await communicator.disconnect()
+            await asyncio.sleep(0.6)
+        self.assertEqual(sends.call_count, 1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SessionControlTests(TransactionTestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    async def post(self, path, data=None, **params):
+        url = f'/devices/api/device/basky_control/{path}/'
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return await self.async_client.post(url, data or {}, content_type='application/json')
+
+    async def test_anonymous_redirected(self):
+        response = await self.post('start-session')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('?next=/devices/api/device/basky_control/start-session/'))
+
+    async def test_start_stop_round_trip(self):
+        user = await sync_to_async(get_user_model().objects.create_user)(
+            email='control@basky.local', password='test', national_id='control-test'
+        )
+        await sync_to_async(self.async_client.force_login)(user)
+        self.assertEqual((await self.post('start-session')).status_code, 404)
+
+        await DeviceConfig.objects.acreate(device_id='basky_control', user=user)
+        communicator = await connect_device('basky_control')
+
+        request = asyncio.ensure_future(self.post('start-session', {'exercise': 'Reaching'}, wait=1))
+        command = await communicator.receive_json_from()
+        self.assertEqual((command['type'], command['exercise']), ('start_session', 'Reaching'))
+        await communicator.send_json_to({'type': 'session_ack', 'id': command['id'], 'status': 'started'})
+        response = (await request).json()
+        self.assertTrue(response['success'])
+        self.assertTrue(response['confirmed'])
+        session = await Session.objects.aget(pk=response['session_id'])
+        self.assertTrue(session.is_active)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'session_confirmed')
+
+        response = (await self.post('stop-session')).json()
+        self.assertTrue(response['success'])
+        self.assertEqual((await communicator.receive_json_from())['type'], 'stop_session')
+        session = await Session.objects.aget(pk=session.pk)
+        self.assertFalse(session.is_active)
+        self.assertIsNotNone(session.end_time)
+        await communicator.disconnect()
+
+
+class CodecTests(TestCase):
+
+    def test_backends_produce_same_messages(self):
+        message = {'type': 'sensor_data', 'id': 'a1', 'values': [1.5, -2, 0], 'name': 'طفل', 'nested': {'ok': True}}
+        encoded = {name: get_codec(name).dumps(message) for name in ('json', 'orjson')}
+        self.assertEqual(encoded['json'], encoded['orjson'])
+        for name in ('json', 'orjson'):
+            self.assertEqual(get_codec(name).loads(encoded[name]), message)
+            self.assertEqual(get_codec(name).loads(encoded[name].encode()), message)
+        self.assertEqual({get_codec(name).name for name in ('json', 'orjson')}, {'json', 'orjson'})
+
+    def test_now_iso_matches_isoformat(self):
+        before = datetime.now()
+        value = now_iso()
+        after = datetime.now()
+        self.assertEqual(len(value), len(before.replace(microsecond=1).isoformat()))
+        self.assertTrue(before <= datetime.fromisoformat(value) <= after)
@@ -0,0 +1,313 @@
+# ==============================================
+# timeseries.py - تخزين القراءات المضغوط (SensorChunk) والقراءة منه
+# ==============================================
+#
+# القراءات الحديثة تُكتب كصفوف SensorReading، والقديمة تُضغط إلى SensorChunk:
+# كل chunk يحمل نافذة زمنية (CHUNK_SECONDS أو CHUNK_MAX_SAMPLES) لجهاز واحد
+# بنفس الجلسة و exercise/difficulty/mode.
+#
+# محتوى data (كل القيم 4 بايت، مرتبة بالبايت "byte shuffle" ثم مضغوطة بـ zlib):
+#   uint32[n]   offsets بالـ µs من start_time
+#   int32[n]    session_duration
+#   float32[n]  لكل قناة في SENSOR_FIELDS (قناة بعد قناة)
+#
+# الـ byte shuffle يجمع البايت الأول من كل القيم ثم الثاني ... فتتجاور
+# بايتات الـ exponent المتشابهة في القراءات المتقاربة ويتحسن الضغط كثيراً.
+
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from .models import SENSOR_FIELDS, SensorChunk, SensorReading
+
+CHUNK_SECONDS = getattr(settings, 'BASKY_CHUNK_SECONDS', 60)
+CHUNK_MAX_SAMPLES = getattr(settings, 'BASKY_CHUNK_MAX_SAMPLES', 6000)
+
+# offsets بالـ µs في uint32 (أقصى نافذة ~71 دقيقة)
+MAX_CHUNK_SECONDS = 0xFFFFFFFF // 1_000_000
+
+PAGE_SIZE = getattr(settings, 'BASKY_READINGS_PAGE_SIZE', 20)
+MAX_PAGE_SIZE = getattr(settings, 'BASKY_READINGS_MAX_PAGE_SIZE', 1000)
+
+# مجموعات الأعمدة المتاحة في ?fields= (اسم المجموعة -> الأعمدة)
+FIELD_GROUPS = {
+    'shoulder': ('shoulder_pitch', 'shoulder_roll', 'shoulder_yaw'),
+    'elbow': ('elbow_pitch', 'elbow_roll', 'elbow_yaw'),
+    'wrist': ('wrist_pitch', 'wrist_roll', 'wrist_yaw'),
+    'hand': ('hand_pitch', 'hand_roll', 'hand_yaw'),
+    'force': ('force_value',),
+    'exercise': ('exercise_type',),
+    'difficulty': ('difficulty',),
+    'mode': ('mode',),
+    'session': ('session_id',),
+    'session_duration': ('session_duration',),
+}
+DEFAULT_FIELDS = ('shoulder', 'elbow', 'wrist', 'force', 'exercise', 'mode')
+
+
+def shuffle_bytes(raw):
+    """ترتيب البايتات: البايت i من كل قيمة (4 بايت) متجاورة"""
+    return b''.join(raw[i::4] for i in range(4))
+
+
+def unshuffle_bytes(raw):
+    """عكس shuffle_bytes"""
+    n = len(raw) // 4
+    out = bytearray(len(raw))
+    for i in range(4):
+        out[i::4] = raw[i * n:(i + 1) * n]
+    return bytes(out)
+
+
+def pack_chunk(readings):
+    """تحويل قائمة قراءات (مرتبة زمنياً، نفس الجهاز والجلسة) إلى SensorChunk غير محفوظ"""
+    first = readings[0]
+    start = first.timestamp
+
+    offsets = array('I', (
+        int((r.timestamp - start) / timedelta(microseconds=1)) for r in readings
+    ))
+    durations = array('i', (r.session_duration for r in readings))
+    parts = [offsets.tobytes(), durations.tobytes()]
+
+    stats = {}
+    for field in SENSOR_FIELDS:
+        values = array('f', (getattr(r, field) for r in readings))
+        parts.append(values.tobytes())
+        stats[field] = [min(values), max(values), sum(values) / len(values)]
+
+    return SensorChunk(
+        device_id=first.device_id,
+        exercise_type=first.exercise_type,
+        difficulty=first.difficulty,
+        mode=first.mode,
+        session_id=first.session_id,
+        start_time=start,
+        end_time=readings[-1].timestamp,
+        sample_count=len(readings),
+        data=zlib.compress(shuffle_bytes(b''.join(parts))),
+        stats=stats,
+    )
+
+
+def unpack_chunk(chunk):
+    """إعادة بناء القراءات (SensorReading غير محفوظة) من chunk، بالترتيب الزمني"""
+    raw = memoryview(unshuffle_bytes(zlib.decompress(chunk.data)))
+    n = chunk.sample_count
+
+    offsets = array('I')
+    offsets.frombytes(raw[:4 * n])
+    durations = array('i')
+    durations.frombytes(raw[4 * n:8 * n])
+
+    channels = []
+    position = 8 * n
+    for _ in SENSOR_FIELDS:
+        values = array('f')
+        values.frombytes(raw[position:position + 4 * n])
+        channels.append(values)
+        position += 4 * n
+
+    readings = []
+    for i in range(n):
+        reading = SensorReading(
+            device_id=chunk.device_id,
+            exercise_type=chunk.exercise_type,
+            difficulty=chunk.difficulty,
+            mode=chunk.mode,
+            session_id=chunk.session_id,
+            session_duration=durations[i],
+            timestamp=chunk.start_time + timedelta(microseconds=offsets[i]),
+        )
+        for field, values in zip(SENSOR_FIELDS, channels):
+            setattr(reading, field, values[i])
+        readings.append(reading)
+    return readings
+
+
+def split_windows(readings, chunk_seconds=None, max_samples=None):
+    """تقسيم قراءات مرتبة زمنياً إلى نوافذ لكل chunk"""
+    window = timedelta(seconds=min(chunk_seconds or CHUNK_SECONDS, MAX_CHUNK_SECONDS))
+    max_samples = max_samples or CHUNK_MAX_SAMPLES
+
+    current = []
+    for reading in readings:
+        if current and (
+            len(current) >= max_samples
+            or reading.timestamp - current[0].timestamp >= window
+            or (reading.session_id, reading.exercise_type, reading.difficulty, reading.mode)
+            != (current[0].session_id, current[0].exercise_type, current[0].difficulty, current[0].mode)
+        ):
+            yield current
+            current = []
+        current.append(reading)
+    if current:
+        yield current
+
+
+def compact_readings(device_id, before, chunk_seconds=None, max_samples=None, batch_size=20000):
+    """
+    ضغط قراءات جهاز أقدم من before إلى SensorChunk وحذف الصفوف الأصلية
+    على دفعات (كل دفعة في transaction مستقلة). يرجع عدد القراءات المضغوطة.
+    """
+    compacted = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                SensorReading.objects
+                .filter(device_id=device_id, timestamp__lt=before)
+                .order_by('timestamp', 'id')[:batch_size]
+            )
+            if not rows:
+                break
+
+            chunks = [pack_chunk(window) for window in split_windows(rows, chunk_seconds, max_samples)]
+            SensorChunk.objects.bulk_create(chunks)
+            SensorReading.objects.filter(id__in=[r.id for r in rows]).delete()
+            compacted += len(rows)
+
+        if len(rows) < batch_size:
+            break
+    return compacted
+
+
+# ==============================================
+# Read helpers (صفوف + chunks)
+# ==============================================
+
+def latest_readings(device_id, limit):
+    """آخر limit قراءة للجهاز (الأحدث أولاً) من الصفوف ثم من الـ chunks"""
+    readings = list(
+        SensorReading.objects.filter(device_id=device_id).order_by('-timestamp')[:limit]
+    )
+    if len(readings) >= limit:
+        return readings
+
+    chunks = SensorChunk.objects.filter(device_id=device_id).order_by('-start_time')
+    if readings:
+        chunks = chunks.filter(start_time__lt=readings[-1].timestamp)
+
+    for chunk in chunks.iterator(chunk_size=10):
+        samples = unpack_chunk(chunk)
+        if readings:
+            samples = [s for s in samples if s.timestamp < readings[-1].timestamp]
+        readings.extend(reversed(samples))
+        if len(readings) >= limit:
+            break
+    return readings[:limit]
+
+
+def count_readings(device_id):
+    """عدد قراءات الجهاز (صفوف + chunks)"""
+    rows = SensorReading.objects.filter(device_id=device_id).count()
+    chunked = SensorChunk.objects.filter(device_id=device_id).aggregate(
+        total=Sum('sample_count')
+    )['total'] or 0
+    return rows + chunked
+
+
+# ==============================================
+# Keyset pagination (device_id, timestamp, id)
+# ==============================================
+#
+# الـ cursor هو مفتاح آخر قراءة في الصفحة: "<timestamp µs>_<id>"
+# (قراءات الـ chunks ليس لها id فتأخذ ترتيبها السالب داخل الـ chunk:
+# i - sample_count، فتبقى المفاتيح فريدة ومرتبة). كل صفحة استعلام range على
+# index (device_id, timestamp, id) فتكلفتها ثابتة مهما كان عمق الصفحة.
+
+def encode_cursor(timestamp, reading_id):
+    """تحويل مفتاح قراءة إلى cursor"""
+    micros = (timestamp - datetime(1970, 1, 1, tzinfo=dt_timezone.utc)) // timedelta(microseconds=1)
+    return f"{micros}_{reading_id}"
+
+
+def decode_cursor(cursor):
+    """تحويل cursor إلى (timestamp, id)؛ ValueError إذا كان غير صالح"""
+    micros, _, reading_id = cursor.partition('_')
+    timestamp = datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + timedelta(microseconds=int(micros))
+    return timestamp, int(reading_id or 0)
+
+
+def resolve_fields(names=None):
+    """تحويل أسماء المجموعات/الأعمدة المطلوبة إلى قائمة أعمدة؛ ValueError لاسم غير معروف"""
+    columns = []
+    for name in names or DEFAULT_FIELDS:
+        if name in FIELD_GROUPS:
+            group = FIELD_GROUPS[name]
+        elif name in SENSOR_FIELDS:
+            group = (name,)
+        else:
+            raise ValueError(name)
+        columns.extend(column for column in group if column not in columns)
+    return columns
+
+
+def readings_page(device_id, columns, limit=None, before=None, after=None):
+    """
+    صفحة قراءات للجهاز بالـ keyset (الأحدث أولاً).
+    before / after: مفتاح (timestamp, id) من decode_cursor.
+    يرجع قائمة tuples: (timestamp, id, *columns) مرتبة من الأحدث للأقدم.
+    """
+    limit = max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+    newer = after is not None and before is None
+    key = after if newer else before
+
+    rows = SensorReading.objects.filter(device_id=device_id)
+    if key is not None:
+        timestamp, reading_id = key
+        # شرط المدى (timestamp__gte/lte) مع الـ OR حتى يُستخدم الـ index بـ device_id و timestamp معاً
+        # (بدونه يُستخدم device_id فقط ويُفحص الـ index من أوله، فتزيد التكلفة مع عمق الصفحة)
+        if newer:
+            rows = rows.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=reading_id),
+                timestamp__gte=timestamp,
+            )
+        else:
+            rows = rows.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=reading_id),
+                timestamp__lte=timestamp,
+            )
+    order = ('timestamp', 'id') if newer else ('-timestamp', '-id')
+    page = list(rows.order_by(*order).values_list('timestamp', 'id', *columns)[:limit])
+
+    # القراءات المضغوطة أقدم من الصفوف عادةً: نكمل منها فقط إذا لم تكتمل الصفحة
+    # (أو في اتجاه newer حيث قد تسبق الصفوف)
+    if len(page) < limit or newer:
+        page.extend(_chunk_page(device_id, columns, limit, key, newer))
+        page.sort(key=lambda row: (row[0], row[1]), reverse=not newer)
+        page = page[:limit]
+
+    if newer:
+        page.reverse()
+    return page
+
+
+def _chunk_page(device_id, columns, limit, key, newer):
+    """حتى limit قراءة من الـ chunks بعد/قبل المفتاح (بنفس شكل readings_page)"""
+    chunks = SensorChunk.objects.filter(device_id=device_id)
+    if newer:
+        if key is not None:
+            chunks = chunks.filter(end_time__gte=key[0])
+        chunks = chunks.order_by('start_time')
+    else:
+        if key is not None:
+            chunks = chunks.filter(start_time__lte=key[0])
+        chunks = chunks.order_by('-start_time')
+
+    page = []
+    for chunk in chunks.iterator(chunk_size=10):
+        samples = list(enumerate(unpack_chunk(chunk), start=-chunk.sample_count))
+        if not newer:
+            samples.reverse()
+        for ordinal, sample in samples:
+            sample_key = (sample.timestamp, ordinal)
+            if key is not None and (sample_key <= key if newer else sample_key >= key):
+                continue
+            page.append((sample.timestamp, ordinal, *(getattr(sample, column) for column in columns)))
+        if len(page) >= limit:
+            break
+    return page
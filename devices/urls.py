@@ -16,6 +16,8 @@ urlpatterns = [
     # Device Management API
     # ==============================================
     path('api/test-connection/', views.test_device_connection, name='test_connection'),
+    path('api/devices/probe/', views.probe_devices_api, name='probe_devices'),
+    path('api/devices/discovered/', views.discovered_devices_api, name='discovered_devices'),
     path('api/save-device/', views.save_device_config, name='save_device'),
     path('api/delete-device/<str:device_id>/', views.delete_device, name='delete_device'),
     
@@ -29,11 +31,15 @@ urlpatterns = [
     path('api/device/<str:device_id>/network-info/', views.get_network_info_api, name='network_info'),
     path('api/device/<str:device_id>/reset-wifi/', views.reset_wifi_api, name='reset_wifi'),
     path('api/device/<str:device_id>/ping/', views.ping_device_api, name='ping_device'),
+    path('api/devices/command/', views.bulk_command_api, name='bulk_command'),
     
     # ==============================================
     # Data & Statistics API
     # ==============================================
     path('api/device/<str:device_id>/status/', views.get_device_status_api, name='device_status'),
     path('api/device/<str:device_id>/readings/', views.get_latest_readings_api, name='latest_readings'),
+    path('api/device/<str:device_id>/rollups/', views.get_readings_rollup_api, name='readings_rollup'),
+    path('api/device/<str:device_id>/export/', views.export_readings_api, name='export_readings'),
     path('api/device/<str:device_id>/stats/', views.get_session_stats_api, name='session_stats'),
+    path('api/ingest/stats/', views.get_ingest_stats_api, name='ingest_stats'),
 ]
\ No newline at end of file
@@ -1,19 +1,42 @@
 
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db.models import Count, Avg, Max, Min
+from django.utils.dateparse import parse_datetime
+from django.db.models import Exists, OuterRef, Subquery
 from datetime import timedelta
 import json
-import socket
-import subprocess
+import ipaddress
 import asyncio
-from asgiref.sync import async_to_sync
-
-from .models import DeviceConfig, DeviceStatus, SensorReading, Session
-from .consumers import BaskyDeviceConsumer
+from asgiref.sync import sync_to_async
+
+from .models import SENSOR_FIELDS, DeviceConfig, DeviceStatus, SensorReading, Session
+from .consumers import BaskyDeviceConsumer, command_timeout
+from .decorators import async_csrf_exempt, async_login_required
+from .discovery import discovery, get_server_ip
+from .export import EXPORT_FORMATS, FORMAT_CSV, async_export, encode_pieces, export_lines, iter_rows
+from .ingest import ingest_queue
+from .probe import PROBE_PORTS, check_http_path, device_ports, probe, probe_many
+from .rollups import RESOLUTIONS, rollup_series
+from .state import device_state
+from .stats import session_stats
+from .summary import get_device_summary
+from .timeseries import (
+    FIELD_GROUPS, PAGE_SIZE, decode_cursor, encode_cursor, latest_readings,
+    readings_page, resolve_fields,
+)
+
+# الأوامر المسموحة في API الأوامر الجماعية، وحدود الطلب
+BULK_COMMANDS = ('start_session', 'stop_session', 'calibrate', 'ping', 'get_network_info')
+BULK_MAX_DEVICES = getattr(settings, 'BASKY_BULK_MAX_DEVICES', 100)
+BULK_CONCURRENCY = getattr(settings, 'BASKY_BULK_CONCURRENCY', 20)
+
+# أسماء الأعمدة في استجابة API القراءات
+READING_KEYS = {'force_value': 'force', 'exercise_type': 'exercise', 'session_id': 'session'}
 
 
 # ==============================================
@@ -23,10 +46,16 @@ from .consumers import BaskyDeviceConsumer
 @login_required
 def device_setup_page(request):
     """صفحة إعداد الجهاز"""
+    discovered = discovery.discovered()
+    registered = set(DeviceConfig.objects.filter(
+        device_id__in=[entry['device_id'] for entry in discovered]
+    ).values_list('device_id', flat=True))
     context = {
         'server_ip': get_server_ip(),
         'ws_port': 8080,
         'devices': DeviceConfig.objects.filter(user=request.user),
+        # أجهزة أعلنت عن نفسها على الشبكة ولم تُضف بعد
+        'discovered_devices': [entry for entry in discovered if entry['device_id'] not in registered],
     }
     return render(request, 'device_setup.html', context)
 
@@ -34,57 +63,84 @@ def device_setup_page(request):
 @login_required
 def device_list_page(request):
     """صفحة قائمة الأجهزة"""
-    devices = DeviceConfig.objects.filter(user=request.user)
-    connected_devices = BaskyDeviceConsumer.get_connected_devices()
-    
-    # إضافة حالة الاتصال لكل جهاز
-    for device in devices:
-        device.is_connected = device.device_id in connected_devices
-        if device.is_connected:
-            device.connection_info = connected_devices[device.device_id]
+    devices = get_device_list(request.user)
     
     context = {
         'devices': devices,
-        'total_devices': devices.count(),
+        'total_devices': len(devices),
         'connected_count': len([d for d in devices if d.is_connected]),
     }
     return render(request, 'device_list.html', context)
 
 
+def get_device_list(user):
+    """
+    أجهزة المستخدم في استعلام واحد (آخر حالة، آخر قراءة، وجود جلسة نشطة)
+    مع بيانات الاتصال من الـ registry
+    """
+    latest_status = DeviceStatus.objects.filter(
+        device_id=OuterRef('device_id')
+    ).order_by('-timestamp', '-id')
+    
+    devices = list(DeviceConfig.objects.filter(user=user).annotate(
+        last_status=Subquery(latest_status.values('status')[:1]),
+        last_status_at=Subquery(latest_status.values('timestamp')[:1]),
+        last_reading_at=Subquery(
+            SensorReading.objects.filter(
+                device_id=OuterRef('device_id')
+            ).order_by('-timestamp').values('timestamp')[:1]
+        ),
+        has_active_session=Exists(
+            Session.objects.filter(device=OuterRef('pk'), is_active=True)
+        ),
+    ))
+    
+    connected_devices = BaskyDeviceConsumer.get_connected_devices(
+        [device.device_id for device in devices]
+    )
+    
+    # إضافة حالة الاتصال لكل جهاز
+    for device in devices:
+        device.is_connected = device.device_id in connected_devices
+        device.connection_info = connected_devices.get(device.device_id, {})
+        device.last_seen = device.connection_info.get('last_seen') or device.last_status_at
+    
+    return devices
+
+
 @login_required
 def device_dashboard(request, device_id):
     """Dashboard للجهاز"""
     device = get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
-    connected_devices = BaskyDeviceConsumer.get_connected_devices()
+    connected_devices = BaskyDeviceConsumer.get_connected_devices([device_id])
     
     # معلومات الاتصال
     is_connected = device_id in connected_devices
     connection_info = connected_devices.get(device_id, {})
     
-    # آخر قراءات
-    latest_readings = SensorReading.objects.filter(
-        device_id=device_id
-    ).order_by('-timestamp')[:20]
+    # آخر قراءات (من الصفوف أو الـ chunks المضغوطة)
+    readings = latest_readings(device_id, 20)
     
     # الجلسات الأخيرة
     recent_sessions = Session.objects.filter(
         device=device
     ).order_by('-start_time')[:10]
     
-    # إحصائيات
+    # إحصائيات (من DeviceSummary بدلاً من COUNT على القراءات والجلسات)
+    summary = get_device_summary(device_id)
     stats = {
-        'total_sessions': Session.objects.filter(device=device).count(),
-        'total_readings': SensorReading.objects.filter(device_id=device_id).count(),
-        'avg_session_duration': Session.objects.filter(device=device).aggregate(
-            Avg('duration')
-        )['duration__avg'] or 0,
+        'total_sessions': summary.total_sessions,
+        'total_readings': summary.total_readings,
+        'avg_session_duration': summary.avg_session_duration,
+        'last_reading_at': summary.last_reading_at,
+        'last_status': summary.last_status,
     }
     
     context = {
         'device': device,
         'is_connected': is_connected,
         'connection_info': connection_info,
-        'latest_readings': latest_readings,
+        'latest_readings': readings,
         'recent_sessions': recent_sessions,
         'stats': stats,
     }
@@ -95,40 +151,60 @@ def device_dashboard(request, device_id):
 # API Endpoints - Device Management
 # ==============================================
 
-@csrf_exempt
-@login_required
-def test_device_connection(request):
-    """اختبار اتصال الجهاز"""
+@async_csrf_exempt
+@async_login_required
+async def test_device_connection(request):
+    """اختبار اتصال الجهاز (فحص منفذ الـ WebSocket أو الـ HTTP بدون ping)"""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             device_ip = data.get('device_ip')
             
-            # محاولة ping
-            result = subprocess.run(
-                ['ping', '-c', '1', '-W', '2', device_ip],
-                capture_output=True,
-                text=True,
-                timeout=3
+            try:
+                ipaddress.ip_address(device_ip)
+            except ValueError:
+                return JsonResponse({
+                    'success': False,
+                    'message': '✗ عنوان IP غير صالح'
+                })
+            
+            http_path = data.get('http_path')
+            if http_path:
+                try:
+                    check_http_path(http_path)
+                except ValueError:
+                    return JsonResponse({
+                        'success': False,
+                        'message': '✗ مسار HTTP غير صالح'
+                    }, status=400)
+            
+            ports = [int(data['ws_port'])] if data.get('ws_port') else []
+            result = await probe(
+                device_ip,
+                ports=[*ports, *PROBE_PORTS],
+                http_path=http_path,
+                use_cache=not data.get('refresh'),
             )
             
-            if result.returncode == 0:
+            if result['reachable']:
                 return JsonResponse({
                     'success': True,
                     'message': f'✓ الجهاز متصل! ({device_ip})',
                     'device_ip': device_ip,
-                    'latency': extract_ping_time(result.stdout)
+                    'port': result['port'],
+                    'latency': result['latency_ms'],
+                    'cached': result['cached']
+                })
+            elif result['error'] == 'timeout':
+                return JsonResponse({
+                    'success': False,
+                    'message': '✗ انتهى وقت الانتظار. الجهاز غير متصل.'
                 })
             else:
                 return JsonResponse({
                     'success': False,
                     'message': '✗ لا يمكن الوصول للجهاز. تأكد من الاتصال بنفس الشبكة.'
                 })
-        except subprocess.TimeoutExpired:
-            return JsonResponse({
-                'success': False,
-                'message': '✗ انتهى وقت الانتظار. الجهاز غير متصل.'
-            })
         except Exception as e:
             return JsonResponse({
                 'success': False,
@@ -138,6 +214,61 @@ def test_device_connection(request):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
+@async_login_required
+async def probe_devices_api(request):
+    """فحص الوصول لكل أجهزة المستخدم في نفس الوقت (?refresh=1 بدون cache)"""
+    try:
+        devices = [
+            device async for device in DeviceConfig.objects.filter(
+                user=request.user, device_ip__isnull=False
+            ).only('device_id', 'device_ip', 'ws_port')
+        ]
+        results = await probe_many(
+            {device.device_id: (device.device_ip, device_ports(device)) for device in devices},
+            use_cache=request.GET.get('refresh') not in ('1', 'true'),
+        )
+        
+        return JsonResponse({
+            'success': True,
+            'reachable': sum(1 for result in results.values() if result['reachable']),
+            'total': len(results),
+            'devices': [
+                {'device_id': device_id, **result} for device_id, result in results.items()
+            ],
+        })
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        })
+
+
+@async_login_required
+async def discovered_devices_api(request):
+    """الأجهزة المكتشفة على الشبكة المحلية (من جدول الـ DiscoveryService)"""
+    try:
+        entries = await discovery.adiscovered()
+        registered = {
+            device_id async for device_id in DeviceConfig.objects.filter(
+                device_id__in=[entry['device_id'] for entry in entries]
+            ).values_list('device_id', flat=True)
+        }
+        
+        return JsonResponse({
+            'success': True,
+            'server_ip': get_server_ip(),
+            'devices': [
+                {**entry, 'registered': entry['device_id'] in registered}
+                for entry in sorted(entries, key=lambda entry: entry['first_seen'])
+            ],
+        })
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        })
+
+
 @csrf_exempt
 @login_required
 def save_device_config(request):
@@ -150,8 +281,27 @@ def save_device_config(request):
             device_ip = data.get('device_ip')
             ws_port = data.get('ws_port', 8080)
             
-            # إنشاء device_id فريد
-            device_id = f"basky_{device_ip.replace('.', '_')}"
+            if data.get('device_id'):
+                # device_id من جدول الاكتشاف فقط (لا يُقبل أي id يرسله العميل)
+                discovered = {entry['device_id']: entry for entry in discovery.discovered()}
+                entry = discovered.get(data['device_id'])
+                if entry is None:
+                    return JsonResponse({
+                        'success': False,
+                        'message': 'الجهاز غير موجود في الأجهزة المكتشفة'
+                    }, status=400)
+                device_id = entry['device_id']
+                device_ip = device_ip or entry['ip']
+            else:
+                # إنشاء device_id فريد من الـ IP
+                device_id = f"basky_{device_ip.replace('.', '_')}"
+            
+            # جهاز مسجل لمستخدم آخر لا يُنقل
+            if DeviceConfig.objects.filter(device_id=device_id).exclude(user=request.user).exclude(user=None).exists():
+                return JsonResponse({
+                    'success': False,
+                    'message': 'الجهاز مسجل لمستخدم آخر'
+                }, status=403)
             
             # حفظ أو تحديث
             device, created = DeviceConfig.objects.update_or_create(
@@ -210,18 +360,41 @@ def delete_device(request, device_id):
 # API Endpoints - Device Control
 # ==============================================
 
-@csrf_exempt
-@login_required
-def start_session_api(request, device_id):
+# Async views: تنتظر الـ consumer مباشرة على نفس الـ event loop (daphne)
+# بدلاً من sync view → thread pool → async_to_sync → event loop جديد
+#
+# مع ?wait=1 ينتظر الـ API تأكيد الجهاز نفسه (session_ack, pong ...) ويرجع
+# confirmed و latency_ms، وإلا يكفي إرسال الأمر.
+
+async def dispatch_command(request, device_id, command_type, command_data):
+    """إرسال أمر للجهاز (وانتظار تأكيده مع ?wait=1): يرجع (success, بيانات التأكيد)"""
+    if request.GET.get('wait') not in ('1', 'true'):
+        return await BaskyDeviceConsumer.send_command_to_device(device_id, command_type, command_data), {}
+    
+    result = await BaskyDeviceConsumer.request_device(device_id, command_type, command_data)
+    confirmation = {
+        'command_id': result['id'],
+        'command_status': result['status'],
+        'confirmed': result['status'] == 'ok',
+        'latency_ms': result.get('latency_ms'),
+    }
+    if result['status'] == 'timeout':
+        confirmation['message'] = 'لم يصل تأكيد من الجهاز'
+    return result['status'] in ('ok', 'sent'), confirmation
+
+
+@async_csrf_exempt
+@async_login_required
+async def start_session_api(request, device_id):
     """بدء جلسة علاج"""
     if request.method == 'POST':
+        # Http404 خارج الـ try حتى يصل للعميل كـ 404
+        device = await aget_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
         try:
             data = json.loads(request.body)
             
-            device = get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
-            
             # إنشاء جلسة جديدة
-            session = Session.objects.create(
+            session = await Session.objects.acreate(
                 device=device,
                 user=request.user,
                 child_name=data.get('child_name', 'طفل'),
@@ -235,24 +408,34 @@ def start_session_api(request, device_id):
                 'child_name': session.child_name,
                 'user_role': data.get('user_role', 'Parent'),
                 'difficulty': session.difficulty,
-                'exercise': session.exercise_type
+                'exercise': session.exercise_type,
+                'session_id': session.id
             }
             
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'start_session', session_data
+            success, confirmation = await dispatch_command(
+                request, device_id, 'start_session', session_data
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
                     'message': 'تم بدء الجلسة بنجاح!',
-                    'session_id': session.id
+                    'session_id': session.id,
+                    **confirmation
+                })
+            elif confirmation.get('command_status') == 'timeout':
+                # الأمر وصل للجهاز لكن لم يؤكد: قد يبدأ متأخراً فلا نحذف الجلسة
+                return JsonResponse({
+                    'success': False,
+                    'session_id': session.id,
+                    **confirmation
                 })
             else:
-                session.delete()
+                await session.adelete()
                 return JsonResponse({
                     'success': False,
-                    'message': 'الجهاز غير متصل'
+                    'message': 'الجهاز غير متصل',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -263,9 +446,9 @@ def start_session_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
-@csrf_exempt
-@login_required
-def stop_session_api(request, device_id):
+@async_csrf_exempt
+@async_login_required
+async def stop_session_api(request, device_id):
     """إيقاف جلسة علاج"""
     if request.method == 'POST':
         try:
@@ -273,25 +456,27 @@ def stop_session_api(request, device_id):
             sessions = Session.objects.filter(
                 device__device_id=device_id,
                 is_active=True
-            )
+            ).select_related('device')
             
-            for session in sessions:
-                session.end_session()
+            async for session in sessions:
+                await sync_to_async(session.end_session)()
             
             # إرسال الأمر للجهاز
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'stop_session', {}
+            success, confirmation = await dispatch_command(
+                request, device_id, 'stop_session', {}
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
-                    'message': 'تم إيقاف الجلسة بنجاح!'
+                    'message': 'تم إيقاف الجلسة بنجاح!',
+                    **confirmation
                 })
             else:
                 return JsonResponse({
                     'success': False,
-                    'message': 'الجهاز غير متصل'
+                    'message': 'الجهاز غير متصل',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -302,25 +487,27 @@ def stop_session_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
-@csrf_exempt
-@login_required
-def calibrate_device_api(request, device_id):
+@async_csrf_exempt
+@async_login_required
+async def calibrate_device_api(request, device_id):
     """معايرة الجهاز"""
     if request.method == 'POST':
         try:
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'calibrate', {}
+            success, confirmation = await dispatch_command(
+                request, device_id, 'calibrate', {}
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
-                    'message': 'تم إرسال أمر المعايرة'
+                    'message': 'تم إرسال أمر المعايرة',
+                    **confirmation
                 })
             else:
                 return JsonResponse({
                     'success': False,
-                    'message': 'الجهاز غير متصل'
+                    'message': 'الجهاز غير متصل',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -331,9 +518,9 @@ def calibrate_device_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
-@csrf_exempt
-@login_required
-def send_ai_correction_api(request, device_id):
+@async_csrf_exempt
+@async_login_required
+async def send_ai_correction_api(request, device_id):
     """إرسال تصحيح من الـ AI"""
     if request.method == 'POST':
         try:
@@ -347,19 +534,21 @@ def send_ai_correction_api(request, device_id):
                 'feedback': data.get('feedback', '')
             }
             
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'ai_correction', correction_data
+            success, confirmation = await dispatch_command(
+                request, device_id, 'ai_correction', correction_data
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
-                    'message': 'تم إرسال التصحيح'
+                    'message': 'تم إرسال التصحيح',
+                    **confirmation
                 })
             else:
                 return JsonResponse({
                     'success': False,
-                    'message': 'الجهاز غير متصل'
+                    'message': 'الجهاز غير متصل',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -370,25 +559,27 @@ def send_ai_correction_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
-@csrf_exempt
-@login_required
-def get_network_info_api(request, device_id):
+@async_csrf_exempt
+@async_login_required
+async def get_network_info_api(request, device_id):
     """طلب معلومات الشبكة"""
     if request.method == 'POST':
         try:
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'get_network_info', {}
+            success, confirmation = await dispatch_command(
+                request, device_id, 'get_network_info', {}
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
-                    'message': 'تم إرسال الطلب'
+                    'message': 'تم إرسال الطلب',
+                    **confirmation
                 })
             else:
                 return JsonResponse({
                     'success': False,
-                    'message': 'الجهاز غير متصل'
+                    'message': 'الجهاز غير متصل',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -399,25 +590,27 @@ def get_network_info_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
-@csrf_exempt
-@login_required
-def reset_wifi_api(request, device_id):
+@async_csrf_exempt
+@async_login_required
+async def reset_wifi_api(request, device_id):
     """إعادة ضبط WiFi"""
     if request.method == 'POST':
         try:
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'reset_wifi', {}
+            success, confirmation = await dispatch_command(
+                request, device_id, 'reset_wifi', {}
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
-                    'message': 'تم إرسال أمر إعادة الضبط. الجهاز سيعيد التشغيل.'
+                    'message': 'تم إرسال أمر إعادة الضبط. الجهاز سيعيد التشغيل.',
+                    **confirmation
                 })
             else:
                 return JsonResponse({
                     'success': False,
-                    'message': 'الجهاز غير متصل'
+                    'message': 'الجهاز غير متصل',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -428,25 +621,27 @@ def reset_wifi_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
-@csrf_exempt
-@login_required
-def ping_device_api(request, device_id):
+@async_csrf_exempt
+@async_login_required
+async def ping_device_api(request, device_id):
     """Ping الجهاز"""
     if request.method == 'POST':
         try:
-            success = async_to_sync(BaskyDeviceConsumer.send_command_to_device)(
-                device_id, 'ping', {}
+            success, confirmation = await dispatch_command(
+                request, device_id, 'ping', {}
             )
             
             if success:
                 return JsonResponse({
                     'success': True,
-                    'message': 'Ping sent'
+                    'message': 'Ping sent',
+                    **confirmation
                 })
             else:
                 return JsonResponse({
                     'success': False,
-                    'message': 'Device offline'
+                    'message': 'Device offline',
+                    **confirmation
                 })
         except Exception as e:
             return JsonResponse({
@@ -457,6 +652,110 @@ def ping_device_api(request, device_id):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
+@async_csrf_exempt
+@async_login_required
+async def bulk_command_api(request):
+    """
+    أمر واحد لعدة أجهزة في نفس الوقت
+    {"device_ids": [...], "command": "calibrate", "data": {...}, "timeout": 5}
+    يرجع نتيجة لكل جهاز: ok | sent | timeout | offline | not_found | error
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request'})
+    
+    try:
+        data = json.loads(request.body)
+        device_ids = list(dict.fromkeys(data.get('device_ids') or []))
+        command_type = data.get('command')
+        command_data = data.get('data') or {}
+        
+        if command_type not in BULK_COMMANDS:
+            return JsonResponse({'success': False, 'message': f'أمر غير مدعوم: {command_type}'}, status=400)
+        if not device_ids or len(device_ids) > BULK_MAX_DEVICES:
+            return JsonResponse({
+                'success': False,
+                'message': f'عدد الأجهزة يجب أن يكون بين 1 و {BULK_MAX_DEVICES}'
+            }, status=400)
+        try:
+            timeout = command_timeout(data.get('timeout'))
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'مهلة غير صالحة'}, status=400)
+        
+        # أجهزة المستخدم فقط (استعلام واحد)
+        devices = {
+            device.device_id: device
+            async for device in DeviceConfig.objects.filter(user=request.user, device_id__in=device_ids)
+        }
+        
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+        
+        async def run_one(device_id):
+            device = devices.get(device_id)
+            if device is None:
+                return {'device_id': device_id, 'status': 'not_found'}
+            
+            async with semaphore:
+                try:
+                    session = None
+                    payload = command_data
+                    if command_type == 'start_session':
+                        session = await Session.objects.acreate(
+                            device=device,
+                            user=request.user,
+                            child_name=command_data.get('child_name', 'طفل'),
+                            exercise_type=command_data.get('exercise', 'Stretching'),
+                            difficulty=command_data.get('difficulty', 'medium'),
+                            is_active=True
+                        )
+                        payload = {
+                            'child_name': session.child_name,
+                            'user_role': command_data.get('user_role', 'Parent'),
+                            'difficulty': session.difficulty,
+                            'exercise': session.exercise_type,
+                            'session_id': session.id
+                        }
+                    elif command_type == 'stop_session':
+                        async for active in Session.objects.filter(device=device, is_active=True):
+                            active.device = device
+                            await sync_to_async(active.end_session)()
+                    
+                    result = await BaskyDeviceConsumer.request_device(
+                        device_id, command_type, payload, timeout=timeout
+                    )
+                    
+                    # الأمر لم يُرسل: الجلسة لم تبدأ
+                    if session is not None and result['status'] == 'offline':
+                        await session.adelete()
+                        session = None
+                except Exception as e:
+                    return {'device_id': device_id, 'status': 'error', 'message': str(e)}
+            
+            outcome = {
+                'device_id': device_id,
+                'status': result['status'],
+                'command_id': result['id'],
+                'latency_ms': result.get('latency_ms'),
+            }
+            if session is not None:
+                outcome['session_id'] = session.id
+            return outcome
+        
+        results = await asyncio.gather(*(run_one(device_id) for device_id in device_ids))
+        
+        return JsonResponse({
+            'success': True,
+            'command': command_type,
+            'delivered': sum(1 for r in results if r['status'] in ('ok', 'sent')),
+            'total': len(results),
+            'results': results,
+        })
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        })
+
+
 # ==============================================
 # API Endpoints - Data & Statistics
 # ==============================================
@@ -466,15 +765,13 @@ def get_device_status_api(request, device_id):
     """الحصول على حالة الجهاز"""
     try:
         device = get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
-        connected_devices = BaskyDeviceConsumer.get_connected_devices()
+        connected_devices = BaskyDeviceConsumer.get_connected_devices([device_id])
         
         is_connected = device_id in connected_devices
         connection_info = connected_devices.get(device_id, {})
         
-        # آخر حالة
-        last_status = DeviceStatus.objects.filter(
-            device_id=device_id
-        ).first()
+        # آخر حالة (من الـ cache أو صف DeviceLatestState، بدون جدول DeviceStatus)
+        state = device_state.get(device_id)
         
         return JsonResponse({
             'success': True,
@@ -483,10 +780,12 @@ def get_device_status_api(request, device_id):
             'is_connected': is_connected,
             'connection_info': connection_info,
             'last_status': {
-                'status': last_status.status if last_status else 'unknown',
-                'message': last_status.message if last_status else '',
-                'timestamp': last_status.timestamp.isoformat() if last_status else None
-            } if last_status else None
+                'status': state.get('status') or 'unknown',
+                'message': state.get('message', ''),
+                'timestamp': state['status_at'].isoformat() if state.get('status_at') else None,
+                'last_seen': state['last_seen'].isoformat() if state.get('last_seen') else None,
+                'network': state.get('network') or {},
+            } if state else None
         })
     except Exception as e:
         return JsonResponse({
@@ -497,40 +796,54 @@ def get_device_status_api(request, device_id):
 
 @login_required
 def get_latest_readings_api(request, device_id):
-    """الحصول على آخر القراءات"""
+    """
+    القراءات بالصفحات (الأحدث أولاً)
+    ?limit=N&fields=shoulder,force&before=<cursor> أو &after=<cursor>
+    """
     try:
-        limit = int(request.GET.get('limit', 20))
+        try:
+            limit = int(request.GET.get('limit', PAGE_SIZE))
+            before = request.GET.get('before')
+            after = request.GET.get('after')
+            before = decode_cursor(before) if before else None
+            after = decode_cursor(after) if after else None
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'قيمة limit أو cursor غير صالحة'})
         
-        readings = SensorReading.objects.filter(
-            device_id=device_id
-        ).order_by('-timestamp')[:limit]
+        names = [name for name in request.GET.get('fields', '').split(',') if name]
+        try:
+            columns = resolve_fields(names)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'message': f'حقل غير معروف: {e}'})
+        
+        page = readings_page(device_id, columns, limit=limit, before=before, after=after)
         
-        data = [{
-            'timestamp': r.timestamp.isoformat(),
-            'shoulder': {
-                'pitch': r.shoulder_pitch,
-                'roll': r.shoulder_roll,
-                'yaw': r.shoulder_yaw
-            },
-            'elbow': {
-                'pitch': r.elbow_pitch,
-                'roll': r.elbow_roll,
-                'yaw': r.elbow_yaw
-            },
-            'wrist': {
-                'pitch': r.wrist_pitch,
-                'roll': r.wrist_roll,
-                'yaw': r.wrist_yaw
-            },
-            'force': r.force_value,
-            'exercise': r.exercise_type,
-            'mode': r.mode
-        } for r in readings]
+        # تجميع الأعمدة حسب المجموعة (shoulder: {pitch, roll, yaw}) مرة واحدة للصفحة
+        layout = []
+        for index, column in enumerate(columns, start=2):
+            joint, _, axis = column.partition('_')
+            if column in SENSOR_FIELDS and joint != 'force':
+                layout.append((joint, axis, index))
+            else:
+                layout.append((READING_KEYS.get(column, column), None, index))
+        
+        data = []
+        for row in page:
+            item = {'timestamp': row[0].isoformat()}
+            for name, axis, index in layout:
+                if axis is None:
+                    item[name] = row[index]
+                else:
+                    item.setdefault(name, {})[axis] = row[index]
+            data.append(item)
         
         return JsonResponse({
             'success': True,
             'count': len(data),
-            'readings': data
+            'readings': data,
+            # next: صفحة أقدم، prev: صفحة أحدث
+            'next': encode_cursor(page[-1][0], page[-1][1]) if page else None,
+            'prev': encode_cursor(page[0][0], page[0][1]) if page else None,
         })
     except Exception as e:
         return JsonResponse({
@@ -540,42 +853,108 @@ def get_latest_readings_api(request, device_id):
 
 
 @login_required
-def get_session_stats_api(request, device_id):
-    """الحصول على إحصائيات الجلسات"""
+def export_readings_api(request, device_id):
+    """
+    تصدير القراءات كـ stream
+    ?session=<id> أو ?start=&end= ، ?format=csv|ndjson ، ?fields= ، ?compress=gzip
+    """
+    device = get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
+    
+    export_format = request.GET.get('format', FORMAT_CSV)
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'success': False, 'message': f'صيغة غير مدعومة: {export_format}'}, status=400)
+    
+    names = [name for name in request.GET.get('fields', '').split(',') if name]
     try:
-        device = get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
-        
-        # إحصائيات عامة
-        total_sessions = Session.objects.filter(device=device).count()
-        
-        completed_sessions = Session.objects.filter(
-            device=device,
-            is_active=False
-        )
-        
-        avg_duration = completed_sessions.aggregate(Avg('duration'))['duration__avg'] or 0
-        max_duration = completed_sessions.aggregate(Max('duration'))['duration__max'] or 0
+        columns = resolve_fields(names or list(FIELD_GROUPS))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'حقل غير معروف: {e}'}, status=400)
+    
+    session = None
+    if request.GET.get('session'):
+        try:
+            session_id = int(request.GET['session'])
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'رقم الجلسة غير صالح'}, status=400)
+        session = get_object_or_404(Session, pk=session_id, device=device)
+    bounds = {}
+    for name in ('start', 'end'):
+        value = request.GET.get(name)
+        try:
+            # parse_datetime ترجع None للنص غير المطابق و ValueError للتاريخ المستحيل
+            bounds[name] = parse_datetime(value) if value else None
+        except ValueError:
+            bounds[name] = None
+        if value and bounds[name] is None:
+            return JsonResponse({'success': False, 'message': f'تاريخ غير صالح: {name}'}, status=400)
+    start, end = bounds['start'], bounds['end']
+    if session is None and start is None and end is None:
+        return JsonResponse({'success': False, 'message': 'حدد الجلسة أو المدى الزمني'}, status=400)
+    
+    gzip = request.GET.get('compress') == 'gzip'
+    pieces = encode_pieces(
+        export_lines(export_format, iter_rows(device_id, columns, session, start, end), columns),
+        gzip=gzip
+    )
+    
+    # تحت daphne نرسل async generator حتى لا يُقرأ التصدير كاملاً في الذاكرة
+    if isinstance(request, ASGIRequest):
+        pieces = async_export(pieces)
+    
+    filename = f"{device_id}_{f'session{session.pk}' if session else 'readings'}.{export_format}"
+    if gzip:
+        response = StreamingHttpResponse(pieces, content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(pieces, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def get_readings_rollup_api(request, device_id):
+    """ملخص القراءات (min/max/mean لكل ثانية أو دقيقة) لمدى زمني"""
+    get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
+    
+    resolution = request.GET.get('resolution')
+    if resolution:
+        if not resolution.isdigit() or int(resolution) not in RESOLUTIONS:
+            return JsonResponse({'success': False, 'message': f'دقة غير مدعومة: {resolution}'}, status=400)
+        resolution = int(resolution)
+    
+    try:
+        end = parse_datetime(request.GET.get('end', '')) or timezone.now()
+        start = parse_datetime(request.GET.get('start', '')) or end - timedelta(hours=1)
         
-        # إحصائيات حسب نوع التمرين
-        exercise_stats = completed_sessions.values('exercise_type').annotate(
-            count=Count('id'),
-            avg_duration=Avg('duration')
+        series, resolution = rollup_series(
+            device_id, start, end,
+            resolution=resolution or None,
+            exercise_type=request.GET.get('exercise')
         )
         
-        # إحصائيات حسب الصعوبة
-        difficulty_stats = completed_sessions.values('difficulty').annotate(
-            count=Count('id'),
-            avg_duration=Avg('duration')
-        )
+        return JsonResponse({
+            'success': True,
+            'resolution': resolution,
+            'count': len(series),
+            'buckets': series
+        })
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        })
+
+
+@login_required
+def get_session_stats_api(request, device_id):
+    """الحصول على إحصائيات الجلسات"""
+    try:
+        device = get_object_or_404(DeviceConfig, device_id=device_id, user=request.user)
         
+        # استعلام واحد، ومن الـ cache حتى تتغير جلسات الجهاز
         return JsonResponse({
             'success': True,
-            'total_sessions': total_sessions,
-            'completed_sessions': completed_sessions.count(),
-            'avg_duration': round(avg_duration, 2),
-            'max_duration': max_duration,
-            'exercise_stats': list(exercise_stats),
-            'difficulty_stats': list(difficulty_stats)
+            **session_stats(device.pk)
         })
     except Exception as e:
         return JsonResponse({
@@ -584,29 +963,23 @@ def get_session_stats_api(request, device_id):
         })
 
 
+@login_required
+def get_ingest_stats_api(request):
+    """إحصائيات طابور كتابة القراءات (لهذه العملية)"""
+    return JsonResponse({
+        'success': True,
+        **ingest_queue.stats()
+    })
+
+
 # ==============================================
 # Utility Functions
 # ==============================================
 
-def get_server_ip():
-    """الحصول على IP الخاص بالسيرفر"""
+async def aget_object_or_404(model, **kwargs):
+    """get_object_or_404 بالـ async ORM"""
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "127.0.0.1"
+        return await model.objects.aget(**kwargs)
+    except model.DoesNotExist:
+        raise Http404(f"No {model._meta.object_name} matches the given query.")
 
-
-def extract_ping_time(ping_output):
-    """استخراج وقت الـ ping من النتيجة"""
-    try:
-        import re
-        match = re.search(r'time=(\d+\.?\d*)', ping_output)
-        if match:
-            return float(match.group(1))
-    except:
-        pass
-    return None
\ No newline at end of file